@@ -11,7 +11,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# Not when run from the app, which has its own logging configuration
+if config.config_file_name is not None and config.attributes.get('configure_logger', True):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -19,7 +20,9 @@ if config.config_file_name is not None:
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from app.db.models import Base
+from app.core.config import Config as AppConfig
 target_metadata = Base.metadata
+config.set_main_option('sqlalchemy.url', AppConfig.get_config().database_url)
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -27,6 +30,13 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # SQLite expression indexes can't be reflected, so autogenerate can't compare them
+    if type_ == 'index' and name.endswith('_nocase'):
+        return False
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -66,10 +76,15 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        # Like the app's connections (app.db.database): a new database is
+        # created with incremental auto vacuum, before the first table
+        connection.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+        connection.commit()
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
-            compare_type=True
+            compare_type=True,
+            include_object=include_object
         )
 
         with context.begin_transaction():
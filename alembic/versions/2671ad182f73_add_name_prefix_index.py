@@ -0,0 +1,33 @@
+"""Add name prefix index
+
+Revision ID: 2671ad182f73
+Revises: 569a42383149
+Create Date: 2026-10-19 14:58:11.683489+02:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2671ad182f73'
+down_revision: Union[str, None] = '569a42383149'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('components', 'epic_groups', 'persons', 'products')
+
+
+def upgrade() -> None:
+    # Expression indexes are not autogenerated on SQLite
+    for table in TABLES:
+        op.create_index(f'ix_{table}_name_nocase', table, [sa.text('name COLLATE NOCASE')],
+                        unique=False)
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_name_nocase', table_name=table)
@@ -0,0 +1,54 @@
+"""Add story timestamp columns
+
+Revision ID: e51e504cad98
+Revises: f9bfc8a119f1
+Create Date: 2026-10-19 16:02:15.472495+02:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e51e504cad98'
+down_revision: Union[str, None] = 'f9bfc8a119f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# SQLAlchemy's storage format for DateTime in SQLite, which sorts chronologically
+TO_DATETIME = "strftime('%Y-%m-%d %H:%M:%f', {0}) || '000'"
+TO_ISO = "strftime('%Y-%m-%dT%H:%M:%SZ', {0})"
+
+
+def _convert(table: str, expression: str, type_):
+    op.execute(f'UPDATE {table} SET created = {expression.format("created")}, '
+               f'updated = {expression.format("updated")}')
+    # Recreated with the new types given as reflected ones: altering the types
+    # would copy the values with CAST, which turns these strings into numbers
+    with op.batch_alter_table(table, recreate='always', reflect_args=[
+            sa.Column('created', type_, nullable=False),
+            sa.Column('updated', type_, nullable=False)]):
+        pass
+
+
+def upgrade() -> None:
+    # Staged stories are refetched rather than converted
+    op.execute('DELETE FROM staging_stories')
+    op.execute('DELETE FROM staging_story_custom_fields')
+    op.execute('DELETE FROM staging_story_labels')
+    op.execute('DELETE FROM import_checkpoints')
+    # Shortcut's ISO 8601 timestamps, e.g. 2024-05-02T08:30:00Z, parsed as UTC by strftime
+    _convert('stories', TO_DATETIME, sa.DateTime())
+    _convert('staging_stories', TO_DATETIME, sa.DateTime())
+    op.create_index(op.f('ix_stories_created'), 'stories', ['created'], unique=False)
+    op.create_index(op.f('ix_stories_updated'), 'stories', ['updated'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_stories_updated'), table_name='stories')
+    op.drop_index(op.f('ix_stories_created'), table_name='stories')
+    _convert('stories', TO_ISO, sa.VARCHAR())
+    _convert('staging_stories', TO_ISO, sa.VARCHAR())
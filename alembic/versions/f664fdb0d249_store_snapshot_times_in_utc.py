@@ -0,0 +1,31 @@
+"""Store snapshot times in UTC
+
+Revision ID: f664fdb0d249
+Revises: 4f6eff8ad9de
+Create Date: 2026-10-19 16:23:58.946190+02:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f664fdb0d249'
+down_revision: Union[str, None] = '4f6eff8ad9de'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Snapshots were taken in the server's local time, which SQLite's 'utc' and
+# 'localtime' modifiers convert from and to; kept in SQLAlchemy's DateTime format
+CONVERT = "UPDATE snapshots " \
+          "SET taken_at = strftime('%Y-%m-%d %H:%M:%f', taken_at, '{0}') || '000'"
+
+
+def upgrade() -> None:
+    op.execute(CONVERT.format('utc'))
+
+
+def downgrade() -> None:
+    op.execute(CONVERT.format('localtime'))
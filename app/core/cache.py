@@ -0,0 +1,140 @@
+"""
+Caches for values derived from the database.
+"""
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Awaitable, Optional
+
+from app.core import metrics
+from app.core.coalesce import Coalescer
+from app.core.config import Config
+
+
+class GenerationCache(object):
+    """
+    LRU cache whose entries are only valid for the data generation they were
+    computed in. `generation` returns the current generation; when it changes
+    every entry is dropped.
+    """
+
+    def __init__(self, name: str, generation: Callable[[], int], maxsize: int = 128):
+        self.name = name
+        self.generation = generation
+        self.maxsize = maxsize
+        self._generation = None
+        self._entries = OrderedDict()
+
+    def _sync(self):
+        current = self.generation()
+        if current != self._generation:
+            self._entries.clear()
+            self._generation = current
+
+    def get(self, key: Hashable, default=None):
+        self._sync()
+        try:
+            value = self._entries[key]
+        except KeyError:
+            metrics.record_cache(self.name, False)
+            return default
+        self._entries.move_to_end(key)
+        metrics.record_cache(self.name, True)
+        return value
+
+    def set(self, key: Hashable, value, generation=None):
+        """Store value, unless it was computed in an older `generation` than the current."""
+        self._sync()
+        if generation is not None and generation != self._generation:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TTLCache(object):
+    """
+    LRU cache whose entries expire after `ttl` seconds, for reference data
+    (labels, custom fields, entity lists) that changes rarely and is cheap to
+    serve stale for a while. Writers call `invalidate` after changing the data.
+
+    `get_or_load` is single-flight: concurrent misses for the same key share
+    one load, through a Coalescer, instead of each running it.
+
+    With `generation`, entries are also dropped when the data generation
+    changes, which is how writes in other worker processes invalidate it.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 128,
+                 clock: Callable[[], float] = time.monotonic,
+                 generation: Optional[Callable[[], int]] = None):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.generation = generation
+        self._generation = None
+        self._entries = OrderedDict()
+        # Loads in progress. invalidate forgets them, so their results are not stored
+        self._loads = Coalescer(name)
+
+    def _sync(self):
+        if self.generation is not None:
+            current = self.generation()
+            if current != self._generation:
+                self._entries.clear()
+                self._generation = current
+
+    def get(self, key: Hashable, default=None):
+        self._sync()
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            metrics.record_cache(self.name, False)
+            return default
+        self._entries.move_to_end(key)
+        metrics.record_cache(self.name, True)
+        return entry[1]
+
+    def set(self, key: Hashable, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def fresh(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable]):
+        """The cached value of key, or the result of `await load()`, stored for `ttl`."""
+        missing = object()
+        if (value := self.get(key, missing)) is not missing:
+            return value
+        return await self._loads.run(key, lambda: self._load(key, load))
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable]):
+        value = await load()
+        if self._loads.current(key):
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        """Drop keys, or every entry without keys. Loads in progress are not stored."""
+        if not keys:
+            self._entries.clear()
+            self._loads.forget()
+        for key in keys:
+            self._entries.pop(key, None)
+            self._loads.forget(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+reference_cache = TTLCache('reference_data', ttl=Config.get_config().reference_data_ttl)
@@ -0,0 +1,64 @@
+"""
+Coalescing of identical concurrent requests.
+
+`Coalescer.run(key, function)` awaits `function()` unless a call with the
+same key is already running, in which case it awaits that call's result
+instead. Unlike a cache, nothing is kept once the call is done: only
+requests arriving while it runs share it, so a burst of identical requests
+costs one computation while every later request sees fresh data.
+
+Keys must identify everything the result depends on, including the data
+generation, so that a request made after a write never gets a result
+computed before it.
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from app.core import metrics
+
+T = TypeVar('T')
+
+_coalescers: list['Coalescer'] = []
+
+metrics.registry.gauge('coalesced_in_flight', 'Computations running for coalesced requests',
+                       ['name'],
+                       function=lambda: {(coalescer.name,): len(coalescer)
+                                         for coalescer in _coalescers})
+
+
+class Coalescer(object):
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        _coalescers.append(self)
+
+    async def _call(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await function()
+        finally:
+            if self.current(key):
+                del self._tasks[key]
+
+    def current(self, key: Hashable) -> bool:
+        """Whether the running task is the call of key, and it was not forgotten."""
+        return self._tasks.get(key) is asyncio.current_task()
+
+    def forget(self, *keys: Hashable):
+        """Let later calls of keys, or of any key, start anew instead of sharing running ones."""
+        if not keys:
+            self._tasks.clear()
+        for key in keys:
+            self._tasks.pop(key, None)
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        if (task := self._tasks.get(key)) is None:
+            task = self._tasks[key] = asyncio.ensure_future(self._call(key, function))
+            metrics.coalesced_requests.inc(name=self.name, result='computed')
+        else:
+            metrics.coalesced_requests.inc(name=self.name, result='shared')
+        # A cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._tasks)
@@ -0,0 +1,148 @@
+"""
+ASGI middleware compressing responses with brotli or gzip, whichever the
+client prefers of those available. Responses smaller than `minimum_size`,
+already encoded responses and event streams are passed through untouched.
+
+Brotli is used only if the optional `brotli` package is installed.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+from app.core import metrics
+
+compressed_bytes = metrics.registry.counter(
+    'http_response_compressed_bytes_total', 'Response bytes before and after compression',
+    ['encoding', 'stage'])
+
+SKIP_CONTENT_TYPES = ('text/event-stream', 'image/', 'application/zip', 'application/gzip')
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: str):
+    accepted = parse_accept_encoding(header)
+    candidates = [('br', 1.0)] if brotli is not None else []
+    candidates.append(('gzip', 0.9))
+    best = None
+    for encoding, preference in candidates:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0 and (best is None or (quality, preference) > best[0]):
+            best = ((quality, preference), encoding)
+    return best[1] if best else None
+
+
+class _Compressor(object):
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level['br'])
+        else:
+            self._compressor = zlib.compressobj(level['gzip'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressionMiddleware(object):
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = {'gzip': gzip_level, 'br': brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        accept = ''
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                accept = value.decode('latin-1')
+                break
+        if not accept or (encoding := choose_encoding(accept)) is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, encoding, self.level,
+                                                          self.minimum_size))
+
+
+class _CompressingSender(object):
+
+    def __init__(self, send, encoding, level, minimum_size):
+        self.send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.start = message
+            headers = {name.lower(): value for name, value in message.get('headers', [])}
+            content_type = headers.get(b'content-type', b'').decode('latin-1')
+            if b'content-encoding' in headers or content_type.startswith(SKIP_CONTENT_TYPES):
+                self.passthrough = True
+                await self.send(message)
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        started = self.compressor is not None
+        if not started:
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding, self.level)
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.flush()
+        if not started:
+            await self.send(self._compressed_start(None if more_body else len(data)))
+        compressed_bytes.inc(len(body), encoding=self.encoding, stage='in')
+        compressed_bytes.inc(len(data), encoding=self.encoding, stage='out')
+        await self.send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+    def _compressed_start(self, content_length):
+        """The original response start, with headers describing the compressed body."""
+        original = self.start.get('headers', [])
+        headers = [(name, value) for name, value in original
+                   if name.lower() not in (b'content-length', b'vary')]
+        vary = [value for name, value in original if name.lower() == b'vary']
+        headers.append((b'content-encoding', self.encoding.encode()))
+        headers.append((b'vary', b', '.join(vary + [b'Accept-Encoding'])))
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+        return dict(self.start, headers=headers)
@@ -1,8 +1,44 @@
 import os
+from pathlib import Path
 
 from app.core.envconfigparser import EnvConfigParser
 
 
+# The project directory, with version.txt and alembic.ini
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def split_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class Workspace(object):
+    """
+    A Shortcut workspace to import from. Settings are read from the section
+    [workspace:<name>] or the environment variables SHORTCUT_<NAME>_<OPTION>,
+    falling back to the global Shortcut settings.
+    """
+
+    def __init__(self, config: EnvConfigParser, name: str, default: 'Config'):
+        section = f'workspace:{name}'
+        prefix = f'SHORTCUT_{name.upper()}'
+        self.name = name
+        self.url = config.get_env(section=section, option='url', env_var=f'{prefix}_URL',
+                                  fallback=default.shortcut_url)
+        self.token = config.get_env(section=section, option='token',
+                                    env_var=f'{prefix}_TOKEN', hidden=True,
+                                    fallback=default.shortcut_token)
+        self.states = split_list(config.get_env(section=section, option='states',
+                                                env_var=f'{prefix}_STATES',
+                                                fallback=','.join(default.shortcut_states)))
+        self.rate_limit = config.get_env_int(section=section, option='rate_limit',
+                                             env_var=f'{prefix}_RATE_LIMIT',
+                                             fallback=default.shortcut_rate_limit)
+        self.concurrency = config.get_env_int(section=section, option='concurrency',
+                                              env_var=f'{prefix}_CONCURRENCY',
+                                              fallback=default.shortcut_concurrency)
+
+
 class Config(object):
     """Configuration base with singleton."""
 
@@ -20,7 +56,76 @@ class Config(object):
             env_var='SHORTCUT_URL',
             fallback='https://api.app.shortcut.com/api/v3'
         )
-        self.shortcut_token = self.config.get_env(env_var='SHORTCUT_TOKEN')
+        self.shortcut_token = self.config.get_env(env_var='SHORTCUT_TOKEN', hidden=True)
+        self.shortcut_states = split_list(self.config.get_env(
+            env_var='SHORTCUT_STATES',
+            fallback='Önskemål'
+        ))
+        # Shortcut allows 200 requests per minute and token
+        self.shortcut_rate_limit = self.config.get_env_int(env_var='SHORTCUT_RATE_LIMIT',
+                                                           fallback=180)
+        self.shortcut_concurrency = self.config.get_env_int(env_var='SHORTCUT_CONCURRENCY',
+                                                            fallback=4)
+        self.workspaces = [
+            Workspace(self.config, name, self)
+            for name in split_list(self.config.get_env(env_var='SHORTCUT_WORKSPACES',
+                                                       fallback='default'))
+        ]
+        self.database_url = self.config.get_env(
+            env_var='DATABASE_URL',
+            fallback='sqlite:///./data/shortcut_report.db'
+        )
+        # Change events queued per event stream client before it has to resync
+        self.events_buffer_size = self.config.get_env_int(env_var='EVENTS_BUFFER_SIZE',
+                                                          fallback=256)
+        # Seconds a worker trusts its copy of the data generation before rereading it
+        # from the database, i.e. how long other workers' writes can go unnoticed
+        self.generation_poll_interval = self.config.get_env_float(
+            env_var='GENERATION_POLL_INTERVAL', fallback=0.5)
+        # Seconds labels, custom fields and entity lists are cached before refetching
+        self.reference_data_ttl = self.config.get_env_int(env_var='REFERENCE_DATA_TTL',
+                                                          fallback=900)
+        # Import pipeline: sources fetched at a time, tasks turning pages into rows,
+        # pages buffered between stages and most stories staged per insert
+        self.import_fetch_concurrency = self.config.get_env_int(
+            env_var='IMPORT_FETCH_CONCURRENCY', fallback=4)
+        self.import_build_concurrency = self.config.get_env_int(
+            env_var='IMPORT_BUILD_CONCURRENCY', fallback=1)
+        self.import_queue_size = self.config.get_env_int(env_var='IMPORT_QUEUE_SIZE',
+                                                         fallback=16)
+        self.import_write_batch = self.config.get_env_int(env_var='IMPORT_WRITE_BATCH',
+                                                          fallback=500)
+        # Seconds after which the checkpoints of an interrupted import are too old to resume
+        self.import_resume_max_age = self.config.get_env_int(env_var='IMPORT_RESUME_MAX_AGE',
+                                                             fallback=3600)
+        # Answer backlog queries from an in-memory copy of the stories instead of SQL
+        self.story_index = self.config.get_env_boolean(env_var='STORY_INDEX', fallback='false')
+        # Seconds a search from a client waits for a newer one replacing it
+        self.search_debounce = self.config.get_env_float(env_var='SEARCH_DEBOUNCE',
+                                                         fallback=0.15)
+        # Least share of the query's trigrams a story must have for a fuzzy match
+        self.search_similarity = self.config.get_env_float(env_var='SEARCH_SIMILARITY',
+                                                           fallback=0.3)
+        # Codec story descriptions are stored with: none, zlib or zstd (needs the
+        # zstandard package). Changing it rewrites every story at the next import
+        self.description_compression = self.config.get_env(env_var='DESCRIPTION_COMPRESSION',
+                                                           fallback='none')
+        # Responses smaller than this are not compressed
+        self.compression_minimum_size = self.config.get_env_int(
+            env_var='COMPRESSION_MINIMUM_SIZE', fallback=1024)
+        # Seconds between database maintenance runs (purge, cleanup, vacuum, analyze),
+        # e.g. 86400 for daily. By default it only runs when /admin/maintenance is called
+        self.maintenance_interval = self.config.get_env_int(env_var='MAINTENANCE_INTERVAL',
+                                                            fallback=0)
+        # Days after which maintenance deletes stories no longer in Shortcut, e.g. 90.
+        # Deleted stories are gone for good, so by default they are kept
+        self.purge_inactive_days = self.config.get_env_float(env_var='PURGE_INACTIVE_DAYS',
+                                                             fallback=0)
+        # Free pages an incremental vacuum returns to the file system per run, 0 for all
+        self.vacuum_pages = self.config.get_env_int(env_var='VACUUM_PAGES', fallback=0)
+        # Upgrade the database schema in the app's lifespan instead of in start.sh
+        self.migrate_on_startup = self.config.get_env_boolean(env_var='MIGRATE_ON_STARTUP',
+                                                              fallback='true')
         self.log_level = self.config.get_env(env_var='LOG_LEVEL', fallback='WARNING')
         self.version = self.read_version()
 
@@ -33,7 +138,7 @@ class Config(object):
     @classmethod
     def read_version(cls):
         try:
-            fh = open('version.txt', 'r')
+            fh = open(ROOT / 'version.txt', 'r')
             value = '\n'.join(fh.readlines()).rstrip()
             fh.close()
             return value
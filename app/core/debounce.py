@@ -0,0 +1,49 @@
+"""
+Debouncing of requests that supersede each other, e.g. searches sent on
+every keystroke.
+
+`Debouncer.run(key, function)` waits `delay` seconds before calling
+`function`; another run with the same key meanwhile, or while `function`
+is still running, cancels it and makes it raise `Superseded`. Only the
+latest call for a key does any work.
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class Superseded(Exception):
+    """A newer call with the same key has replaced this one."""
+
+
+class Debouncer(object):
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    async def _delayed(self, function: Callable[[], Awaitable[T]]) -> T:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        return await function()
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        if (previous := self._tasks.get(key)) is not None:
+            previous.cancel()
+        task = self._tasks[key] = asyncio.ensure_future(self._delayed(function))
+        try:
+            # Shielded, so that cancelling the task is what tells a superseded
+            # call apart from its caller being cancelled
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and self._tasks.get(key) is not task:
+                raise Superseded() from None
+            task.cancel()
+            raise
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def __len__(self):
+        return len(self._tasks)
@@ -0,0 +1,126 @@
+"""
+In-process publish/subscribe of backlog change events.
+
+Writers call `events.publish(type, data)`; every subscriber (e.g. an SSE
+client) gets its own bounded queue. A subscriber that falls behind does not
+hold up publishers or grow memory: when its queue is full the queued events
+are dropped and replaced by a single `resync` event telling the client to
+refetch the backlog.
+
+A short history is kept so that reconnecting clients can resume from the
+last event id they saw.
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Optional
+
+from app.core import metrics
+from app.core.config import Config
+
+events_published = metrics.registry.counter(
+    'events_published_total', 'Change events published', ['type'])
+events_dropped = metrics.registry.counter(
+    'events_dropped_total', 'Change events dropped for slow subscribers')
+
+
+class Event(object):
+    __slots__ = ('id', 'type', 'data', 'timestamp')
+
+    def __init__(self, event_id: int, event_type: str, data: dict):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+        self.timestamp = time.time()
+
+
+class Subscription(object):
+
+    def __init__(self, bus: 'EventBus', maxsize: int):
+        self.bus = bus
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def offer(self, event: Event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            events_dropped.inc(dropped + 1)
+            self.queue.put_nowait(Event(event.id, 'resync', {'reason': 'overflow'}))
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class EventBus(object):
+
+    def __init__(self, buffer_size=256, history_size=256):
+        self.buffer_size = buffer_size
+        self.history = deque(maxlen=history_size)
+        self.subscribers: set[Subscription] = set()
+        self._ids = itertools.count(1)
+        self._loop = None
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Subscribe to events. With `last_event_id`, events after it still in the
+        history are queued first, or `resync` if some have already been dropped.
+        """
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, self.buffer_size)
+        if last_event_id is not None:
+            newest = self.history[-1].id if self.history else 0
+            oldest = self.history[0].id if self.history else 1
+            if last_event_id > newest or oldest > last_event_id + 1:
+                # Missed events are gone, or the id is from before a restart
+                subscription.offer(Event(newest, 'resync', {'reason': 'expired'}))
+            else:
+                for event in self.history:
+                    if event.id > last_event_id:
+                        subscription.offer(event)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data: dict):
+        """Publish an event. Safe to call from worker threads as well as the event loop."""
+        event = Event(next(self._ids), event_type, data)
+        events_published.inc(type=event_type)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            self._deliver(event)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, event)
+        return event
+
+    def _deliver(self, event: Event):
+        self.history.append(event)
+        for subscription in list(self.subscribers):
+            subscription.offer(event)
+
+
+events = EventBus(buffer_size=Config.get_config().events_buffer_size)
+
+metrics.registry.gauge('events_subscribers', 'Connected change event subscribers',
+                       function=lambda: len(events.subscribers))
@@ -0,0 +1,64 @@
+"""
+Locks shared between worker processes, as advisory locks on lock files.
+
+The operating system releases a lock when the process holding it dies, so a
+crashed worker can't leave the lock behind. Two holders in the same process
+exclude each other as well, since each acquire opens the file anew.
+"""
+import fcntl
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+
+class LockHeld(Exception):
+    """The lock is held by someone else."""
+
+
+class ProcessLock(object):
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def acquire(self, blocking=True) -> Optional[int]:
+        """A file descriptor holding the lock, or None if not blocking and it is held."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    @staticmethod
+    def release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    @contextmanager
+    def hold(self):
+        """Hold the lock, waiting for it if needed."""
+        fd = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(fd)
+
+    @contextmanager
+    def try_hold(self):
+        """Hold the lock, or raise LockHeld at once if someone else does."""
+        if (fd := self.acquire(blocking=False)) is None:
+            raise LockHeld(self.path)
+        try:
+            yield
+        finally:
+            self.release(fd)
+
+    def held(self) -> bool:
+        if (fd := self.acquire(blocking=False)) is None:
+            return True
+        self.release(fd)
+        return False
@@ -0,0 +1,310 @@
+"""
+Small in-process metrics registry rendering the Prometheus text format.
+
+Metrics are plain Python objects updated in place, so collecting them costs
+a dict lookup and an addition. Nothing is pushed anywhere; the /metrics
+endpoint renders the current values on demand.
+
+    requests = registry.counter('my_requests_total', 'Requests handled', ['route'])
+    requests.inc(route='/shortcut/backlog')
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items, key=lambda kv: tuple(map(str, kv[0]))):
+            yield self.name, key, None, value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Gauge that is either set explicitly or, when `function` is given, read from
+    a callback at render time. The callback returns a number for unlabelled
+    gauges and a {label values tuple: number} dict for labelled ones.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+        result = self.function()
+        if not self.labelnames:
+            yield self.name, (), None, result
+            return
+        for key, value in sorted(result.items()):
+            yield self.name, key, None, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if (entry := self._values.get(key)) is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(entry[0]), entry[1], entry[2]))
+                     for key, entry in self._values.items()]
+        for key, (counts, total, count) in sorted(items, key=lambda kv: tuple(map(str, kv[0]))):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', key, ('le', _format_value(bound)), cumulative
+            yield f'{self.name}_sum', key, None, total
+            yield f'{self.name}_count', key, None, count
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+# HTTP API
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests handled', ['method', 'route', 'status'])
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['method', 'route'])
+http_requests_in_flight = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being handled')
+
+# Caches
+cache_requests = registry.counter(
+    'cache_requests_total', 'Cache lookups', ['cache', 'result'])
+coalesced_requests = registry.counter(
+    'coalesced_requests_total',
+    'Requests that computed a response, or shared the one of an identical request in flight',
+    ['name', 'result'])
+
+# Facet index
+facet_index_builds = registry.counter(
+    'facet_index_builds_total', 'Rebuilds of the in-memory facet index')
+
+# Story index
+story_index_refreshes = registry.counter(
+    'story_index_refreshes_total', 'Refreshes of the in-memory story index', ['kind'])
+
+# Search
+search_index_refreshes = registry.counter(
+    'search_index_refreshes_total', 'Refreshes of the in-memory search index', ['kind'])
+search_requests = registry.counter(
+    'search_requests_total', 'Story searches', ['mode', 'result'])
+
+# Shortcut client
+shortcut_requests = registry.counter(
+    'shortcut_requests_total', 'Requests sent to the Shortcut API',
+    ['workspace', 'endpoint', 'status'])
+shortcut_request_duration = registry.histogram(
+    'shortcut_request_duration_seconds', 'Shortcut API request latency',
+    ['workspace', 'endpoint'])
+
+# Import pipeline
+import_stories_fetched = registry.gauge(
+    'import_stories_fetched', 'Stories fetched from Shortcut by the latest import', ['source'])
+import_stories_written = registry.gauge(
+    'import_stories_written', 'Stories written to the database by the latest import', ['source'])
+import_duration = registry.gauge(
+    'import_duration_seconds', 'Duration of the latest import')
+import_swap_duration = registry.gauge(
+    'import_swap_duration_seconds',
+    'Duration of the transaction swapping the staged stories of a source in', ['source'])
+import_last_success = registry.gauge(
+    'import_last_success_timestamp_seconds', 'Unix time of the latest successful import')
+import_runs = registry.counter(
+    'import_runs_total', 'Imports run', ['result'])
+import_stage_pages = registry.counter(
+    'import_stage_pages_total', 'Pages of stories handled per import pipeline stage', ['stage'])
+import_stage_stories = registry.counter(
+    'import_stage_stories_total', 'Stories handled per import pipeline stage', ['stage'])
+import_stage_busy = registry.counter(
+    'import_stage_busy_seconds_total', 'Time import pipeline stages spent working', ['stage'])
+
+# Database maintenance
+maintenance_runs = registry.counter(
+    'maintenance_runs_total', 'Database maintenance runs', ['result'])
+maintenance_duration = registry.gauge(
+    'maintenance_duration_seconds', 'Duration of the latest database maintenance')
+maintenance_deleted_rows = registry.counter(
+    'maintenance_deleted_rows_total', 'Rows purged or deleted as orphans by maintenance',
+    ['table'])
+
+
+def record_cache(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+class MetricsMiddleware(object):
+    """
+    ASGI middleware timing every HTTP request. Requests are labelled with the
+    route template (e.g. /stories/{story_id}) rather than the raw path, so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or 'unmatched'
+            method = scope['method']
+            http_request_duration.observe(elapsed, method=method, route=route)
+            http_requests.inc(method=method, route=route, status=str(status['code']))
@@ -0,0 +1,45 @@
+"""
+Timing of the startup phases: importing the app, checking migrations and
+building the routers. Reported in the log and as app_startup_seconds.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer(object):
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def mark(self, phase: str):
+        """Record the time since the previous phase ended as `phase`."""
+        self.phases[phase] = time.perf_counter() - self.started - self.total()
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = time.perf_counter() - start
+
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self) -> str:
+        phases = ', '.join(f'{phase} {seconds * 1000:.0f} ms'
+                           for phase, seconds in self.phases.items())
+        return f'Started in {self.total() * 1000:.0f} ms ({phases})'
+
+
+startup = StartupTimer()
+
+metrics.registry.gauge('app_startup_seconds', 'Time spent in each startup phase', ['phase'],
+                       function=lambda: {(phase,): seconds
+                                         for phase, seconds in startup.phases.items()})
@@ -1,65 +1,251 @@
+from contextlib import contextmanager
 from typing import Optional, List
 
-from fastapi import HTTPException, APIRouter, Depends
-from sqlalchemy import select
+from fastapi import HTTPException, APIRouter, Depends, Query
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.db.models import ReportBase
-from app.db.schemas import ReportFieldBase, ReportField
+from app.core.cache import TTLCache
+from app.core.config import Config
+from app.core.events import events
+from app.db.database import SessionLocal, id_in, generation
+from app.db.models import ReportBase, bump_linked_stories, story_link_column
+from app.db.schemas import ReportFieldBase, ReportField, BatchItemResult
 from app.routers.admin.shortcut import get_db
 
 
 class Crud(object):
+    """
+    Routes for listing, creating, renaming and deleting one kind of locally
+    administrated item (persons, components, ...), one at a time or in batches.
+
+    Database work runs in the thread pool so it doesn't block the event loop;
+    cache invalidation and events are handled back on the loop.
+    """
 
     def __init__(self, item_model: type[ReportBase], name: str,
                  schema_model: Optional[type[ReportFieldBase]] = None):
         self.item_model = item_model
         self.name = name
         self.schema_model = schema_model
+        self.cache = TTLCache(f'{item_model.__tablename__}_items',
+                              ttl=Config.get_config().reference_data_ttl,
+                              generation=generation)
 
-    async def create_item(self, item: ReportFieldBase, db: Session = Depends(get_db)):
-        query = select(self.item_model).where(self.item_model.name == item.name)
-        if db.execute(query).first():
-            raise HTTPException(status_code=400, detail=f"{self.name} already exists")
+    def written(self, action: str, items: list):
+        """Drop cached lists and publish an event for each written item."""
+        self.cache.invalidate()
+        for item in items:
+            events.publish(f'{self.item_model.__tablename__}.{action}',
+                           {'id': item.id, 'name': item.name})
 
-        db_item = self.item_model(name=item.name)
-        db.add(db_item)
+    @contextmanager
+    def unique_names(self, db: Session):
+        """Roll back and answer 400 if a statement violates the unique name index."""
+        try:
+            yield
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(400, detail=f'{self.name} already exists')
+
+    def _create(self, db: Session, name: str):
+        model = self.item_model
+        insert_q = insert(model).values(name=name) \
+            .on_conflict_do_nothing(index_elements=['name']) \
+            .returning(model)
+        if (db_item := db.scalars(insert_q).one_or_none()) is None:
+            db.rollback()
+            raise HTTPException(400, detail=f'{self.name} already exists')
         db.commit()
-        db.refresh(db_item)
         return db_item
 
-    async def get_items(self, db: Session = Depends(get_db)):
-        query = select(self.item_model)
-        x = db.execute(query).scalars()
-        return x
+    async def create_item(self, item: ReportFieldBase, db: Session = Depends(get_db)):
+        db_item = await run_in_threadpool(self._create, db, item.name)
+        self.written('created', [db_item])
+        return db_item
+
+    def _items(self, q: Optional[str], offset: int, limit: int) -> list[dict]:
+        model = self.item_model
+        name = model.name.collate('NOCASE')
+        query = select(model.id, model.name).order_by(name, model.id).offset(offset).limit(limit)
+        if q:
+            # A range on the NOCASE name index. Like NOCASE, only ASCII letters are folded
+            query = query.where(name >= q, name < q + '\U0010ffff')
+        with SessionLocal() as db:
+            return [{'id': item_id, 'name': item_name}
+                    for item_id, item_name in db.execute(query)]
+
+    async def get_items(self,
+                        q: Optional[str] = Query(None, description='Name prefix'),
+                        offset: int = Query(0, ge=0),
+                        limit: int = Query(100, ge=1, le=1000)):
+        return await self.cache.get_or_load(
+            (q, offset, limit), lambda: run_in_threadpool(self._items, q, offset, limit))
 
     async def get_item_by_id(self, item_id, db: Session = Depends(get_db)):
-        query = select(self.item_model).where(self.item_model.id == item_id)
-        if item := db.execute(query).scalar_one_or_none():
+        if item := await run_in_threadpool(db.get, self.item_model, item_id):
             return item
         raise HTTPException(404, detail=f"{self.name} not found")
 
-    async def update_item_by_id(self, item_id: int, item: ReportField,
-                                db: Session = Depends(get_db)):
-        query = select(self.item_model).where(self.item_model.id == item_id)
-        if db_item := db.execute(query).scalar_one_or_none():
-            item.id = item_id
-            update_item = self.item_model(**item.dict())
-            db.merge(update_item)
+    def _update(self, db: Session, item_id: int, name: str):
+        """The renamed item and whether it changed."""
+        model = self.item_model
+        update_q = update(model) \
+            .where(model.id == item_id, model.name != name) \
+            .values(name=name) \
+            .returning(model)
+        with self.unique_names(db):
+            db_item = db.scalars(update_q).one_or_none()
+        if db_item:
+            bump_linked_stories(db, model, [item_id])
             db.commit()
-            db.refresh(db_item)
-            return db_item
+            return db_item, True
+        # Either unchanged or missing
+        if db_item := db.get(model, item_id):
+            return db_item, False
         raise HTTPException(404, detail=f"{self.name} not found")
 
+    async def update_item_by_id(self, item_id: int, item: ReportField,
+                                db: Session = Depends(get_db)):
+        db_item, changed = await run_in_threadpool(self._update, db, item_id, item.name)
+        if changed:
+            self.written('updated', [db_item])
+        return db_item
+
+    def _delete(self, db: Session, item_id: int):
+        model = self.item_model
+        delete_q = delete(model).where(model.id == item_id) \
+            .returning(model.id, model.name) \
+            .execution_options(synchronize_session=False)
+        if (deleted := db.execute(delete_q).one_or_none()) is None:
+            raise HTTPException(404, detail=f"{self.name} not found")
+        link_column = story_link_column(model)
+        bump_linked_stories(db, model, [item_id])
+        db.execute(delete(link_column.table).where(link_column == item_id))
+        db.commit()
+        return deleted
+
     async def delete_item_by_id(self, item_id: int, db: Session = Depends(get_db)):
-        query = select(self.item_model).where(self.item_model.id == item_id)
-        if db_item := db.execute(query).scalar_one_or_none():
-            db.delete(db_item)
-            db.commit()
-            return {'message': f'Deleted {db_item.name} successfully'}
-        raise HTTPException(404, detail=f"{self.name} not found")
+        deleted = await run_in_threadpool(self._delete, db, item_id)
+        self.written('deleted', [deleted])
+        return {'message': f'Deleted {deleted.name} successfully'}
+
+    def _create_items(self, db: Session, items: List[ReportFieldBase]):
+        """
+        Create all items not conflicting with an existing name, or an earlier
+        item in the batch, in one statement.
+        """
+        model = self.item_model
+        names = [item.name for item in items]
+        existing = set(db.scalars(select(model.name).where(id_in(model.name, names))))
+        results = []
+        rows = []
+        for index, name in enumerate(names):
+            if name in existing:
+                results.append(BatchItemResult(index=index, status='conflict', name=name,
+                                               detail=f'{self.name} already exists'))
+            else:
+                existing.add(name)
+                rows.append({'name': name})
+                results.append(BatchItemResult(index=index, status='created', name=name))
+        if rows:
+            # The unique index on name catches names created since the check above
+            insert_q = insert(model).on_conflict_do_nothing(index_elements=['name']) \
+                .returning(model.id, model.name)
+            created = dict((name, item_id) for item_id, name in db.execute(insert_q, rows))
+            for result in results:
+                if result.status == 'created':
+                    if (item_id := created.get(result.name)) is None:
+                        result.status = 'conflict'
+                        result.detail = f'{self.name} already exists'
+                    result.id = item_id
+        db.commit()
+        return results
+
+    def _update_items(self, db: Session, items: List[ReportField]):
+        """Rename items, skipping unknown ids and names taken by other items."""
+        model = self.item_model
+        ids = [item.id for item in items]
+        names = [item.name for item in items]
+        current = db.execute(select(model.id, model.name)
+                             .where(or_(id_in(model.id, ids), id_in(model.name, names)))).all()
+        name_by_id = dict(current)
+        id_by_name = {name: item_id for item_id, name in current}
+        results = []
+        rows = []
+        renamed = []
+        for index, item in enumerate(items):
+            result = BatchItemResult(index=index, status='updated', id=item.id, name=item.name)
+            if item.id not in name_by_id:
+                result.status = 'not_found'
+                result.detail = f'{self.name} not found'
+            elif id_by_name.setdefault(item.name, item.id) != item.id \
+                    or any(row['id'] == item.id for row in rows):
+                result.status = 'conflict'
+                result.detail = f'{self.name} already exists'
+            else:
+                rows.append({'id': item.id, 'name': item.name})
+                if name_by_id[item.id] != item.name:
+                    renamed.append(item.id)
+            results.append(result)
+        if rows:
+            with self.unique_names(db):
+                db.execute(update(model), rows)
+        if renamed:
+            bump_linked_stories(db, model, renamed)
+        db.commit()
+        return results
+
+    def _delete_items(self, db: Session, ids: List[int]):
+        """Delete items and their links to stories."""
+        model = self.item_model
+        link_column = story_link_column(model)
+        bump_linked_stories(db, model, ids)
+        db.execute(delete(link_column.table).where(id_in(link_column, ids)))
+        delete_q = delete(model).where(id_in(model.id, ids)) \
+            .returning(model.id, model.name) \
+            .execution_options(synchronize_session=False)
+        deleted = dict(db.execute(delete_q).all())
+        results = []
+        for index, item_id in enumerate(ids):
+            if (name := deleted.pop(item_id, None)) is not None:
+                results.append(BatchItemResult(index=index, status='deleted', id=item_id,
+                                               name=name))
+            else:
+                results.append(BatchItemResult(index=index, status='not_found', id=item_id,
+                                               detail=f'{self.name} not found'))
+        db.commit()
+        return results
+
+    async def create_items(self, items: List[ReportFieldBase], db: Session = Depends(get_db)):
+        results = await run_in_threadpool(self._create_items, db, items)
+        self.written('created', [result for result in results if result.status == 'created'])
+        return results
+
+    async def update_items(self, items: List[ReportField], db: Session = Depends(get_db)):
+        results = await run_in_threadpool(self._update_items, db, items)
+        self.written('updated', [result for result in results if result.status == 'updated'])
+        return results
+
+    async def delete_items(self, ids: List[int], db: Session = Depends(get_db)):
+        results = await run_in_threadpool(self._delete_items, db, ids)
+        self.written('deleted', [result for result in results if result.status == 'deleted'])
+        return results
 
     def add_routes(self, router: APIRouter):
+        # Before the /{item_id} routes, which would match /batch too
+        router.add_api_route(path='/batch',
+                             endpoint=self.create_items, methods=['POST'],
+                             response_model=List[BatchItemResult])
+        router.add_api_route(path='/batch',
+                             endpoint=self.update_items, methods=['PUT'],
+                             response_model=List[BatchItemResult])
+        router.add_api_route(path='/batch/delete',
+                             endpoint=self.delete_items, methods=['POST'],
+                             response_model=List[BatchItemResult])
         router.add_api_route(path='',
                              endpoint=self.get_items, methods=['GET'],
                              response_model=List[self.schema_model])
@@ -1,21 +1,196 @@
-from sqlalchemy import select, delete, create_engine
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import (select, create_engine, event, func, Table, Column, Integer,
+                        Float, String, text)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./data/shortcut_report.db"
+from app.core import metrics
+from app.core.config import Config
+
+SQLALCHEMY_DATABASE_URL = Config.get_config().database_url
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30}
 )
+
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers, also in other worker processes, go on while one writes
+    cursor = dbapi_connection.cursor()
+    # Only takes effect in a new database; app.db.maintenance converts existing ones
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine,
                             class_=Session, expire_on_commit=False)
 
 Base = declarative_base()
 
 
+def _pool_connections():
+    pool = engine.pool
+    return {
+        ('checked_out',): pool.checkedout(),
+        ('idle',): pool.checkedin(),
+        ('overflow',): max(pool.overflow(), 0),
+    }
+
+
+metrics.registry.gauge('db_pool_connections', 'SQLite connection pool usage', ['state'],
+                       function=_pool_connections)
+metrics.registry.gauge('db_pool_size', 'SQLite connection pool size',
+                       function=lambda: engine.pool.size())
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def _record_statement_cache(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and context.cache_hit in (context.dialect.CACHE_HIT,
+                                                     context.dialect.CACHE_MISS):
+        metrics.record_cache('sql_statement', context.cache_hit == context.dialect.CACHE_HIT)
+
+
+def id_in(column, ids):
+    """
+    column IN (...) for any number of ids, bound as a single JSON parameter
+    instead of one parameter per id (SQLite limits those to 32766).
+    """
+    return column.in_(select(func.json_each(json.dumps(list(ids))).table_valued('value')))
+
+
+def lock_path(name: str) -> str:
+    """Path of a lock file shared by all processes using the database."""
+    database = engine.url.database
+    if database and database != ':memory:':
+        return f'{database}.{name}.lock'
+    return os.path.join(tempfile.gettempdir(), f'shortcut-report.{name}.lock')
+
+
+generation_table = Table(
+    'data_generation', Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('value', Integer, nullable=False),
+    Column('changed_at', Float, nullable=False),
+    # Distinguishes the generations of different databases in ETags
+    Column('instance', String, nullable=False,
+           server_default=text('(lower(hex(randomblob(4))))')),
+)
+
+
+class Generation(object):
+    """
+    Counter bumped in every transaction that wrote something. Anything derived
+    from the database can be cached for as long as the generation is unchanged.
+
+    The counter is stored in the database, so that all worker processes see
+    each other's writes. A process rereads it at most every `poll_interval`
+    seconds; its own writes are seen at once.
+    """
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self.value = 0
+        self.changed_at = time.time()
+        self.instance = ''
+        self._read_at = None
+
+    def refresh(self):
+        try:
+            with engine.connect() as connection:
+                row = connection.execute(
+                    select(generation_table.c.value, generation_table.c.changed_at,
+                           generation_table.c.instance)
+                    .where(generation_table.c.id == 1)).first()
+        except OperationalError:
+            # Not migrated yet
+            row = None
+        if row is not None:
+            self.update(*row)
+        self._read_at = time.monotonic()
+
+    def update(self, value: int, changed_at: float, instance: str):
+        self.value = value
+        self.changed_at = changed_at
+        self.instance = instance
+
+    def bump(self, connection):
+        """Increase the counter in the transaction of connection."""
+        now = time.time()
+        bump_q = insert(generation_table).values(id=1, value=1, changed_at=now)
+        bump_q = bump_q.on_conflict_do_update(
+            index_elements=['id'],
+            set_={'value': generation_table.c.value + 1, 'changed_at': now}) \
+            .returning(generation_table.c.value, generation_table.c.changed_at,
+                       generation_table.c.instance)
+        return tuple(connection.execute(bump_q).one())
+
+    def __call__(self):
+        if self._read_at is None or time.monotonic() - self._read_at >= self.poll_interval:
+            self.refresh()
+        return self.value
+
+    def etag(self, *parts) -> str:
+        """Weak ETag for a response derived from the current generation and `parts`."""
+        digest = hashlib.blake2b(repr(parts).encode(), digest_size=6).hexdigest()
+        return f'W/"{self.instance}-{self()}-{digest}"'
+
+
+generation = Generation(poll_interval=Config.get_config().generation_poll_interval)
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_flushed(session, flush_context):
+    session.info['written'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update \
+            or orm_execute_state.is_delete:
+        orm_execute_state.session.info['written'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_generation(session):
+    # Pending changes are otherwise only flushed after this event
+    session.flush()
+    if session.info.pop('written', False):
+        session.info['generation'] = generation.bump(session.connection())
+
+
+@event.listens_for(Session, 'after_commit')
+def _update_generation(session):
+    if bumped := session.info.pop('generation', None):
+        generation.update(*bumped)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written(session):
+    session.info.pop('written', None)
+    session.info.pop('generation', None)
+
+
 async def update_saved(db: Session, db_class: Base,
                        new_items: list[Base],
-                       remove_missing=True):
-    old_items = db.execute(select(db_class))
+                       remove_missing=True,
+                       scope=None):
+    """
+    Save new_items and update or (optionally) remove the existing rows. `scope`
+    is an optional where clause limiting which existing rows are considered,
+    e.g. only the stories imported from one source.
+    """
+    query = select(db_class)
+    if scope is not None:
+        query = query.where(scope)
+    old_items = db.execute(query)
     old_items = old_items.scalars()
     old_items = {
         item.id: item
@@ -29,12 +204,18 @@ async def update_saved(db: Session, db_class: Base,
     remove_items = set(old_items.keys()) - set(new_items.keys())
     add_items = set(new_items.keys()) - set(old_items.keys())
     update_items = set(new_items.keys()).intersection(old_items.keys())
+    if scope is not None and add_items:
+        # Rows outside the scope, e.g. stories that moved between sources
+        moved = set(db.scalars(select(db_class.id).where(id_in(db_class.id, add_items))))
+        add_items -= moved
+        update_items |= moved
     if add_items:
         db.add_all([l for _id, l in new_items.items() if _id in add_items])
     if remove_missing and remove_items:
-        delete_query = delete(db_class).where(db_class.id.in_(remove_items))
-        db.execute(delete_query)
+        # Deleted through the session, so the stories linked to them get new versions
+        for uid in remove_items:
+            db.delete(old_items[uid])
     for uid in update_items:
         db.merge(new_items[uid])
     db.commit()
-    return list(db.scalars(select(db_class)))
+    return list(db.scalars(query))
@@ -0,0 +1,206 @@
+"""
+In-memory facet index for backlog filters.
+
+Every story gets a dense position, and every facet value (label, person,
+priority, ...) maps to a bitmap, stored as a Python int, with the bits of
+the stories that have that value set. Filters then become bitwise OR within
+a facet and AND between facets, however many facets are combined.
+
+The index is rebuilt lazily the first time it is used after the data
+generation has changed, i.e. after an import or any other write. Backlog
+requests run in worker threads, so a rebuild makes a new immutable snapshot
+that readers pick up whole.
+"""
+import threading
+from typing import Optional, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.db.database import generation, id_in
+from app.db.models import (Story, StoryCustomFields, CustomFieldValue, CustomField,
+                           Label, story_labels, story_persons, story_components,
+                           story_epic_groups, story_products)
+
+# Values that select stories without priority or period
+MISSING_VALUES = ('', 'null', 'none', 'saknas')
+
+CUSTOM_FIELDS = {
+    'Priority': 'priority',
+    'Periodsplanering': 'period',
+}
+
+LINK_TABLES = {
+    'person': story_persons.c.person_id,
+    'component': story_components.c.component_id,
+    'epic_group': story_epic_groups.c.epic_group_id,
+    'product': story_products.c.product_id,
+}
+
+FACETS = ('label', 'priority', 'period', 'source', *LINK_TABLES)
+
+
+def bitmap_from_positions(positions: Iterable[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def positions_from_bitmap(bitmap: int) -> list[int]:
+    positions = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            positions.append((byte_index << 3) + low.bit_length() - 1)
+            byte ^= low
+    return positions
+
+
+class FacetSnapshot(object):
+    """
+    The facet index as of one data generation. Never changed once built, so
+    that a request reading it sees ids and bitmaps that belong together.
+    """
+    __slots__ = ('generation', 'ids', 'all', 'bitmaps')
+
+    def __init__(self, generation_value, ids: list[int], bitmaps: dict[str, dict]):
+        self.generation = generation_value
+        self.ids = ids
+        self.all = (1 << len(ids)) - 1
+        self.bitmaps = bitmaps
+
+    def value_bitmap(self, facet: str, value) -> int:
+        return self.bitmaps.get(facet, {}).get(value, 0)
+
+    def match(self, filters: dict[str, list]) -> int:
+        """
+        Bitmap of the stories matching any of the values of each facet in
+        `filters`, and all of the facets.
+        """
+        result = self.all
+        for facet, facet_values in filters.items():
+            union = 0
+            for value in facet_values:
+                union |= self.value_bitmap(facet, value)
+            result &= union
+        return result
+
+    def story_ids(self, bitmap: int) -> list[int]:
+        return [self.ids[position] for position in positions_from_bitmap(bitmap)]
+
+    def memory_usage(self) -> int:
+        return sum((bitmap.bit_length() + 7) // 8
+                   for facet_values in self.bitmaps.values()
+                   for bitmap in facet_values.values())
+
+
+class FacetIndex(object):
+    """
+    Builds a new FacetSnapshot when the generation has changed, one thread at
+    a time, and publishes it with a single assignment.
+    """
+
+    def __init__(self):
+        self.snapshot = FacetSnapshot(None, [], {})
+        self._lock = threading.Lock()
+
+    def _build(self, db: Session) -> FacetSnapshot:
+        current = generation()
+        ids = list(db.scalars(select(Story.id).order_by(Story.id)))
+        position = {story_id: index for index, story_id in enumerate(ids)}
+        values = {facet: {} for facet in FACETS}
+
+        def add(facet, value, story_id):
+            if (index := position.get(story_id)) is not None:
+                values[facet].setdefault(value, []).append(index)
+
+        for story_id, source in db.execute(select(Story.id, Story.source)):
+            add('source', source, story_id)
+
+        field_query = select(StoryCustomFields.story_id, CustomField.name,
+                             CustomFieldValue.value) \
+            .join(CustomFieldValue,
+                  StoryCustomFields.custom_field_value_id == CustomFieldValue.value_id) \
+            .join(CustomField, CustomFieldValue.field_id == CustomField.id) \
+            .where(CustomField.name.in_(CUSTOM_FIELDS))
+        with_field = {facet: set() for facet in CUSTOM_FIELDS.values()}
+        for story_id, name, value in db.execute(field_query):
+            facet = CUSTOM_FIELDS[name]
+            add(facet, (value or '').lower(), story_id)
+            with_field[facet].add(story_id)
+        for facet, story_ids in with_field.items():
+            values[facet][None] = [position[story_id] for story_id in ids
+                                   if story_id not in story_ids]
+
+        label_query = select(story_labels.c.story_id, Label.name) \
+            .join(Label, story_labels.c.label_id == Label.id)
+        for story_id, name in db.execute(label_query):
+            add('label', name, story_id)
+
+        for facet, column in LINK_TABLES.items():
+            for story_id, item_id in db.execute(select(column.table.c.story_id, column)):
+                add(facet, item_id, story_id)
+
+        size = len(ids)
+        bitmaps = {
+            facet: {value: bitmap_from_positions(positions, size)
+                    for value, positions in facet_values.items()}
+            for facet, facet_values in values.items()
+        }
+        return FacetSnapshot(current, ids, bitmaps)
+
+    def build(self, db: Session) -> FacetSnapshot:
+        with self._lock:
+            # Another thread may have built it while this one waited
+            if (snapshot := self.snapshot).generation == generation():
+                return snapshot
+            self.snapshot = snapshot = self._build(db)
+            metrics.facet_index_builds.inc()
+            return snapshot
+
+    def ensure_current(self, db: Session) -> FacetSnapshot:
+        """The snapshot of the current generation, built if needed."""
+        if (snapshot := self.snapshot).generation != generation():
+            snapshot = self.build(db)
+        return snapshot
+
+    def memory_usage(self) -> int:
+        return self.snapshot.memory_usage()
+
+
+facet_index = FacetIndex()
+
+
+def _split(value: Optional[str]) -> list[str]:
+    return [item.strip() for item in value.split(',')] if value else []
+
+
+def facet_filters(params: dict) -> dict[str, list]:
+    """The facet filters of search_params, with values normalized to index keys."""
+    filters = {}
+    for facet in ('priority', 'period'):
+        if values := _split(params.get(f'filter[{facet}]')):
+            filters[facet] = [None if value.lower() in MISSING_VALUES else value.lower()
+                              for value in values]
+    for facet in ('label', 'source'):
+        if values := _split(params.get(f'filter[{facet}]')):
+            filters[facet] = values
+    for facet in LINK_TABLES:
+        if values := _split(params.get(f'filter[{facet}]')):
+            filters[facet] = [int(value) for value in values if value.isdigit()]
+    return filters
+
+
+def matching_story_ids(db: Session, params: dict) -> Optional[list[int]]:
+    """Ids of the stories matching the facet filters in params, or None without filters."""
+    if not (filters := facet_filters(params)):
+        return None
+    snapshot = facet_index.ensure_current(db)
+    return snapshot.story_ids(snapshot.match(filters))
+
+
+def story_id_in(ids: list[int]):
+    return id_in(Story.id, ids)
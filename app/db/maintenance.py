@@ -0,0 +1,220 @@
+"""
+Retention and compaction of the SQLite database.
+
+A maintenance run, every MAINTENANCE_INTERVAL seconds if set, or from
+/admin/maintenance:
+
+- purges stories inactive for longer than PURGE_INACTIVE_DAYS, if set, with
+  their labels, custom fields and links; their snapshot history is kept
+- deletes orphaned rows: links and custom fields of stories or items that
+  no longer exist, and custom field values of removed custom fields. The
+  association tables have no foreign key cascades, and renamed or removed
+  labels, custom fields and entities leave such rows behind
+- returns free pages to the file system with an incremental vacuum. A
+  database created before incremental auto vacuum was enabled is converted
+  with one full VACUUM first
+- runs ANALYZE and PRAGMA optimize, so the query planner has statistics
+
+Deletions happen in one write transaction that bumps the data generation,
+so caches and in-memory indexes of every process catch up as after an
+import. The report has the file size, page counts and the plans and timings
+of some representative queries from before and after the run.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import Connection, select, delete, insert, update, func, or_, not_
+
+from app.core import metrics
+from app.db.database import engine, generation, id_in
+from app.db.models import (Story, StoryCustomFields, CustomField, CustomFieldValue, Label,
+                           Person, Component, EpicGroup, Product, MaintenanceRun,
+                           story_labels, story_persons, story_components, story_epic_groups,
+                           story_products)
+
+logger = logging.getLogger(__name__)
+
+# Story association tables, with the column referring to the other side and its table
+LINK_TABLES = (
+    (story_labels, story_labels.c.label_id, Label.id),
+    (story_persons, story_persons.c.person_id, Person.id),
+    (story_components, story_components.c.component_id, Component.id),
+    (story_epic_groups, story_epic_groups.c.epic_group_id, EpicGroup.id),
+    (story_products, story_products.c.product_id, Product.id),
+    (StoryCustomFields.__table__, StoryCustomFields.custom_field_value_id,
+     CustomFieldValue.value_id),
+)
+
+# Queries whose plans and timings are reported before and after maintenance
+PLAN_QUERIES = {
+    'active_backlog': 'SELECT id FROM stories WHERE active = 1 ORDER BY id',
+    'sources': 'SELECT source, count(id) FROM stories WHERE active = 1 GROUP BY source',
+    'updated_range': "SELECT id FROM stories WHERE updated >= '2024-01-01' "
+                     "AND updated < '2024-02-01' ORDER BY updated DESC",
+    'inactive': 'SELECT id FROM stories WHERE active = 0',
+    'label_stories': 'SELECT story_id FROM story_labels WHERE label_id = 1',
+    'story_labels': 'SELECT label_id FROM story_labels WHERE story_id = 1',
+    'story_custom_fields': "SELECT custom_field_value_id FROM story_custom_fields "
+                           "WHERE story_id = 1",
+}
+
+# auto_vacuum mode of databases that can be vacuumed incrementally
+INCREMENTAL = 2
+
+
+def database_bytes() -> int:
+    """Size of the database file and its write-ahead log."""
+    path = engine.url.database
+    if not path or path == ':memory:':
+        return 0
+    return sum(os.path.getsize(name) for name in (path, f'{path}-wal') if os.path.exists(name))
+
+
+metrics.registry.gauge('database_bytes', 'Size of the SQLite database file and its WAL',
+                       function=database_bytes)
+
+
+def database_stats(connection: Connection) -> dict:
+    """File size, page counts and representative query plans and timings."""
+    def pragma(name: str) -> int:
+        return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+    plans = {}
+    for name, query in PLAN_QUERIES.items():
+        plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {query}')]
+        start = time.perf_counter()
+        rows = len(connection.exec_driver_sql(query).all())
+        plans[name] = {'plan': plan, 'rows': rows,
+                       'ms': round((time.perf_counter() - start) * 1000, 3)}
+    analyzed = connection.exec_driver_sql(
+        "SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").scalar()
+    return {
+        'bytes': database_bytes(),
+        'page_size': pragma('page_size'),
+        'pages': pragma('page_count'),
+        'free_pages': pragma('freelist_count'),
+        'auto_vacuum': pragma('auto_vacuum'),
+        'analyzed': bool(analyzed),
+        'queries': plans,
+    }
+
+
+def purge_inactive(connection: Connection, before: datetime) -> list[int]:
+    """Delete the stories deactivated before `before`, with their links."""
+    stories = Story.__table__
+    purged_ids = select(stories.c.id).where(stories.c.active.is_(False),
+                                            stories.c.deactivated < before)
+    purged = sorted(connection.scalars(purged_ids))
+    if purged:
+        for table, _column, _target in LINK_TABLES:
+            connection.execute(delete(table).where(table.c.story_id.in_(purged_ids)))
+        connection.execute(delete(stories).where(stories.c.id.in_(purged_ids)))
+    return purged
+
+
+def delete_orphans(connection: Connection) -> dict[str, int]:
+    """
+    Delete rows referring to missing stories or items, per table. The stories
+    that lose links get a new version, so every process reloads them.
+    """
+    deleted = {}
+    unlinked = set()
+    for table, column, target in LINK_TABLES:
+        story_ids = connection.scalars(delete(table).where(or_(
+            not_(table.c.story_id.in_(select(Story.id))),
+            not_(column.in_(select(target))))).returning(table.c.story_id)).all()
+        deleted[table.name] = len(story_ids)
+        unlinked.update(story_ids)
+    if unlinked:
+        stories = Story.__table__
+        connection.execute(update(stories).where(id_in(stories.c.id, unlinked)).values(
+            version=select(func.coalesce(func.max(stories.c.version), 0) + 1)
+            .scalar_subquery()))
+    values = CustomFieldValue.__table__
+    result = connection.execute(delete(values).where(
+        not_(values.c.field_id.in_(select(CustomField.id)))))
+    deleted[values.name] = result.rowcount
+    return deleted
+
+
+def vacuum(pages: int = 0) -> str:
+    """Return free pages to the file system; 'incremental' or 'full' for a conversion."""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() == INCREMENTAL:
+            # Every step of the pragma frees one page, and the sqlite3 module only
+            # steps statements run with execute() once; executescript() runs it out
+            connection.connection.driver_connection.executescript(
+                f'PRAGMA incremental_vacuum({pages})' if pages else 'PRAGMA incremental_vacuum')
+            kind = 'incremental'
+        else:
+            logger.warning('Converting the database to incremental auto vacuum, '
+                           'rewriting it with VACUUM once')
+            connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.exec_driver_sql('VACUUM')
+            kind = 'full'
+        connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').all()
+    return kind
+
+
+def optimize():
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('ANALYZE')
+        connection.exec_driver_sql('PRAGMA optimize').all()
+
+
+def last_run() -> Optional[float]:
+    """When maintenance last finished, in any worker process."""
+    with engine.connect() as connection:
+        return connection.execute(select(MaintenanceRun.finished_at)
+                                  .order_by(MaintenanceRun.id.desc()).limit(1)).scalar()
+
+
+def run_maintenance(purge_inactive_days: float, vacuum_pages: int = 0) -> dict:
+    """Purge, clean up, vacuum and analyze, and report the database before and after."""
+    started_at = time.time()
+    with engine.connect() as connection:
+        before = database_stats(connection)
+        connection.rollback()
+
+        # Take the write lock up front, like an import's swap
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            purged = []
+            if purge_inactive_days > 0:
+                purged = purge_inactive(connection, datetime.now(timezone.utc)
+                                        - timedelta(days=purge_inactive_days))
+            orphans = delete_orphans(connection)
+            bumped = generation.bump(connection) \
+                if purged or any(orphans.values()) else None
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+    if bumped:
+        generation.update(*bumped)
+
+    vacuumed = vacuum(vacuum_pages)
+    optimize()
+
+    with engine.connect() as connection:
+        after = database_stats(connection)
+        finished_at = time.time()
+        connection.execute(insert(MaintenanceRun).values(
+            started_at=started_at, finished_at=finished_at, purged_stories=len(purged),
+            orphans=sum(orphans.values()), bytes_before=before['bytes'],
+            bytes_after=after['bytes']))
+        connection.commit()
+    logger.info('Maintenance purged %d stories and %d orphaned rows, %d -> %d bytes in %.1f s',
+                len(purged), sum(orphans.values()), before['bytes'], after['bytes'],
+                finished_at - started_at)
+    return {
+        'purged': purged,
+        'orphans': orphans,
+        'vacuum': vacuumed,
+        'duration': round(finished_at - started_at, 3),
+        'before': before,
+        'after': after,
+    }
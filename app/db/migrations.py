@@ -0,0 +1,73 @@
+"""
+Schema migrations run from the app at startup.
+
+Importing Alembic takes longer than the rest of the startup check, so the
+revisions in alembic/versions are read directly and compared with the
+alembic_version table first. Alembic is only imported and run when there is
+something to upgrade.
+"""
+import ast
+import logging
+import re
+
+from sqlalchemy import inspect, text
+
+from app.core.config import ROOT
+from app.core.locks import ProcessLock
+from app.db.database import engine, lock_path
+
+logger = logging.getLogger(__name__)
+
+VERSIONS = ROOT / 'alembic' / 'versions'
+REVISION_RE = re.compile(r'^(revision|down_revision)\b[^=]*=\s*(.+)$', re.MULTILINE)
+
+
+def head_revisions() -> set[str]:
+    """Revisions in alembic/versions that no other revision revises."""
+    revisions = set()
+    revised = set()
+    for path in VERSIONS.glob('*.py'):
+        values = {name: ast.literal_eval(value)
+                  for name, value in REVISION_RE.findall(path.read_text(encoding='utf-8'))}
+        revisions.add(values['revision'])
+        down_revision = values.get('down_revision')
+        if isinstance(down_revision, str):
+            revised.add(down_revision)
+        elif down_revision:
+            revised.update(down_revision)
+    return revisions - revised
+
+
+def current_revisions() -> set[str]:
+    with engine.connect() as connection:
+        if not inspect(connection).has_table('alembic_version'):
+            return set()
+        return set(connection.scalars(text('SELECT version_num FROM alembic_version')))
+
+
+def alembic_config():
+    from alembic.config import Config as AlembicConfig
+
+    config = AlembicConfig(str(ROOT / 'alembic.ini'))
+    config.set_main_option('script_location', str(ROOT / 'alembic'))
+    # Keep the app's logging configuration
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def migrate() -> bool:
+    """Upgrade the database to the head revision. Returns False if it already was."""
+    heads = head_revisions()
+    if current_revisions() == heads:
+        return False
+    # Workers starting together wait for the first one to upgrade
+    with ProcessLock(lock_path('migrate')).hold():
+        current = current_revisions()
+        if current == heads:
+            return False
+        from alembic import command
+
+        logger.warning('Upgrading database from %s to %s',
+                       ', '.join(sorted(current)) or 'empty', ', '.join(sorted(heads)))
+        command.upgrade(alembic_config(), 'head')
+    return True
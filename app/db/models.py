@@ -1,11 +1,18 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from sqlalchemy import ForeignKey, Table, Column
+from sqlalchemy import (ForeignKey, Table, Float, Column, Index, event, select, func, update, text,
+                        inspect)
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, Session, declared_attr
 
-from .database import Base
+from app.core.config import Config
+from .database import Base, id_in
+from .types import CompressedText, UTCDateTime
+
+# Descriptions can be long and are only needed in story details and the search index
+description_type = CompressedText(Config.get_config().description_compression)
 
 story_labels = Table('story_labels',
                      Base.metadata,
@@ -33,6 +40,34 @@ story_products = Table('story_products',
                        Column('product_id', ForeignKey('products.id')))
 
 
+def prio_sort(prio):
+    match prio:
+        case 'High':
+            return 4
+        case 'Medium':
+            return 3
+        case 'Low':
+            return 2
+        case None | 'None' | _:
+            return 1
+
+
+def period_sort(period):
+    match period:
+        case 'P1 2024':
+            return 1
+        case 'P2 2024':
+            return 2
+        case 'P3 2024':
+            return 3
+        case 'Kanske nästa period':
+            return 4
+        case 'Kanske efter nästa period':
+            return 5
+        case None | 'None' | _:
+            return 6
+
+
 class StoryCustomFields(Base):
     __tablename__ = 'story_custom_fields'
     story_id: Mapped[int] = mapped_column(ForeignKey('stories.id'), primary_key=True)
@@ -48,13 +83,26 @@ class StoryCustomFields(Base):
 
 class Story(Base):
     __tablename__ = 'stories'
+    __table_args__ = (
+        # Serves the backlog's active filter, the active stories per source and
+        # the import's deactivation of a source's missing stories
+        Index('ix_stories_active_source', 'active', 'source'),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
-    created: Mapped[str]
-    updated: Mapped[str]
+    # Indexed for sorts and date range filters
+    created: Mapped[datetime] = mapped_column(UTCDateTime, index=True)
+    updated: Mapped[datetime] = mapped_column(UTCDateTime, index=True)
     shortcut_url: Mapped[str]
-    description: Mapped[str]
+    # Deferred: loaded only when accessed or undeferred, as by the story detail
+    description: Mapped[str] = mapped_column(description_type, deferred=True)
     active: Mapped[bool]
+    # When the story was last deactivated, None while active; purged after PURGE_INACTIVE_DAYS
+    deactivated: Mapped[Optional[datetime]] = mapped_column(UTCDateTime)
+    # "<workspace>/<workflow state>" the story was imported from
+    source: Mapped[Optional[str]] = mapped_column(index=True)
+    # Bumped to a new, globally increasing value whenever the story changes
+    version: Mapped[int] = mapped_column(default=0, server_default='0', index=True)
 
     # From shortcut
     custom_fields: Mapped[List['StoryCustomFields']] = relationship(
@@ -107,7 +155,12 @@ class Label(Base):
 
 class ReportBase:
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str]
+    name: Mapped[str] = mapped_column(index=True, unique=True)
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        # Case insensitive name order and prefix search
+        return (Index(f'ix_{cls.__tablename__}_name_nocase', text('name COLLATE NOCASE')),)
 
 
 class Person(Base, ReportBase):
@@ -124,3 +177,163 @@ class EpicGroup(Base, ReportBase):
 
 class Product(Base, ReportBase):
     __tablename__ = 'products'
+
+
+# Items whose renames and deletions change the stories linked to them
+LINKED_ITEMS = (ReportBase, Label, CustomField, CustomFieldValue)
+
+
+def next_story_version(session: Session) -> int:
+    current = session.connection().execute(select(func.max(Story.version))).scalar()
+    return (current or 0) + 1
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_story_versions(session, flush_context, instances):
+    """
+    Give every new or changed story, and every story linked to a renamed or
+    deleted person, component, epic group, product, label or custom field
+    (value), a new version. The story index and the search index of every
+    worker process then reload those stories.
+    """
+    stories = [obj for obj in session.new if isinstance(obj, Story)]
+    stories += [obj for obj in session.dirty
+                if isinstance(obj, Story) and session.is_modified(obj)]
+    linked = [obj for obj in session.dirty
+              if isinstance(obj, LINKED_ITEMS)
+              and session.is_modified(obj, include_collections=False)]
+    linked += [obj for obj in session.deleted if isinstance(obj, LINKED_ITEMS)]
+    if not stories and not linked:
+        return
+
+    version = next_story_version(session)
+    for story in stories:
+        story.version = version
+    linked_ids = {}
+    for obj in linked:
+        linked_ids.setdefault(type(obj), []).append(inspect(obj).identity[0])
+    for item_class, ids in linked_ids.items():
+        bump_linked_stories(session, item_class, ids, version)
+
+
+def story_link_column(item_class: type['ReportBase']) -> Column:
+    """The column of the story association table referring to item_class."""
+    if item_class is CustomFieldValue:
+        return StoryCustomFields.__table__.c.custom_field_value_id
+    for relation in Story.__mapper__.relationships:
+        if relation.secondary is not None and relation.mapper.class_ is item_class:
+            (_target, column), = relation.secondary_synchronize_pairs
+            return column
+    raise ValueError(f'{item_class.__name__} is not linked to stories')
+
+
+def bump_linked_stories(session: Session, item_class: type['ReportBase'], ids: list[int],
+                        version: Optional[int] = None):
+    """Give the stories linked to the items with `ids` a new version."""
+    if item_class is CustomField:
+        # Linked through the field's values
+        column = story_link_column(CustomFieldValue)
+        linked_stories = select(column.table.c.story_id).where(column.in_(
+            select(CustomFieldValue.value_id).where(id_in(CustomFieldValue.field_id, ids))))
+    else:
+        column = story_link_column(item_class)
+        linked_stories = select(column.table.c.story_id).where(id_in(column, ids))
+    if version is None:
+        # Evaluated once by SQLite, saving the round trip of next_story_version
+        version = select(func.coalesce(func.max(Story.version), 0) + 1).scalar_subquery()
+    session.connection().execute(
+        update(Story).where(Story.id.in_(linked_stories)).values(version=version))
+
+
+class ImportCheckpoint(Base):
+    """
+    Progress of a source in the current import run. Committed together with
+    the pages it counts, so an interrupted run resumes after the last of them.
+    """
+    __tablename__ = 'import_checkpoints'
+    source: Mapped[str] = mapped_column(primary_key=True)
+    run_id: Mapped[str]
+    # Token of the page after the committed ones, None before the first and after the last
+    next_token: Mapped[Optional[str]]
+    pages: Mapped[int] = mapped_column(default=0)
+    stories: Mapped[int] = mapped_column(default=0)
+    # Swapped in; a failed source is reset to be refetched from the start when resumed
+    done: Mapped[bool] = mapped_column(default=False)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+
+class StagedStory(Base):
+    """A story fetched by the current import run, until its source is swapped in."""
+    __tablename__ = 'staging_stories'
+    source: Mapped[str] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str]
+    shortcut_url: Mapped[str]
+    created: Mapped[datetime] = mapped_column(UTCDateTime)
+    updated: Mapped[datetime] = mapped_column(UTCDateTime)
+    # Stored like Story.description, so the two compare equal as stored
+    description: Mapped[Optional[str]] = mapped_column(description_type)
+
+
+class StagedStoryCustomField(Base):
+    __tablename__ = 'staging_story_custom_fields'
+    source: Mapped[str] = mapped_column(primary_key=True)
+    story_id: Mapped[int] = mapped_column(primary_key=True)
+    custom_field_value_id: Mapped[str] = mapped_column(primary_key=True)
+
+
+class StagedStoryLabel(Base):
+    __tablename__ = 'staging_story_labels'
+    source: Mapped[str] = mapped_column(primary_key=True)
+    story_id: Mapped[int] = mapped_column(primary_key=True)
+    label_id: Mapped[int] = mapped_column(primary_key=True)
+
+
+class Snapshot(Base):
+    """One row per import; the backlog state at that time is kept in StorySnapshot deltas."""
+    __tablename__ = 'snapshots'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    taken_at: Mapped[datetime] = mapped_column(UTCDateTime, index=True)
+    story_count: Mapped[int]
+    change_count: Mapped[int]
+
+
+class StorySnapshot(Base):
+    """
+    A story as of a snapshot, written only when it differs from the story's
+    previous snapshot row. `removed` marks stories that left the backlog.
+    """
+    __tablename__ = 'story_snapshots'
+    snapshot_id: Mapped[int] = mapped_column(ForeignKey('snapshots.id'), primary_key=True)
+    story_id: Mapped[int] = mapped_column(primary_key=True)
+    removed: Mapped[bool] = mapped_column(default=False)
+    source: Mapped[Optional[str]]
+    priority_rank: Mapped[Optional[int]]
+    period_rank: Mapped[Optional[int]]
+    # Comma separated, sorted label ids
+    label_ids: Mapped[Optional[str]]
+
+    __table_args__ = (
+        Index('ix_story_snapshots_story_id_snapshot_id', 'story_id', 'snapshot_id'),
+    )
+
+
+class MaintenanceRun(Base):
+    """A database maintenance run, see app.db.maintenance."""
+    __tablename__ = 'maintenance_runs'
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    started_at: Mapped[float] = mapped_column(Float)
+    finished_at: Mapped[float] = mapped_column(Float)
+    purged_stories: Mapped[int]
+    orphans: Mapped[int]
+    bytes_before: Mapped[int]
+    bytes_after: Mapped[int]
+
+
+class SnapshotFacet(Base):
+    """Story counts per facet value, aggregated when the snapshot is written."""
+    __tablename__ = 'snapshot_facets'
+    facet: Mapped[str] = mapped_column(primary_key=True)
+    snapshot_id: Mapped[int] = mapped_column(ForeignKey('snapshots.id'), primary_key=True)
+    value: Mapped[str] = mapped_column(primary_key=True)
+    count: Mapped[int]
@@ -0,0 +1,336 @@
+"""
+Staged story import pipeline.
+
+Fetching, building rows and writing overlap instead of running one after
+the other for each source:
+
+    fetch (async, per source) -> pages -> build rows -> rows -> write (thread)
+
+- fetchers page through the stories of each source, `fetch_concurrency`
+  sources at a time (a source's pages follow each other through next
+  tokens, so one source is fetched sequentially)
+- `build_concurrency` builders turn pages into staging rows
+- one writer thread stages the rows, up to `write_batch` stories per
+  transaction, and swaps a source in as soon as all its pages are staged;
+  SQLite has one writer at a time anyway
+
+Pages are staged in order for each source, together with its checkpoint
+(see app.db.staging), so the staged rows of a source are always exactly its
+first `pages` pages. A run that was interrupted is resumed: sources already
+swapped in are skipped, and the others are fetched from the page after the
+last one staged.
+
+The queues between the stages are bounded, so a slow writer holds back the
+fetchers rather than buffering the whole backlog. A source that fails is
+not swapped in and the others go on, as before. If the writer itself fails,
+the fetchers and builders are stopped and every source not swapped in yet
+fails with its error; the pages it staged are resumed from by the next run.
+Every stage reports pages and stories handled and the time it spent
+working, and the queue depths are exported as gauges while an import runs.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import Connection
+
+from app.core import metrics
+from app.core.events import events
+from app.db.database import engine
+from app.db.staging import ImportRun, start_run, stage, discard, finish_run, swap_in
+from app.db.types import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('fetch', 'build', 'write')
+
+# Queues of the running pipeline, for the queue depth gauge
+_queues: dict[str, asyncio.Queue] = {}
+
+metrics.registry.gauge('import_queue_depth', 'Items waiting between import pipeline stages',
+                       ['queue'],
+                       function=lambda: {(name,): queue.qsize()
+                                         for name, queue in _queues.items()})
+
+
+def story_rows(stories: list[dict], label_ids: set[int], source: str):
+    """Staging rows of the stories, their custom fields and their known labels."""
+    rows = [{'id': story['id'],
+             'name': story['name'],
+             'shortcut_url': story['app_url'],
+             'created': parse_timestamp(story['created_at']),
+             'updated': parse_timestamp(story['updated_at']),
+             'description': story.get('description'),
+             'source': source}
+            for story in stories]
+    custom_fields = [{'story_id': story['id'], 'custom_field_value_id': field['value_id']}
+                     for story in stories
+                     for field in story.get('custom_fields', [])]
+    labels = [{'story_id': story['id'], 'label_id': label['id']}
+              for story in stories
+              for label in story.get('labels', [])
+              if label['id'] in label_ids]
+    return rows, custom_fields, labels
+
+
+class StageStats(object):
+    __slots__ = ('pages', 'stories', 'busy')
+
+    def __init__(self):
+        self.pages = 0
+        self.stories = 0
+        self.busy = 0.0
+
+    def add(self, stage: str, stories: int, busy: float, pages=1):
+        self.pages += pages
+        self.stories += stories
+        self.busy += busy
+        metrics.import_stage_pages.inc(pages, stage=stage)
+        metrics.import_stage_stories.inc(stories, stage=stage)
+        metrics.import_stage_busy.inc(busy, stage=stage)
+
+    def as_dict(self) -> dict:
+        return {'pages': self.pages, 'stories': self.stories, 'busy': round(self.busy, 3)}
+
+
+class _End(object):
+    """Marks the end of a source's pages, after `pages` pages or a failure."""
+    __slots__ = ('pages', 'error')
+
+    def __init__(self, pages: int, error: Optional[BaseException] = None):
+        self.pages = pages
+        self.error = error
+
+
+class ImportPipeline(object):
+
+    def __init__(self, sources: list, label_ids: set[int], fetch_concurrency=4,
+                 build_concurrency=1, queue_size=16, write_batch=500, resume_max_age=3600.0):
+        self.sources = sources
+        self.label_ids = label_ids
+        self.fetch_concurrency = max(fetch_concurrency, 1)
+        self.build_concurrency = max(build_concurrency, 1)
+        self.write_batch = write_batch
+        self.resume_max_age = resume_max_age
+        self.pages = asyncio.Queue(queue_size)
+        self.rows = asyncio.Queue(queue_size)
+        self.stats = {stage: StageStats() for stage in STAGES}
+        # Stories imported, or the exception it failed with, per source
+        self.results: dict[str, object] = {}
+        self.run_id: Optional[str] = None
+        self.resumed = False
+        self._run: Optional[ImportRun] = None
+        self._failed: dict[str, Exception] = {}
+        self._loop = None
+
+    async def run(self) -> dict[str, object]:
+        self._loop = asyncio.get_running_loop()
+        connection = engine.connect()
+        try:
+            sources = [f'{client.name}/{state}' for client, state in self.sources]
+            self._run = await asyncio.to_thread(start_run, connection, sources,
+                                                self.resume_max_age)
+            self.run_id = self._run.id
+            self.resumed = self._run.resumed
+            if self.resumed:
+                logger.info('Resuming import run %s', self.run_id)
+            return await self._run_stages(connection)
+        finally:
+            connection.close()
+
+    async def _run_stages(self, connection: Connection) -> dict[str, object]:
+        _queues.update(pages=self.pages, rows=self.rows)
+        written = self._loop.create_future()
+        writer = threading.Thread(target=self._writer, args=(connection, written),
+                                  name='import-writer', daemon=True)
+        writer.start()
+
+        limit = asyncio.Semaphore(self.fetch_concurrency)
+        fetchers = [asyncio.create_task(self._fetch(client, state, limit))
+                    for client, state in self.sources]
+        builders = [asyncio.create_task(self._build()) for _ in range(self.build_concurrency)]
+        feeding = asyncio.create_task(self._feed(fetchers, builders))
+        try:
+            # A failed writer no longer drains the queues, which would block the
+            # fetchers and builders for good, so it is watched while they run
+            await asyncio.wait((feeding, written), return_when=asyncio.FIRST_EXCEPTION)
+            if written.done() and (error := written.exception()) is not None:
+                logger.error('Import writer failed', exc_info=error)
+                for client, state in self.sources:
+                    self.results.setdefault(f'{client.name}/{state}', error)
+            else:
+                await feeding
+                await written
+        finally:
+            for task in (feeding, *fetchers, *builders):
+                task.cancel()
+            if not written.done():
+                # Cancelled: stop the writer without swapping in anything more
+                while not self.rows.empty():
+                    self.rows.get_nowait()
+                self.rows.put_nowait(None)
+                # The writer must be done with the connection before it is closed
+                await asyncio.to_thread(writer.join)
+            _queues.clear()
+        return self.results
+
+    async def _feed(self, fetchers: list[asyncio.Task], builders: list[asyncio.Task]):
+        """Wait for the fetchers and builders, and then end the writer's rows."""
+        await asyncio.gather(*fetchers)
+        for _builder in builders:
+            await self.pages.put(None)
+        await asyncio.gather(*builders)
+        await self.rows.put(None)
+
+    async def _fetch(self, client, state: str, limit: asyncio.Semaphore):
+        source = f'{client.name}/{state}'
+        progress = self._run.progress[source]
+        if progress.done:
+            self.results[source] = progress.stories
+            return
+        if progress.fetched:
+            # Interrupted before its swap
+            await self.pages.put((source, _End(progress.pages)))
+            return
+        pages = progress.pages
+        stories = progress.stories
+        async with limit:
+            try:
+                start = time.perf_counter()
+                async for page, next_token in client.iter_stories(state, progress.next_token):
+                    self.stats['fetch'].add('fetch', len(page), time.perf_counter() - start)
+                    await self.pages.put((source, (pages, page, next_token)))
+                    pages += 1
+                    stories += len(page)
+                    start = time.perf_counter()
+            except Exception as e:
+                await self.pages.put((source, _End(pages, e)))
+                return
+        metrics.import_stories_fetched.set(stories, source=source)
+        await self.pages.put((source, _End(pages)))
+
+    async def _build(self):
+        while (item := await self.pages.get()) is not None:
+            source, page = item
+            if isinstance(page, _End):
+                if source in self._failed:
+                    item = (source, _End(page.pages, self._failed[source]))
+                await self.rows.put(item)
+                continue
+            if source in self._failed:
+                continue
+            seq, stories, next_token = page
+            start = time.perf_counter()
+            try:
+                rows = story_rows(stories, self.label_ids, source)
+            except Exception as e:
+                # The source's remaining pages are skipped and its end marks it failed
+                self._failed[source] = e
+                continue
+            self.stats['build'].add('build', len(stories), time.perf_counter() - start)
+            await self.rows.put((source, (seq, rows, next_token)))
+
+    async def _take(self) -> list:
+        """The next rows to write: at least one item, more if already queued."""
+        items = [await self.rows.get()]
+        stories = _story_count(items[0])
+        while stories < self.write_batch and items[-1] is not None and not self.rows.empty():
+            items.append(self.rows.get_nowait())
+            stories += _story_count(items[-1])
+        return items
+
+    def _writer(self, connection: Connection, written: asyncio.Future):
+        # Pages of each source not staged yet, by number, and the number of the next one to stage
+        pending: dict[str, dict[int, tuple]] = {}
+        staged = {source: progress.pages for source, progress in self._run.progress.items()}
+        stories = {source: progress.stories for source, progress in self._run.progress.items()}
+        ends: dict[str, _End] = {}
+        try:
+            while True:
+                items = asyncio.run_coroutine_threadsafe(self._take(), self._loop).result()
+                for item in items:
+                    if item is None:
+                        break
+                    source, value = item
+                    if isinstance(value, _End):
+                        ends[source] = value
+                    else:
+                        seq, rows, next_token = value
+                        pending.setdefault(source, {})[seq] = (rows, next_token)
+                for source, pages in pending.items():
+                    if source not in ends or ends[source].error is None:
+                        self._stage(connection, source, pages, staged, stories)
+                for source, end in list(ends.items()):
+                    if end.error is not None or staged[source] == end.pages:
+                        del ends[source]
+                        pending.pop(source, None)
+                        self._finish(connection, source, end, stories[source])
+                if items[-1] is None:
+                    break
+            if len(self.results) == len(self.sources):
+                finish_run(connection, self._run)
+        except BaseException as e:
+            self._loop.call_soon_threadsafe(_set_result, written, e)
+        else:
+            self._loop.call_soon_threadsafe(_set_result, written, None)
+
+    def _stage(self, connection: Connection, source: str, pending: dict[int, tuple],
+               staged: dict[str, int], stories: dict[str, int]):
+        """Stage the pages of a source following the ones already staged, if any."""
+        batches = []
+        while (page := pending.pop(staged[source] + len(batches), None)) is not None:
+            batches.append(page)
+        if not batches:
+            return
+        start = time.perf_counter()
+        rows = [row for (rows, _custom_fields, _labels), _token in batches for row in rows]
+        stage(connection, source, rows,
+              [row for (_rows, custom_fields, _labels), _token in batches
+               for row in custom_fields],
+              [row for (_rows, _custom_fields, labels), _token in batches for row in labels],
+              len(batches), batches[-1][1])
+        staged[source] += len(batches)
+        stories[source] += len(rows)
+        self.stats['write'].add('write', len(rows), time.perf_counter() - start,
+                                pages=len(batches))
+
+    def _finish(self, connection: Connection, source: str, end: _End, stories: int):
+        """Swap a completely staged source in, or drop a failed one."""
+        if end.error is not None:
+            self.results[source] = end.error
+            discard(connection, source)
+            return
+        start = time.perf_counter()
+        try:
+            result = swap_in(connection, source)
+        except Exception as e:
+            self.results[source] = e
+            discard(connection, source)
+            return
+        self.stats['write'].add('write', 0, time.perf_counter() - start, pages=0)
+
+        if result.upserted:
+            events.publish('story.upserted', {'source': source, 'ids': result.upserted,
+                                              'version': result.version})
+        if result.deactivated:
+            events.publish('story.deactivated', {'source': source, 'ids': result.deactivated,
+                                                 'version': result.version})
+        metrics.import_stories_written.set(len(result.upserted), source=source)
+        self.results[source] = stories
+
+
+def _story_count(item) -> int:
+    if item is None or isinstance(item[1], _End):
+        return 0
+    return len(item[1][1][0])
+
+
+def _set_result(future: asyncio.Future, error: Optional[BaseException]):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
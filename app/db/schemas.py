@@ -1,6 +1,8 @@
+from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, ConfigDict, field_validator, create_model
 
 from app.db.models import Label
 
@@ -9,9 +11,8 @@ class StoryBase(BaseModel):
     id: int
     name: str
     shortcut_url: str
-    description: str
-    created: str
-    updated: str
+    created: datetime
+    updated: datetime
     labels: list[str]
     persons: list['Person']
     components: list['Component']
@@ -19,6 +20,8 @@ class StoryBase(BaseModel):
     products: list['Product']
 
     active: bool
+    source: Optional[str] = None
+    version: int = 0
     priority: Optional[str]
     period: Optional[str]
 
@@ -36,6 +39,11 @@ class StoryWithPrio(StoryBase):
     pass
 
 
+class StoryDetail(StoryBase):
+    """A story with its description, which lists leave out unless asked for."""
+    description: str
+
+
 class CustomFieldWithValue(BaseModel):
     name: str
     value: str
@@ -68,6 +76,40 @@ class BacklogResponse(BaseModel):
     items: list[StoryBase]
     count: int
     total: int
+    # Highest story version, pass as `since` to get only later changes
+    version: int = 0
+    # Only in responses to `since`: changed stories that no longer match
+    removed: Optional[list[int]] = None
+
+
+class FacetCount(BaseModel):
+    value: Optional[str]
+    count: int
+
+
+class BacklogStats(BaseModel):
+    count: int
+    total: int
+    facets: dict[str, list[FacetCount]]
+
+
+class SearchResult(BaseModel):
+    id: int
+    name: str
+    # Higher is better; only comparable within one search
+    score: float
+
+
+class SourceCount(BaseModel):
+    source: Optional[str]
+    count: int
+
+
+class BacklogSnapshot(BaseModel):
+    snapshot_id: int
+    taken_at: datetime
+    changes: int
+    counts: dict[str, dict[str, int]]
 
 
 class ReportFieldBase(BaseModel):
@@ -78,6 +120,15 @@ class ReportField(ReportFieldBase):
     id: int
 
 
+class BatchItemResult(BaseModel):
+    """Outcome of one item of a batch request, in request order."""
+    index: int
+    status: str
+    id: Optional[int] = None
+    name: Optional[str] = None
+    detail: Optional[str] = None
+
+
 class Person(ReportField):
     pass
 
@@ -92,3 +143,27 @@ class EpicGroup(ReportField):
 
 class Product(ReportField):
     pass
+
+
+StoryBase.model_rebuild()
+StoryDetail.model_rebuild()
+
+# Fields a backlog can return, and those it returns by default
+STORY_FIELDS = tuple(StoryDetail.model_fields)
+LIST_FIELDS = tuple(StoryBase.model_fields)
+
+
+@lru_cache(maxsize=64)
+def sparse_backlog_model(fields: frozenset[str]) -> type[BacklogResponse]:
+    """BacklogResponse with stories limited to `fields`, for sparse fieldsets."""
+    transform_labels = field_validator('labels', mode='before', check_fields=False)(
+        StoryBase.transform_labels.__func__)
+    story_model = create_model(
+        'StoryFields',
+        __config__=ConfigDict(from_attributes=True, populate_by_name=True),
+        __validators__={'transform_labels': transform_labels},
+        **{name: (field.annotation, field)
+           for name, field in StoryDetail.model_fields.items() if name in fields}
+    )
+    return create_model('SparseBacklogResponse', __base__=BacklogResponse,
+                        items=(list[story_model], ...))
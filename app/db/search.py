@@ -0,0 +1,307 @@
+"""
+In-memory trigram index for story search.
+
+Story names, label names and descriptions are normalized (NFKC, casefolded)
+and split into words, and every word into trigrams padded like pg_trgm's,
+"  tidsbokning " giving "  t", " ti", "tid", ..., "ng ". Every trigram maps
+to a bitmap of the stories having it in a field, as in the facet index.
+
+Three kinds of matching use the same trigrams:
+
+- substring: stories with all trigrams inside the query words, checked
+  against the text, like the `ilike '%q%'` it replaces
+- prefix: every query word starts a word in the story
+- fuzzy: stories sharing at least `similarity` of the query's trigrams with
+  a field, which tolerates typos and inflections ('tidbokningar')
+
+Results are ranked by the share of the query's trigrams found in each field,
+weighted by field, with a bonus for the query appearing as such in the name.
+
+The index is refreshed like the story index: stories with versions above the
+highest indexed one are reindexed when the data generation changes, and all
+of them when stories have disappeared. Renamed labels give their stories new
+versions, so they are reindexed too.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter
+from enum import Enum
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.db.database import generation, id_in, SessionLocal
+from app.db.facets import bitmap_from_positions, positions_from_bitmap
+from app.db.models import Story, Label, story_labels
+
+WORD_RE = re.compile(r'\w+')
+
+# Fields searched, with the weight of a match in each for ranking
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'labels': 2.0,
+    'description': 1.0,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+
+class SearchMode(Enum):
+    fuzzy = 'fuzzy'
+    prefix = 'prefix'
+    substring = 'substring'
+
+
+def normalize(text: Optional[str]) -> str:
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+
+@lru_cache(maxsize=65536)
+def word_trigrams(word: str, pad_end=True) -> frozenset[str]:
+    padded = f'  {word} ' if pad_end else f'  {word}'
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def text_trigrams(text: str) -> set[str]:
+    # Words repeat a lot, within and between stories, and are cached
+    return set().union(*map(word_trigrams, set(WORD_RE.findall(text))))
+
+
+def inner_trigrams(word: str) -> set[str]:
+    """Trigrams of a query word found wherever the word is a substring."""
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class SearchHit(object):
+    __slots__ = ('id', 'name', 'score')
+
+    def __init__(self, story_id: int, name: str, score: float):
+        self.id = story_id
+        self.name = name
+        self.score = score
+
+
+class SearchData(object):
+    """
+    The indexed stories: dense positions, their (id, name, normalized texts,
+    version, active) entries and the trigram bitmaps per field. Never changed once
+    published, so a search sees positions, entries and bitmaps that belong
+    together.
+    """
+    __slots__ = ('positions', 'stories', 'bitmaps')
+
+    def __init__(self, positions: dict[int, int], stories: list[tuple],
+                 bitmaps: dict[str, dict[str, int]]):
+        self.positions = positions
+        self.stories = stories
+        self.bitmaps = bitmaps
+
+
+class SearchIndex(object):
+
+    def __init__(self):
+        self.generation = None
+        self.version = 0
+        self.data = SearchData({}, [], {field: {} for field in FIELDS})
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, ids: Optional[list[int]]) -> dict[int, tuple]:
+        query = select(Story.id, Story.name, Story.description, Story.version, Story.active)
+        label_query = select(story_labels.c.story_id, Label.name) \
+            .join(Label, story_labels.c.label_id == Label.id)
+        if ids is not None:
+            query = query.where(id_in(Story.id, ids))
+            label_query = label_query.where(id_in(story_labels.c.story_id, ids))
+        labels = {}
+        for story_id, name in db.execute(label_query):
+            labels.setdefault(story_id, []).append(name)
+        return {story_id: (story_id, name, normalize(name),
+                           normalize(' '.join(labels.get(story_id, ()))),
+                           normalize(description), version, active)
+                for story_id, name, description, version, active in db.execute(query)}
+
+    def _index(self, stories: dict[int, tuple], rebuild=False):
+        """
+        Add or replace `stories`, or index only them with `rebuild`. New
+        structures are built and published together as one SearchData, so
+        searches running in other threads meanwhile see a consistent index.
+        """
+        if rebuild:
+            positions, entries, bitmaps = {}, [], {field: {} for field in FIELDS}
+        else:
+            data = self.data
+            positions = dict(data.positions)
+            entries = list(data.stories)
+            bitmaps = {field: dict(values) for field, values in data.bitmaps.items()}
+
+        replaced = [positions[story_id] for story_id in stories if story_id in positions]
+        if replaced:
+            mask = ~bitmap_from_positions(replaced, len(entries))
+            for field_index, field in enumerate(FIELDS):
+                trigrams = set()
+                for position in replaced:
+                    trigrams |= text_trigrams(entries[position][2 + field_index])
+                for trigram in trigrams:
+                    if trigram in bitmaps[field]:
+                        bitmaps[field][trigram] &= mask
+
+        added = {field: {} for field in FIELDS}
+        for story_id, entry in stories.items():
+            if (position := positions.get(story_id)) is None:
+                position = positions[story_id] = len(entries)
+                entries.append(entry)
+            else:
+                entries[position] = entry
+            for field_index, field in enumerate(FIELDS):
+                for trigram in text_trigrams(entry[2 + field_index]):
+                    added[field].setdefault(trigram, []).append(position)
+
+        size = len(entries)
+        for field, trigrams in added.items():
+            for trigram, trigram_positions in trigrams.items():
+                bitmaps[field][trigram] = bitmaps[field].get(trigram, 0) \
+                    | bitmap_from_positions(trigram_positions, size)
+
+        self.data = SearchData(positions, entries, bitmaps)
+
+    def refresh(self, db: Session):
+        with self._lock:
+            current = generation()
+            if current == self.generation and not self._stale:
+                return
+            total = db.execute(select(func.count(Story.id))).scalar()
+            kind = 'incremental'
+            if not self._stale:
+                changed = list(db.scalars(select(Story.id).where(Story.version > self.version)))
+                self._index(self._load(db, changed))
+            if self._stale or len(self.data.positions) != total:
+                self._index(self._load(db, None), rebuild=True)
+                kind = 'full'
+            self.version = max((entry[5] for entry in self.data.stories), default=0)
+            self.generation = current
+            self._stale = False
+            metrics.search_index_refreshes.inc(kind=kind)
+
+    def ensure_current(self, db: Session):
+        if self._stale or self.generation != generation():
+            self.refresh(db)
+
+    def invalidate(self):
+        """Reindex all stories when the index is next used."""
+        self._stale = True
+
+    @staticmethod
+    def _all_of(data: SearchData, fields, trigrams: set[str]) -> int:
+        """Bitmap of the stories with all of `trigrams` in one of `fields`."""
+        result = 0
+        for field in fields:
+            bitmaps = data.bitmaps[field]
+            matching = (1 << len(data.stories)) - 1
+            for trigram in trigrams:
+                if not (matching := matching & bitmaps.get(trigram, 0)):
+                    break
+            result |= matching
+        return result
+
+    def _candidates(self, data: SearchData, words: list[str], fields, trigrams) -> list[int]:
+        bitmap = (1 << len(data.stories)) - 1
+        for word in words:
+            bitmap &= self._all_of(data, fields, trigrams(word))
+        return positions_from_bitmap(bitmap)
+
+    @staticmethod
+    def _field_matches(data: SearchData, trigrams: set[str]) -> dict[str, Counter]:
+        """Per field, the number of `trigrams` every story has in it."""
+        counts = {}
+        for field in FIELDS:
+            bitmaps = data.bitmaps[field]
+            counts[field] = counter = Counter()
+            for trigram in trigrams:
+                if bitmap := bitmaps.get(trigram):
+                    counter.update(positions_from_bitmap(bitmap))
+        return counts
+
+    def search(self, query: str, mode: SearchMode = SearchMode.fuzzy,
+               similarity: float = 0.3, fields=FIELDS,
+               active: Optional[bool] = None) -> list[SearchHit]:
+        """Stories matching `query`, best first, only those with `active` unless None."""
+        data = self.data
+        stories = data.stories
+        text = normalize(query).strip()
+        words = WORD_RE.findall(text)
+        if not words:
+            return []
+        trigrams = set().union(*(word_trigrams(word) for word in words))
+        field_indexes = [FIELDS.index(field) for field in fields]
+
+        if mode == SearchMode.substring:
+            positions = [position for position in
+                         self._candidates(data, words, fields, inner_trigrams)
+                         if any(text in stories[position][2 + index]
+                                for index in field_indexes)]
+        elif mode == SearchMode.prefix:
+            patterns = [re.compile(r'(?<!\w)' + re.escape(word)) for word in words]
+            positions = [position for position in
+                         self._candidates(data, words, fields,
+                                          lambda word: word_trigrams(word, pad_end=False))
+                         if all(any(pattern.search(stories[position][2 + index])
+                                    for index in field_indexes)
+                                for pattern in patterns)]
+        else:
+            positions = None
+
+        counts = self._field_matches(data, trigrams)
+        if positions is None:
+            best = Counter()
+            for field in fields:
+                for position, count in counts[field].items():
+                    best[position] = max(best[position], count)
+            positions = [position for position, count in best.items()
+                         if count >= similarity * len(trigrams)]
+
+        hits = []
+        for position in positions:
+            entry = stories[position]
+            if active is not None and entry[6] != active:
+                continue
+            score = sum(weight * counts[field][position] / len(trigrams)
+                        for field, weight in FIELD_WEIGHTS.items())
+            if text in entry[2]:
+                score += 2.0 if entry[2].startswith(text) else 1.0
+            hits.append(SearchHit(entry[0], entry[1], round(score, 4)))
+        hits.sort(key=lambda hit: (-hit.score, hit.id))
+        return hits
+
+    def memory_usage(self) -> int:
+        data = self.data
+        return sum((bitmap.bit_length() + 7) // 8
+                   for bitmaps in data.bitmaps.values()
+                   for bitmap in bitmaps.values()) \
+            + sum(len(entry[2]) + len(entry[3]) + len(entry[4]) for entry in data.stories)
+
+
+search_index = SearchIndex()
+
+metrics.registry.gauge('search_index_trigrams', 'Distinct trigrams in the search index',
+                       ['field'],
+                       function=lambda: {(field,): len(bitmaps)
+                                         for field, bitmaps
+                                         in search_index.data.bitmaps.items()})
+metrics.registry.gauge('search_index_bytes', 'Approximate memory used by the search index',
+                       function=lambda: search_index.memory_usage())
+
+
+def warm_search_index():
+    with SessionLocal() as db:
+        search_index.ensure_current(db)
+
+
+def search_story_ids(db: Session, query: str, mode: SearchMode = SearchMode.substring,
+                     fields=('name', 'description')) -> list[int]:
+    """Ids of the stories matching `query`, in id order, for filtering."""
+    search_index.ensure_current(db)
+    return sorted(hit.id for hit in search_index.search(query, mode, fields=fields))
@@ -0,0 +1,127 @@
+"""
+Append-only backlog history.
+
+After each import the active backlog is compared with the latest snapshot
+row of every story and only the differences are written. Story counts per
+facet are aggregated at the same time, so trend queries only read the small
+snapshot_facets table.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import select, func, insert, and_
+from sqlalchemy.orm import Session
+
+from app.db.models import (Story, StoryCustomFields, CustomFieldValue, CustomField, Label,
+                           Snapshot, StorySnapshot, SnapshotFacet, story_labels,
+                           prio_sort, period_sort)
+
+FACETS = ('total', 'source', 'priority', 'period', 'label')
+
+
+def current_backlog(db: Session) -> dict[int, dict]:
+    """Active stories as {story_id: {source, priority, period, label_ids}}."""
+    stories = {
+        story_id: {'source': source, 'priority': None, 'period': None, 'label_ids': []}
+        for story_id, source in db.execute(select(Story.id, Story.source).where(Story.active))
+    }
+    field_query = select(StoryCustomFields.story_id, CustomField.name, CustomFieldValue.value) \
+        .join(CustomFieldValue,
+              StoryCustomFields.custom_field_value_id == CustomFieldValue.value_id) \
+        .join(CustomField, CustomFieldValue.field_id == CustomField.id) \
+        .where(CustomField.name.in_(('Priority', 'Periodsplanering')))
+    for story_id, name, value in db.execute(field_query):
+        if story := stories.get(story_id):
+            story['priority' if name == 'Priority' else 'period'] = value
+    for story_id, label_id in db.execute(select(story_labels.c.story_id,
+                                                story_labels.c.label_id)):
+        if story := stories.get(story_id):
+            story['label_ids'].append(label_id)
+    return stories
+
+
+def latest_story_rows(db: Session) -> dict[int, tuple]:
+    """The newest snapshot row of every story still in the backlog, as comparable tuples."""
+    latest = select(StorySnapshot.story_id,
+                    func.max(StorySnapshot.snapshot_id).label('snapshot_id')) \
+        .group_by(StorySnapshot.story_id) \
+        .subquery()
+    query = select(StorySnapshot.story_id, StorySnapshot.source, StorySnapshot.priority_rank,
+                   StorySnapshot.period_rank, StorySnapshot.label_ids) \
+        .join(latest, and_(StorySnapshot.story_id == latest.c.story_id,
+                           StorySnapshot.snapshot_id == latest.c.snapshot_id)) \
+        .where(~StorySnapshot.removed)
+    return {row[0]: tuple(row[1:]) for row in db.execute(query)}
+
+
+def facet_counts(stories: dict[int, dict], label_names: dict[int, str]) -> Counter:
+    counts = Counter()
+    for story in stories.values():
+        counts['total', 'total'] += 1
+        counts['source', str(story['source'])] += 1
+        counts['priority', str(story['priority'])] += 1
+        counts['period', str(story['period'])] += 1
+        for label_id in story['label_ids']:
+            counts['label', label_names.get(label_id, str(label_id))] += 1
+    return counts
+
+
+def write_snapshot(db: Session) -> Snapshot:
+    stories = current_backlog(db)
+    previous = latest_story_rows(db)
+
+    rows = []
+    for story_id, story in stories.items():
+        row = (story['source'],
+               prio_sort(story['priority']),
+               period_sort(story['period']),
+               ','.join(str(label_id) for label_id in sorted(story['label_ids'])) or None)
+        if previous.get(story_id) != row:
+            rows.append({'story_id': story_id, 'removed': False, 'source': row[0],
+                         'priority_rank': row[1], 'period_rank': row[2],
+                         'label_ids': row[3]})
+    for story_id in previous.keys() - stories.keys():
+        rows.append({'story_id': story_id, 'removed': True, 'source': None,
+                     'priority_rank': None, 'period_rank': None, 'label_ids': None})
+
+    snapshot = Snapshot(taken_at=datetime.now(timezone.utc), story_count=len(stories),
+                        change_count=len(rows))
+    db.add(snapshot)
+    db.flush()
+    if rows:
+        db.execute(insert(StorySnapshot),
+                   [dict(row, snapshot_id=snapshot.id) for row in rows])
+
+    label_names = dict(db.execute(select(Label.id, Label.name)).all())
+    counts = facet_counts(stories, label_names)
+    if counts:
+        db.execute(insert(SnapshotFacet),
+                   [{'snapshot_id': snapshot.id, 'facet': facet, 'value': value,
+                     'count': count}
+                    for (facet, value), count in counts.items()])
+    db.commit()
+    return snapshot
+
+
+def get_history(db: Session, facets, taken_from=None, taken_to=None):
+    """Facet counts per snapshot, oldest first."""
+    query = select(Snapshot.id, Snapshot.taken_at, Snapshot.change_count,
+                   SnapshotFacet.facet, SnapshotFacet.value, SnapshotFacet.count) \
+        .join(SnapshotFacet, SnapshotFacet.snapshot_id == Snapshot.id) \
+        .where(SnapshotFacet.facet.in_(facets)) \
+        .order_by(Snapshot.id)
+    if taken_from:
+        query = query.where(Snapshot.taken_at >= taken_from)
+    if taken_to:
+        query = query.where(Snapshot.taken_at <= taken_to)
+
+    history = {}
+    for snapshot_id, taken_at, change_count, facet, value, count in db.execute(query):
+        entry = history.setdefault(snapshot_id, {
+            'snapshot_id': snapshot_id,
+            'taken_at': taken_at,
+            'changes': change_count,
+            'counts': {name: {} for name in facets}
+        })
+        entry['counts'][facet][value] = count
+    return list(history.values())
@@ -0,0 +1,259 @@
+"""
+Staged, resumable story imports.
+
+The stories fetched for a source are written to staging tables as their
+pages arrive, each batch in one transaction together with the source's
+import checkpoint: the run id, the pages committed so far and the token of
+the next page. A run interrupted by a restart resumes from there, so a
+crash costs at most one batch.
+
+Once all pages of a source are staged, it is swapped in with a handful of
+set based statements in one short write transaction:
+
+- stories whose row, custom fields or labels differ from the staged ones
+  are found with EXCEPT
+- only those are upserted, get their custom fields and labels replaced and
+  get a new version
+- active stories of the source that were not staged are deactivated, and
+  the time noted for app.db.maintenance to purge them later
+- the staged rows are deleted and the checkpoint marked done
+
+Deactivation thus only ever happens for a completely fetched source. With
+WAL, readers are never blocked by an import and see a source either
+entirely before or entirely after its swap.
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import (Table, Column, Integer, MetaData, Connection, select, update, delete,
+                        union, func, literal, true, null)
+from sqlalchemy.dialects.sqlite import insert
+
+from app.core import metrics
+from app.db.database import generation
+from app.db.models import (Story, StoryCustomFields, story_labels, ImportCheckpoint,
+                           StagedStory, StagedStoryCustomField, StagedStoryLabel)
+
+logger = logging.getLogger(__name__)
+
+staging_stories = StagedStory.__table__
+staging_custom_fields = StagedStoryCustomField.__table__
+staging_labels = StagedStoryLabel.__table__
+checkpoints = ImportCheckpoint.__table__
+STAGING_TABLES = (staging_stories, staging_custom_fields, staging_labels)
+
+# Ids of the stories changed by a swap, only needed during the swap transaction
+swap_metadata = MetaData()
+staging_changed = Table(
+    'staging_changed', swap_metadata,
+    Column('id', Integer, primary_key=True),
+    prefixes=['TEMPORARY'])
+
+STORY_COLUMNS = ('id', 'name', 'shortcut_url', 'created', 'updated', 'description', 'source')
+
+
+class SwapResult(object):
+    __slots__ = ('upserted', 'deactivated', 'version', 'duration')
+
+    def __init__(self, upserted: list[int], deactivated: list[int], version: int,
+                 duration: float):
+        self.upserted = upserted
+        self.deactivated = deactivated
+        self.version = version
+        self.duration = duration
+
+
+class SourceProgress(object):
+    """A source's checkpoint as read when a run starts."""
+    __slots__ = ('pages', 'stories', 'next_token', 'done')
+
+    def __init__(self, pages=0, stories=0, next_token=None, done=False):
+        self.pages = pages
+        self.stories = stories
+        self.next_token = next_token
+        self.done = done
+
+    @property
+    def fetched(self) -> bool:
+        """All pages are staged, only the swap is left."""
+        return self.pages > 0 and self.next_token is None
+
+
+class ImportRun(object):
+    __slots__ = ('id', 'resumed', 'progress')
+
+    def __init__(self, run_id: str, resumed: bool, progress: dict[str, SourceProgress]):
+        self.id = run_id
+        self.resumed = resumed
+        self.progress = progress
+
+
+def start_run(connection: Connection, sources: list[str], max_age: float) -> ImportRun:
+    """
+    Resume the unfinished run of the checkpoints, unless there is none or it
+    was last updated more than `max_age` seconds ago; then start a new one.
+    """
+    now = time.time()
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+    try:
+        rows = connection.execute(select(checkpoints)).all()
+        resumable = (rows and len({row.run_id for row in rows}) == 1
+                     and not all(row.done for row in rows)
+                     and max(row.updated_at for row in rows) >= now - max_age)
+        if resumable:
+            run = ImportRun(rows[0].run_id, True, {
+                row.source: SourceProgress(row.pages, row.stories, row.next_token, row.done)
+                for row in rows if row.source in sources})
+            connection.execute(delete(checkpoints).where(checkpoints.c.source.not_in(sources)))
+        else:
+            run = ImportRun(uuid.uuid4().hex, False, {})
+            connection.execute(delete(checkpoints))
+            for table in STAGING_TABLES:
+                connection.execute(delete(table))
+        if new := [source for source in sources if source not in run.progress]:
+            connection.execute(insert(checkpoints), [
+                {'source': source, 'run_id': run.id, 'pages': 0, 'stories': 0,
+                 'done': False, 'updated_at': now}
+                for source in new])
+            run.progress.update((source, SourceProgress()) for source in new)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    return run
+
+
+def stage(connection: Connection, source: str, stories: list[dict],
+          custom_fields: Iterable[dict], labels: Iterable[dict], pages: int,
+          next_token: Optional[str]):
+    """
+    Add `pages` pages of stories, as rows with STORY_COLUMNS, to the staging
+    tables and advance the source's checkpoint past them, in one transaction.
+    """
+    try:
+        if stories:
+            connection.execute(insert(staging_stories).on_conflict_do_nothing(), stories)
+        if custom_fields := [dict(row, source=source) for row in custom_fields]:
+            connection.execute(insert(staging_custom_fields).on_conflict_do_nothing(),
+                               custom_fields)
+        if labels := [dict(row, source=source) for row in labels]:
+            connection.execute(insert(staging_labels).on_conflict_do_nothing(), labels)
+        connection.execute(
+            update(checkpoints)
+            .where(checkpoints.c.source == source)
+            .values(pages=checkpoints.c.pages + pages,
+                    stories=checkpoints.c.stories + len(stories),
+                    next_token=next_token, updated_at=time.time()))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def discard(connection: Connection, source: str):
+    """Drop the staged stories of a failed source, which a resumed run refetches."""
+    try:
+        for table in STAGING_TABLES:
+            connection.execute(delete(table).where(table.c.source == source))
+        connection.execute(
+            update(checkpoints)
+            .where(checkpoints.c.source == source)
+            .values(pages=0, stories=0, next_token=None, done=False, updated_at=time.time()))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+
+def finish_run(connection: Connection, run: ImportRun):
+    """Forget the checkpoints of a run all sources of which are swapped in or failed."""
+    connection.execute(delete(checkpoints).where(checkpoints.c.run_id == run.id))
+    connection.commit()
+
+
+def _link_differences(staged: Table, table: Table, column: str, source: str):
+    """Ids of staged stories whose links in `table` differ from the staged ones."""
+    staged_ids = select(staging_stories.c.id).where(staging_stories.c.source == source)
+    current = select(table.c.story_id, table.c[column]).where(table.c.story_id.in_(staged_ids))
+    new = select(staged.c.story_id, staged.c[column]).where(staged.c.source == source)
+    return [select(new.except_(current).subquery().c.story_id),
+            select(current.except_(new).subquery().c.story_id)]
+
+
+def changed_stories(source: str):
+    """Ids of staged stories that are new, inactive or differ from the saved story."""
+    stories = Story.__table__
+    new = select(*(staging_stories.c[name] for name in STORY_COLUMNS), literal(True)) \
+        .where(staging_stories.c.source == source)
+    current = select(*(stories.c[name] for name in STORY_COLUMNS), stories.c.active) \
+        .where(stories.c.id.in_(select(staging_stories.c.id)
+                                .where(staging_stories.c.source == source)))
+    return union(select(new.except_(current).subquery().c.id),
+                 *_link_differences(staging_custom_fields, StoryCustomFields.__table__,
+                                    'custom_field_value_id', source),
+                 *_link_differences(staging_labels, story_labels, 'label_id', source))
+
+
+def swap_in(connection: Connection, source: str) -> SwapResult:
+    """Make the saved stories of source match the staged ones, in one transaction."""
+    stories = Story.__table__
+    start = time.perf_counter()
+    swap_metadata.create_all(connection)
+    connection.commit()
+    # Take the write lock up front, so that nothing read below can change before the writes
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+    try:
+        connection.execute(delete(staging_changed))
+        connection.execute(insert(staging_changed).from_select(['id'], changed_stories(source)))
+        version = connection.execute(
+            select(func.coalesce(func.max(stories.c.version), 0) + 1)).scalar()
+        changed = select(staging_changed.c.id)
+        staged_ids = select(staging_stories.c.id).where(staging_stories.c.source == source)
+
+        upsert_q = insert(stories).from_select(
+            [*STORY_COLUMNS, 'active', 'deactivated', 'version'],
+            select(*(staging_stories.c[name] for name in STORY_COLUMNS), true(), null(),
+                   literal(version))
+            .where(staging_stories.c.source == source, staging_stories.c.id.in_(changed)))
+        upsert_q = upsert_q.on_conflict_do_update(
+            index_elements=['id'],
+            set_={name: upsert_q.excluded[name]
+                  for name in (*STORY_COLUMNS[1:], 'active', 'deactivated', 'version')})
+        connection.execute(upsert_q)
+
+        for table, staged, column in (
+                (StoryCustomFields.__table__, staging_custom_fields, 'custom_field_value_id'),
+                (story_labels, staging_labels, 'label_id')):
+            connection.execute(delete(table).where(table.c.story_id.in_(changed)))
+            connection.execute(insert(table).from_select(
+                ['story_id', column],
+                select(staged.c.story_id, staged.c[column])
+                .where(staged.c.source == source, staged.c.story_id.in_(changed))))
+
+        deactivated = list(connection.scalars(
+            update(stories)
+            .where(stories.c.source == source, stories.c.active,
+                   stories.c.id.not_in(staged_ids))
+            .values(active=False, deactivated=datetime.now(timezone.utc), version=version)
+            .returning(stories.c.id)))
+        upserted = list(connection.scalars(changed))
+
+        for table in STAGING_TABLES:
+            connection.execute(delete(table).where(table.c.source == source))
+        connection.execute(update(checkpoints).where(checkpoints.c.source == source)
+                           .values(done=True, updated_at=time.time()))
+        bumped = generation.bump(connection) if upserted or deactivated else None
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    if bumped:
+        generation.update(*bumped)
+    duration = time.perf_counter() - start
+    metrics.import_swap_duration.set(duration, source=source)
+    logger.info('Swapped in %s: %d upserted, %d deactivated in %.1f ms', source,
+                len(upserted), len(deactivated), duration * 1000)
+    return SwapResult(sorted(upserted), sorted(deactivated), version, duration)
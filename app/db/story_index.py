@@ -0,0 +1,260 @@
+"""
+In-memory story index answering backlog queries without the ORM.
+
+Every story is kept as a small `__slots__` record with the values needed to
+sort it and its JSON serialization, pre-encoded one `"field":value` fragment
+per field of StoryBase. A backlog response is then the matching records'
+fragments joined together, also for sparse fieldsets. Equal fragments (the
+same source, priority or labels, empty lists, ...) are stored once.
+Descriptions are not kept; when a sparse fieldset asks for them, those of
+the returned page are read from the database.
+
+Stories are loaded with plain selects rather than through the ORM. Facet
+filters are answered by the facet index as in the SQL path; the story index
+itself only selects, sorts and encodes. It is refreshed the first time it is
+used after the data generation has changed: stories with a version above the
+highest one already indexed are reloaded, and the whole index is rebuilt if
+stories have disappeared or `invalidate()` has been called. Renaming or
+deleting a label, custom field or linked item gives the linked stories new
+versions (see app.db.models), so the indexes of all worker processes catch up.
+"""
+import sys
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from pydantic_core import to_json
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.db.database import generation, id_in, SessionLocal
+from app.db.models import (Story, StoryCustomFields, CustomFieldValue, CustomField, Label,
+                           Person, Component, EpicGroup, Product, story_labels, story_persons,
+                           story_components, story_epic_groups, story_products,
+                           prio_sort, period_sort)
+from app.db.schemas import LIST_FIELDS
+
+STORY_COLUMNS = (Story.id, Story.name, Story.shortcut_url, Story.created, Story.updated,
+                 Story.active, Story.source, Story.version)
+
+LINKS = (
+    ('persons', story_persons, story_persons.c.person_id, Person),
+    ('components', story_components, story_components.c.component_id, Component),
+    ('epic_groups', story_epic_groups, story_epic_groups.c.epic_group_id, EpicGroup),
+    ('products', story_products, story_products.c.product_id, Product),
+)
+
+CUSTOM_FIELDS = {
+    'Priority': 'priority',
+    'Periodsplanering': 'period',
+}
+
+# Fields with few distinct values, whose fragments are shared between records
+SHARED_FIELDS = frozenset(('labels', 'persons', 'components', 'epic_groups', 'products',
+                           'active', 'source', 'version', 'priority', 'period'))
+
+
+class StoryRecord(object):
+    __slots__ = ('id', 'name', 'created', 'updated', 'active', 'version', 'priority_rank',
+                 'period_rank', 'fragments')
+
+    def __init__(self, story_id: int, name: str, created: datetime, updated: datetime,
+                 active: bool, version: int,
+                 priority_rank: int, period_rank: int, fragments: tuple[bytes, ...]):
+        self.id = story_id
+        self.name = name
+        self.created = created
+        self.updated = updated
+        self.active = active
+        self.version = version
+        self.priority_rank = priority_rank
+        self.period_rank = period_rank
+        self.fragments = fragments
+
+    def encode(self, positions: Optional[tuple[int, ...]] = None) -> bytes:
+        if positions is None:
+            return b'{' + b','.join(self.fragments) + b'}'
+        fragments = self.fragments
+        return b'{' + b','.join([fragments[position] for position in positions]) + b'}'
+
+
+@lru_cache(maxsize=64)
+def field_positions(fields: Optional[frozenset[str]]) -> Optional[tuple[int, ...]]:
+    """Positions of the fragments of `fields` in StoryRecord.fragments, in model order."""
+    if fields is None:
+        return None
+    return tuple(position for position, name in enumerate(LIST_FIELDS) if name in fields)
+
+
+class StoryIndex(object):
+
+    def __init__(self):
+        self.generation = None
+        self.version = 0
+        self.records: dict[int, StoryRecord] = {}
+        self.size = 0
+        self._fragments: dict[bytes, bytes] = {}
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def _fragment(self, name: str, value) -> bytes:
+        fragment = to_json(name) + b':' + to_json(value)
+        if name in SHARED_FIELDS:
+            return self._fragments.setdefault(fragment, fragment)
+        return fragment
+
+    def _record(self, values: dict) -> StoryRecord:
+        fragments = tuple(self._fragment(name, values[name]) for name in LIST_FIELDS)
+        return StoryRecord(values['id'], values['name'], values['created'], values['updated'],
+                           values['active'], values['version'], prio_sort(values['priority']),
+                           period_sort(values['period']), fragments)
+
+    def _load(self, db: Session, records: dict[int, StoryRecord], ids: Optional[list[int]]):
+        """
+        Load the stories in `ids`, or all, into `records` with plain selects;
+        the values are those StoryBase serializes the ORM objects to.
+        """
+        def only(query, column):
+            return query if ids is None else query.where(id_in(column, ids))
+
+        stories = {}
+        for row in db.execute(only(select(*STORY_COLUMNS), Story.id)):
+            values = row._asdict()
+            values.update(labels=[], priority=None, period=None,
+                          **{name: [] for name, *_ in LINKS})
+            stories[row.id] = values
+
+        label_query = select(story_labels.c.story_id, Label.name) \
+            .join(Label, story_labels.c.label_id == Label.id)
+        for story_id, name in db.execute(only(label_query, story_labels.c.story_id)):
+            if values := stories.get(story_id):
+                values['labels'].append(name)
+
+        for name, table, column, model in LINKS:
+            link_query = select(table.c.story_id, model.name, model.id) \
+                .join(model, column == model.id)
+            for story_id, item_name, item_id in db.execute(only(link_query, table.c.story_id)):
+                if values := stories.get(story_id):
+                    values[name].append({'name': item_name, 'id': item_id})
+
+        field_query = select(StoryCustomFields.story_id, CustomField.name,
+                             CustomFieldValue.value) \
+            .join(CustomFieldValue,
+                  StoryCustomFields.custom_field_value_id == CustomFieldValue.value_id) \
+            .join(CustomField, CustomFieldValue.field_id == CustomField.id) \
+            .where(CustomField.name.in_(CUSTOM_FIELDS))
+        for story_id, name, value in db.execute(only(field_query, StoryCustomFields.story_id)):
+            if (values := stories.get(story_id)) and values[CUSTOM_FIELDS[name]] is None:
+                values[CUSTOM_FIELDS[name]] = value
+
+        for story_id, values in stories.items():
+            records[story_id] = self._record(values)
+
+    def refresh(self, db: Session):
+        with self._lock:
+            current = generation()
+            if current == self.generation and not self._stale:
+                return
+            total = db.execute(select(func.count(Story.id))).scalar()
+            if self._stale:
+                self._fragments = {}
+                records = {}
+                self._load(db, records, None)
+                kind = 'full'
+            else:
+                # Copied, so requests reading the index from other threads never
+                # see a half updated dict
+                records = dict(self.records)
+                changed = list(db.scalars(select(Story.id).where(Story.version > self.version)))
+                self._load(db, records, changed)
+                records = dict(sorted(records.items()))
+                kind = 'incremental'
+                if len(records) != total:
+                    self._fragments = {}
+                    records = {}
+                    self._load(db, records, None)
+                    kind = 'full'
+            self.records = records
+            self.version = max((record.version for record in records.values()), default=0)
+            self.size = self.memory_usage()
+            self.generation = current
+            self._stale = False
+            metrics.story_index_refreshes.inc(kind=kind)
+
+    def ensure_current(self, db: Session):
+        if self._stale or self.generation != generation():
+            self.refresh(db)
+
+    def invalidate(self):
+        """Rebuild the whole index when it is next used."""
+        self._stale = True
+
+    def select(self, ids: Optional[Iterable[int]] = None, since: Optional[int] = None,
+               active: Optional[bool] = None) -> list[StoryRecord]:
+        """
+        Records of the stories in `ids` (all without), changed after version
+        `since` and, unless None, with `active`, in id order.
+        """
+        records = self.records
+        if ids is None:
+            selected = list(records.values())
+        else:
+            selected = [record for story_id in ids
+                        if (record := records.get(story_id)) is not None]
+        if since is not None:
+            selected = [record for record in selected if record.version > since]
+        if active is not None:
+            selected = [record for record in selected if record.active == active]
+        return selected
+
+    def memory_usage(self) -> int:
+        """Approximate bytes used by the records and their fragments."""
+        size = sys.getsizeof(self.records) + sys.getsizeof(self._fragments)
+        size += sum(sys.getsizeof(fragment) for fragment in self._fragments)
+        for record in self.records.values():
+            size += sys.getsizeof(record) + sys.getsizeof(record.fragments)
+            size += sum(sys.getsizeof(fragment) for fragment in record.fragments
+                        if fragment not in self._fragments)
+            size += (sys.getsizeof(record.name) + sys.getsizeof(record.created)
+                     + sys.getsizeof(record.updated))
+        return size
+
+
+story_index = StoryIndex()
+
+metrics.registry.gauge('story_index_stories', 'Stories in the in-memory story index',
+                       function=lambda: len(story_index.records))
+metrics.registry.gauge('story_index_bytes', 'Approximate memory used by the story index',
+                       function=lambda: story_index.size)
+
+
+def warm_story_index():
+    """Bring the index up to date after a write, so the next request need not."""
+    with SessionLocal() as db:
+        story_index.ensure_current(db)
+
+
+def read_descriptions(db: Session, ids: list[int]) -> dict[int, str]:
+    return dict(db.execute(select(Story.id, Story.description).where(id_in(Story.id, ids))).all())
+
+
+def encode_backlog(records: list[StoryRecord], fields: Optional[frozenset[str]],
+                   count: int, total: int, version: int,
+                   removed: Optional[list[int]] = None,
+                   descriptions: Optional[dict[int, str]] = None) -> bytes:
+    """
+    A BacklogResponse as JSON, with the fields of BacklogResponse in model
+    order; `descriptions` of the records, if given, go last as in StoryDetail.
+    """
+    positions = field_positions(fields)
+    if descriptions is None:
+        items = b','.join([record.encode(positions) for record in records])
+    else:
+        items = b','.join([record.encode(positions)[:-1] + b',"description":'
+                           + to_json(descriptions.get(record.id)) + b'}'
+                           for record in records])
+    return (b'{"items":[' + items + b'],"count":' + str(count).encode()
+            + b',"total":' + str(total).encode() + b',"version":' + str(version).encode()
+            + b',"removed":' + to_json(removed) + b'}')
@@ -0,0 +1,105 @@
+"""
+Column types.
+
+UTCDateTime stores timestamps as naive UTC datetimes and reads them back as
+timezone aware UTC ones. As stored by SQLite they sort and compare
+chronologically, so indexes on them serve range filters.
+
+CompressedText stores text compressed with zlib or, if the optional
+`zstandard` package is installed, zstd. Values are decompressed when read,
+so queries and models see plain strings. Compressed values are stored as
+BLOBs and plain ones as TEXT, and the codec of a BLOB is told by its magic
+number, so rows written with any codec, or none, can be read whatever the
+current one is. Values that would not shrink are stored as they are.
+
+Compression is deterministic for a codec and level, so staged and saved
+descriptions can still be compared as stored, e.g. with EXCEPT.
+"""
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+from sqlalchemy import String, DateTime
+from sqlalchemy.types import TypeDecorator
+
+CODECS = ('none', 'zlib', 'zstd')
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Shorter values rarely compress and are kept as text
+MINIMUM_SIZE = 64
+
+
+def as_utc(value: datetime) -> datetime:
+    """`value` as an aware UTC datetime; naive values are taken to be UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """An ISO 8601 timestamp like Shortcut's 2024-05-02T08:30:00Z as an aware UTC datetime."""
+    # fromisoformat() only accepts the Z suffix from Python 3.11
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    return as_utc(datetime.fromisoformat(value))
+
+
+class UTCDateTime(TypeDecorator):
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[datetime], dialect):
+        if value is None:
+            return None
+        return as_utc(value).replace(tzinfo=None)
+
+    def process_result_value(self, value: Optional[datetime], dialect) -> Optional[datetime]:
+        if value is None:
+            return None
+        return value.replace(tzinfo=timezone.utc)
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data: bytes) -> bytes:
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError('Reading zstd compressed values needs the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class CompressedText(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def __init__(self, codec: str = 'zlib'):
+        super().__init__()
+        if codec not in CODECS:
+            raise ValueError(f'Unknown compression {codec!r}, expected one of {", ".join(CODECS)}')
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+        self.codec = codec
+
+    def process_bind_param(self, value: Optional[str], dialect):
+        if value is None or self.codec == 'none':
+            return value
+        data = value.encode()
+        if len(data) < MINIMUM_SIZE:
+            return value
+        compressed = compress(data, self.codec)
+        return compressed if len(compressed) < len(data) else value
+
+    def process_result_value(self, value, dialect) -> Optional[str]:
+        if isinstance(value, bytes):
+            return decompress(value).decode()
+        return value
@@ -1,15 +1,52 @@
+# First, so the startup timer starts before the imports below and can time them
+from .core.startup import startup
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
 
-from .routers import api_router
 from .core.config import Config
+from .core.compression import CompressionMiddleware
+from .core.metrics import MetricsMiddleware
+from .resources.resources import resources
 import logging
 import sys
 
+config = Config.get_config()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    with startup.phase('database'):
+        from .db.migrations import migrate
+    if config.migrate_on_startup:
+        with startup.phase('migrations'):
+            migrate()
+    if not getattr(_app.state, 'routers', None):
+        with startup.phase('routers'):
+            # Importing the routers imports the models, schemas and everything
+            # else, so it's done here rather than when app.main is imported
+            from .routers import api_router
+            _app.include_router(api_router())
+            add_pagination(_app)
+            _app.state.routers = True
+    maintenance = None
+    if config.maintenance_interval > 0:
+        from .routers.admin.maintenance import maintenance_schedule
+        maintenance = asyncio.create_task(maintenance_schedule(config.maintenance_interval))
+    logger.info(startup.report())
+    yield
+    if maintenance is not None:
+        maintenance.cancel()
+    await resources.close()
+
+
 app = FastAPI(
     title="shortcut-report",
-    version=Config.get_config().version
+    version=config.version,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -19,9 +56,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-add_pagination(app)
-app.include_router(api_router())
+app.add_middleware(CompressionMiddleware, minimum_size=config.compression_minimum_size)
+app.add_middleware(MetricsMiddleware)
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +66,9 @@ access_handler.setFormatter(logging.Formatter("%(levelname)s \t %(message)s"))
 
 logger.handlers = [access_handler]
 
-logger.setLevel(Config.get_config().log_level)
+logger.setLevel(config.log_level)
+
+startup.mark('import')
 
 
 @app.get("/")
@@ -38,4 +76,4 @@ logger.setLevel(Config.get_config().log_level)
 def index():
     logger.debug(__name__)
 
-    return {"name": app.title, "version": Config.get_config().version}
+    return {"name": app.title, "version": config.version}
@@ -1,10 +1,31 @@
+import asyncio
+
+from app.core.config import Config
 from app.resources.shortcut import Shortcut
 
 
 class Resources(object):
+    """Shortcut clients per workspace, created when first used."""
 
     def __init__(self):
-        self.shortcut = Shortcut()
+        self._workspaces = None
+
+    @property
+    def workspaces(self) -> dict[str, Shortcut]:
+        if self._workspaces is None:
+            self._workspaces = {
+                workspace.name: Shortcut(workspace)
+                for workspace in Config.get_config().workspaces
+            }
+        return self._workspaces
+
+    @property
+    def shortcut(self) -> Shortcut:
+        return next(iter(self.workspaces.values()))
+
+    async def close(self):
+        if self._workspaces:
+            await asyncio.gather(*(client.close() for client in self._workspaces.values()))
 
 
 resources = Resources()
@@ -1,24 +1,80 @@
-import aiohttp
+import asyncio
+import time
+from typing import Optional
 
-from app.core.config import Config
+from app.core import metrics
+from app.core.config import Config, Workspace
+
+
+class RateLimiter(object):
+    """Token bucket allowing `rate` requests per `per` seconds."""
+
+    def __init__(self, rate: int, per: float = 60.0):
+        self.capacity = max(rate, 1)
+        self.tokens = float(self.capacity)
+        self.fill_rate = self.capacity / per
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.fill_rate)
 
 
 class Shortcut(object):
 
-    def __init__(self):
-        config = Config.get_config()
-        self.api_url = config.shortcut_url.rstrip('/')
-        self.token = config.shortcut_token
+    def __init__(self, workspace: Optional[Workspace] = None):
+        if workspace is None:
+            workspace = Config.get_config().workspaces[0]
+        self.workspace = workspace
+        self.name = workspace.name
+        self.states = workspace.states
+        self.api_url = workspace.url.rstrip('/')
+        self.token = workspace.token
         self.headers = {'Shortcut-Token': f'{self.token}'}
+        self.rate_limiter = RateLimiter(workspace.rate_limit)
+        self._session = None
+        self._session_loop = None
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            # Imported when first needed, aiohttp is slow to import
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.workspace.concurrency)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def get_url(self, path, query_parameters=None):
         path = path.lstrip('/')
         full_url = f'{self.api_url}/{path}'
 
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.get(full_url, params=query_parameters) as resp:
+        await self.rate_limiter.acquire()
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            async with self._get_session().get(full_url, params=query_parameters) as resp:
+                status = str(resp.status)
                 result = await resp.json()
                 return result
+        finally:
+            metrics.shortcut_requests.inc(workspace=self.name, endpoint=path, status=status)
+            metrics.shortcut_request_duration.observe(time.perf_counter() - start,
+                                                      workspace=self.name, endpoint=path)
 
     @staticmethod
     def _get_next_page_token(url):
@@ -27,20 +83,32 @@ class Shortcut(object):
                 return kv.split('=')[1]
         return None
 
-    async def get_stories(self, state, limit=25):
+    async def iter_stories(self, state, next_token=None):
+        """
+        The stories in a workflow state, one page at a time, each with the
+        token of the page after it (None after the last), starting at the
+        page of `next_token` if given.
+        """
         path = '/search/stories'
         query_parameters = {'query': f'state:"{state}" -is:archived',
                             'page_size': 25}
-        stories = []
-        result = await self.get_url(path, query_parameters)
-        stories.extend(result['data'])
-        if limit < 0:
-            limit = result['total']
-        while ((len(stories) < limit) and
-               (next_token := self._get_next_page_token(result.get('next')))):
+        if next_token:
+            query_parameters['next'] = next_token
+        while True:
+            result = await self.get_url(path, query_parameters)
+            next_token = self._get_next_page_token(result.get('next'))
+            yield result['data'], next_token
+            if not next_token:
+                return
             query_parameters['next'] = next_token
-            result = await self.get_url(path=path, query_parameters=query_parameters)
-            stories.extend(result['data'])
+
+    async def get_stories(self, state, limit=25):
+        """The first `limit` stories in a workflow state, or all with a negative limit."""
+        stories = []
+        async for page, _next_token in self.iter_stories(state):
+            stories.extend(page)
+            if 0 <= limit <= len(stories):
+                break
         return stories
 
     async def get_labels(self):
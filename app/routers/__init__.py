@@ -1,5 +1,6 @@
-from .admin import shortcut as admin_shortcut
-from . import shortcut, persons, stories, components, epicgroups, products
+from .admin import shortcut as admin_shortcut, maintenance as admin_maintenance
+from . import shortcut, persons, stories, components, epicgroups, products, metrics, \
+    events
 
 
 def api_router():
@@ -7,9 +8,12 @@ def api_router():
     router = APIRouter()
     router.include_router(shortcut.router)
     router.include_router(admin_shortcut.router)
+    router.include_router(admin_maintenance.router)
     router.include_router(persons.router)
     router.include_router(stories.router)
     router.include_router(components.router)
     router.include_router(epicgroups.router)
     router.include_router(products.router)
+    router.include_router(metrics.router)
+    router.include_router(events.router)
     return router
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+
+from fastapi import APIRouter, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
+
+from app.core import metrics
+from app.core.config import Config
+from app.core.events import events
+from app.core.locks import LockHeld
+from app.db.maintenance import run_maintenance, last_run
+from app.routers.admin.shortcut import import_lock
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix='/admin', tags=['admin'])
+
+config = Config.get_config()
+
+
+@router.get('/maintenance')
+async def get_maintenance(purge_inactive_days: float = Query(
+                              None,
+                              description='Purge stories inactive for longer than this many '
+                                          'days instead of PURGE_INACTIVE_DAYS, 0 for none'
+                          )):
+    """Purge old inactive stories, delete orphaned rows, vacuum and analyze the database."""
+    if purge_inactive_days is None:
+        purge_inactive_days = config.purge_inactive_days
+    # Never while an import runs, in any worker process
+    try:
+        with import_lock.try_hold():
+            return await maintain(purge_inactive_days)
+    except LockHeld:
+        metrics.maintenance_runs.inc(result='locked')
+        raise HTTPException(409, detail='An import or maintenance is already running')
+
+
+async def maintain(purge_inactive_days: float) -> dict:
+    try:
+        report = await run_in_threadpool(run_maintenance, purge_inactive_days,
+                                         config.vacuum_pages)
+    except Exception:
+        metrics.maintenance_runs.inc(result='failure')
+        raise
+    metrics.maintenance_runs.inc(result='success')
+    metrics.maintenance_duration.set(report['duration'])
+    metrics.maintenance_deleted_rows.inc(len(report['purged']), table='stories')
+    for table, count in report['orphans'].items():
+        metrics.maintenance_deleted_rows.inc(count, table=table)
+    if report['purged']:
+        events.publish('story.purged', {'ids': report['purged']})
+    return report
+
+
+async def maintenance_schedule(interval: float):
+    """Run maintenance every `interval` seconds, in one of the worker processes."""
+    while True:
+        try:
+            last = await run_in_threadpool(last_run)
+            # The first run comes an interval after startup rather than during it
+            due = (last or time.time()) + interval
+            await asyncio.sleep(max(due - time.time(), 1.0))
+            with import_lock.try_hold():
+                # Another worker may have run it while this one slept
+                if (await run_in_threadpool(last_run) or 0) > time.time() - interval / 2:
+                    continue
+                await maintain(config.purge_inactive_days)
+        except LockHeld:
+            # An import is running, try again shortly
+            await asyncio.sleep(60)
+        except Exception:
+            logger.exception('Scheduled maintenance failed')
+            await asyncio.sleep(interval)
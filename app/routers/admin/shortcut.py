@@ -1,16 +1,35 @@
+import asyncio
+import logging
+import time
 from typing import List
 
-from fastapi import APIRouter, Depends
-from sqlalchemy import update
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-
-from app.db.database import SessionLocal, update_saved
-from app.db.models import Label, Story, StoryCustomFields, CustomFieldValue, CustomField
+from starlette.concurrency import run_in_threadpool
+
+from app.core import metrics
+from app.core.cache import reference_cache
+from app.core.config import Config
+from app.core.events import events
+from app.core.locks import ProcessLock, LockHeld
+from app.db.database import SessionLocal, update_saved, lock_path
+from app.db.models import Label, CustomFieldValue, CustomField
 from app.db.schemas import CustomFieldBase, LabelBase
+from app.db.search import warm_search_index
+from app.db.snapshots import write_snapshot
+from app.db.pipeline import ImportPipeline
+from app.db.story_index import warm_story_index
 from app.resources.resources import resources
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix='/admin/shortcut', tags=['shortcut', 'admin'])
 
+config = Config.get_config()
+
+import_lock = ProcessLock(lock_path('import'))
+
 
 async def get_db():
     db = SessionLocal()
@@ -20,68 +39,144 @@ async def get_db():
         db.close()
 
 
-@router.get('/labels', response_model=List[LabelBase])
-async def get_labels_from_shortcut(db: Session = Depends(get_db)):
-    labels = await resources.shortcut.get_labels()
-    db_labels = [
-        Label(id=label['id'],
-              name=label['name'])
+async def save_labels_from_shortcut() -> list[dict]:
+    workspace_labels = await asyncio.gather(*(client.get_labels()
+                                              for client in resources.workspaces.values()))
+    db_labels = {
+        label['id']: Label(id=label['id'],
+                           name=label['name'])
+        for labels in workspace_labels
         for label in labels
-    ]
+    }
+
+    with SessionLocal() as db:
+        db_labels = await update_saved(db, Label, list(db_labels.values()))
+        return [{'id': label.id, 'name': label.name} for label in db_labels]
+
+
+async def save_custom_fields_from_shortcut() -> list[dict]:
+    workspace_fields = await asyncio.gather(*(client.get_fields()
+                                              for client in resources.workspaces.values()))
+    db_fields = {}
+    for fields in workspace_fields:
+        for field in fields:
+            field_values = [
+                CustomFieldValue(field_id=field['id'],
+                                 value_id=value['id'],
+                                 value=value['value'])
+                for value in field['values']
+            ]
+            db_fields[field['id']] = CustomField(id=field['id'],
+                                                 name=field['name'],
+                                                 field_values=field_values)
+
+    with SessionLocal() as db:
+        db_fields = await update_saved(db, CustomField, list(db_fields.values()))
+        return [{'id': field.id, 'name': field.name} for field in db_fields]
+
+
+async def load_reference_data(refresh=False):
+    """
+    Fetch and save labels and custom fields, unless they were fetched less than
+    REFERENCE_DATA_TTL seconds ago.
+    """
+    if refresh:
+        reference_cache.invalidate('labels', 'fields')
+    return await asyncio.gather(
+        reference_cache.get_or_load('labels', save_labels_from_shortcut),
+        reference_cache.get_or_load('fields', save_custom_fields_from_shortcut))
+
 
-    db_labels = await update_saved(db, Label, db_labels)
-    return db_labels
+@router.get('/labels', response_model=List[LabelBase])
+async def get_labels_from_shortcut():
+    reference_cache.invalidate('labels')
+    return await reference_cache.get_or_load('labels', save_labels_from_shortcut)
 
 
 @router.get('/fields', response_model=List[CustomFieldBase])
-async def get_custom_fields_from_shortcut(db: Session = Depends(get_db)):
-    fields = await resources.shortcut.get_fields()
-    db_fields = []
-    for field in fields:
-        field_values = [
-            CustomFieldValue(field_id=field['id'],
-                             value_id=value['id'],
-                             value=value['value'])
-            for value in field['values']
-        ]
-        db_fields.append(CustomField(id=field['id'],
-                                     name=field['name'],
-                                     field_values=field_values))
-
-    db_fields = await update_saved(db, CustomField, db_fields)
-    return db_fields
+async def get_custom_fields_from_shortcut():
+    reference_cache.invalidate('fields')
+    return await reference_cache.get_or_load('fields', save_custom_fields_from_shortcut)
 
 
 @router.get('/backlog')
-async def get_backlog_from_shortcut(db: Session = Depends(get_db)):
-    labels = {label.id: label
-              for label in await get_labels_from_shortcut(db)}
-
-    await get_custom_fields_from_shortcut(db)
-    stories = await resources.shortcut.get_stories(state='Önskemål', limit=-1)
-    db_stories = [
-        Story(id=story['id'],
-              name=story['name'],
-              shortcut_url=story['app_url'],
-              custom_fields=[StoryCustomFields(
-                  story_id=story['id'],
-                  custom_field_value_id=field['value_id'])
-                  for field in story.get('custom_fields', [])
-              ],
-              created=story['created_at'],
-              updated=story['updated_at'],
-              description=story.get('description'),
-              labels=[labels[label['id']]
-                      for label in story.get('labels', [])],
-              active=True
-              )
-
-        for story in stories
-    ]
-
-    deactivate_q = update(Story).values(active=False)
-    db.execute(deactivate_q)
-    await update_saved(db, Story, db_stories)
-
-    return {'message': f'{len(db_stories)} stories imported',
-            'total': len(db_stories)}
+async def get_backlog_from_shortcut(refresh: bool = Query(
+                                        False,
+                                        description='Refetch labels and custom fields even '
+                                                    'if they are cached'
+                                    ),
+                                    db: Session = Depends(get_db)):
+    # Only one import at a time, across all worker processes
+    try:
+        with import_lock.try_hold():
+            return await run_import(db, refresh)
+    except LockHeld:
+        metrics.import_runs.inc(result='locked')
+        raise HTTPException(409, detail='An import is already running')
+
+
+async def run_import(db: Session, refresh=False):
+    start = time.perf_counter()
+    events.publish('import.started', {})
+    try:
+        result = await _import_backlog(db, refresh)
+    except Exception as e:
+        metrics.import_runs.inc(result='failure')
+        events.publish('import.finished', {'status': 'failure',
+                                           'error': str(e) or type(e).__name__})
+        raise
+    finally:
+        metrics.import_duration.set(time.perf_counter() - start)
+    events.publish('import.finished', {'status': 'partial' if result['failed'] else 'success',
+                                       'total': result['total'],
+                                       'duration': round(time.perf_counter() - start, 3)})
+    if result['failed']:
+        metrics.import_runs.inc(result='partial')
+    else:
+        metrics.import_runs.inc(result='success')
+        metrics.import_last_success.set(time.time())
+    return result
+
+
+async def _import_backlog(db: Session, refresh=False):
+    await load_reference_data(refresh)
+
+    sources = [(client, state)
+               for client in resources.workspaces.values()
+               for state in client.states]
+    with SessionLocal() as label_db:
+        label_ids = set(label_db.scalars(select(Label.id)))
+    pipeline = ImportPipeline(sources, label_ids,
+                              fetch_concurrency=config.import_fetch_concurrency,
+                              build_concurrency=config.import_build_concurrency,
+                              queue_size=config.import_queue_size,
+                              write_batch=config.import_write_batch,
+                              resume_max_age=config.import_resume_max_age)
+    results = await pipeline.run()
+
+    imported = {}
+    failed = {}
+    for client, state in sources:
+        source = f'{client.name}/{state}'
+        result = results.get(source)
+        if isinstance(result, BaseException):
+            logger.error('Import of %s failed', source, exc_info=result)
+            failed[source] = str(result) or type(result).__name__
+        else:
+            imported[source] = result
+    if not imported and failed:
+        raise HTTPException(502, detail={'message': 'Import failed', 'failed': failed})
+
+    await run_in_threadpool(write_snapshot, db)
+    await run_in_threadpool(warm_search_index)
+    if config.story_index:
+        await run_in_threadpool(warm_story_index)
+
+    total = sum(imported.values())
+    return {'message': f'{total} stories imported',
+            'run_id': pipeline.run_id,
+            'resumed': pipeline.resumed,
+            'total': total,
+            'sources': imported,
+            'failed': failed,
+            'stages': {stage: stats.as_dict() for stage, stats in pipeline.stats.items()}}
@@ -0,0 +1,40 @@
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Request, Header
+from fastapi.responses import StreamingResponse
+
+from app.core.events import events
+
+router = APIRouter(prefix='/shortcut', tags=['shortcut', 'events'])
+
+# Seconds between keepalive comments on an idle stream
+HEARTBEAT = 15.0
+
+
+def format_event(event) -> str:
+    data = json.dumps(event.data, separators=(',', ':'), ensure_ascii=False)
+    return f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'
+
+
+@router.get('/backlog/events', response_class=StreamingResponse)
+async def get_backlog_events(request: Request,
+                             last_event_id: Optional[int] = Header(None, alias='Last-Event-ID')):
+    """
+    Server-sent events for backlog changes: story.upserted, story.deactivated,
+    link.added, link.removed, import.started, import.finished, changes to
+    persons, components, epic groups and products, and resync when events
+    were lost and the client should refetch.
+    """
+    async def stream():
+        with events.subscribe(last_event_id) as subscription:
+            yield 'retry: 5000\n\n'
+            while not await request.is_disconnected():
+                if (event := await subscription.get(timeout=HEARTBEAT)) is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield format_event(event)
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache',
+                                      'X-Accel-Buffering': 'no'})
@@ -1,26 +1,53 @@
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from enum import Enum
-from typing import Optional
+from operator import attrgetter
+from typing import Optional, List
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import select, func, Select, asc, desc
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response, Header
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, func, Select, asc, desc, literal, distinct, union_all
+from sqlalchemy.orm import Session, load_only, selectinload
 
-from app.db.models import Story, Label, StoryCustomFields, Person
-from app.db.schemas import BacklogResponse
+from app.core import metrics
+from app.core.cache import GenerationCache
+from app.core.coalesce import Coalescer
+from app.core.config import Config
+from app.core.debounce import Debouncer, Superseded
+from app.db.database import generation, id_in, SessionLocal
+from app.db.facets import matching_story_ids, story_id_in
+from app.db.models import (Story, Label, StoryCustomFields, Person, Component, EpicGroup,
+                           Product, CustomField, CustomFieldValue, story_labels, story_persons,
+                           story_components, story_epic_groups, story_products,
+                           prio_sort, period_sort)
+from app.db.schemas import (BacklogResponse, SourceCount, BacklogSnapshot, BacklogStats,
+                             SearchResult, STORY_FIELDS, LIST_FIELDS, sparse_backlog_model)
+from app.db.search import SearchMode, search_index, search_story_ids
+from app.db.snapshots import FACETS, get_history
+from app.db.story_index import story_index, encode_backlog, read_descriptions
+from app.db.types import as_utc
 from app.routers.admin.shortcut import get_db
 
 router = APIRouter(prefix='/shortcut', tags=['shortcut', 'stories'])
 
+config = Config.get_config()
+
 
 class SortOrder(Enum):
     reverse = 'reverse'
     forward = 'forward'
 
 
+class ActiveFilter(Enum):
+    active = 'true'
+    inactive = 'false'
+    any = 'any'
+
+
 async def search_params(
         q: Optional[str] = Query(
             None,
-            description='Search in story name and description',
+            description='Search in story name and description, case insensitively',
             examples='tidsbokning'
         ),
         sort_name: Optional[SortOrder] = Query(
@@ -50,7 +77,7 @@ async def search_params(
         ),
         filter_priority: Optional[str] = Query(
             None,
-            description='Filter stories on priority',
+            description='Filter stories on priority, comma separated for any of several',
             alias='filter[priority]'
         ),
         sort_period: Optional[SortOrder] = Query(
@@ -60,13 +87,64 @@ async def search_params(
         ),
         filter_period: Optional[str] = Query(
             None,
-            description='Filter stories on period',
+            description='Filter stories on period, comma separated for any of several',
             alias='filter[period]'
         ),
         filter_label: Optional[str] = Query(
             None,
-            description='Filter stories on label',
+            description='Filter stories on label, comma separated for any of several',
             alias='filter[label]'
+        ),
+        filter_source: Optional[str] = Query(
+            None,
+            description='Filter stories on source (workspace/workflow state)',
+            alias='filter[source]'
+        ),
+        filter_person: Optional[str] = Query(
+            None,
+            description='Filter stories on person ID, comma separated for any of several',
+            alias='filter[person]'
+        ),
+        filter_component: Optional[str] = Query(
+            None,
+            description='Filter stories on component ID, comma separated for any of several',
+            alias='filter[component]'
+        ),
+        filter_epic_group: Optional[str] = Query(
+            None,
+            description='Filter stories on epic group ID, comma separated for any of several',
+            alias='filter[epic_group]'
+        ),
+        filter_product: Optional[str] = Query(
+            None,
+            description='Filter stories on product ID, comma separated for any of several',
+            alias='filter[product]'
+        ),
+        filter_created_from: Optional[datetime] = Query(
+            None,
+            description='Only stories created at or after this time, UTC unless given',
+            alias='filter[created_from]'
+        ),
+        filter_created_to: Optional[datetime] = Query(
+            None,
+            description='Only stories created before this time, UTC unless given',
+            alias='filter[created_to]'
+        ),
+        filter_updated_from: Optional[datetime] = Query(
+            None,
+            description='Only stories updated at or after this time, UTC unless given',
+            alias='filter[updated_from]'
+        ),
+        filter_updated_to: Optional[datetime] = Query(
+            None,
+            description='Only stories updated before this time, UTC unless given',
+            alias='filter[updated_to]'
+        ),
+        filter_active: ActiveFilter = Query(
+            ActiveFilter.active,
+            description='Stories still in Shortcut (true), those no longer imported (false) '
+                        'or both (any)',
+            alias='filter[active]'
         )
 ):
     return {'q': q,
@@ -76,33 +154,66 @@ async def search_params(
             'sort[updated]': sort_updated,
             'sort[priority]': sort_priority, 'filter[priority]': filter_priority,
             'sort[period]': sort_period, 'filter[period]': filter_period,
-            'filter[label]': filter_label}
+            'filter[label]': filter_label,
+            'filter[source]': filter_source,
+            'filter[person]': filter_person,
+            'filter[component]': filter_component,
+            'filter[epic_group]': filter_epic_group,
+            'filter[product]': filter_product,
+            'filter[created_from]': filter_created_from and as_utc(filter_created_from),
+            'filter[created_to]': filter_created_to and as_utc(filter_created_to),
+            'filter[updated_from]': filter_updated_from and as_utc(filter_updated_from),
+            'filter[updated_to]': filter_updated_to and as_utc(filter_updated_to),
+            'filter[active]': filter_active}
+
 
+# Date range filters: parameter, story column and whether it is the lower bound
+DATE_FILTERS = (
+    ('filter[created_from]', 'created', True),
+    ('filter[created_to]', 'created', False),
+    ('filter[updated_from]', 'updated', True),
+    ('filter[updated_to]', 'updated', False),
+)
 
-async def apply_story_filters(query: Select, params: dict):
+
+def in_date_ranges(record, params: dict) -> bool:
+    """Whether a story index record passes the date range filters in `params`."""
+    for name, attribute, lower in DATE_FILTERS:
+        if (value := params.get(name)) is not None:
+            if (getattr(record, attribute) < value) == lower:
+                return False
+    return True
+
+
+def apply_story_filters(query: Select, params: dict, db: Session):
+    """
+    Facet filters are resolved to story ids by the facet index and text search
+    by the search index, so they never add joins to the query. Different
+    facets are combined with AND and comma separated values within a facet
+    with OR. Date ranges are plain conditions the indexes on created and
+    updated serve; `_from` bounds are inclusive and `_to` bounds exclusive.
+    Only active stories match unless `filter[active]` says otherwise.
+    """
+    if (story_ids := matching_story_ids(db, params)) is not None:
+        query = query.where(story_id_in(story_ids))
     if value := params.get('q'):
-        query = query.filter(
-            Story.name.ilike(f'%{value}%') | Story.description.ilike(f'%{value}%'))
-    if value := params.get('filter[priority]'):
-        if value.lower() in ('', 'null', 'None', 'saknas'):
-            query = query.filter(
-                ~Story.custom_fields.any(StoryCustomFields.name == 'Priority'))
-        else:
-            query = query.filter(StoryCustomFields.name == 'Priority',
-                                 StoryCustomFields.value.ilike(value))
-    if value := params.get('filter[period]'):
-        if value.lower() in ('', 'null', 'None', 'saknas'):
-            query = query.filter(
-                ~Story.custom_fields.any(StoryCustomFields.name == 'Periodsplanering'))
-        else:
-            query = query.filter(StoryCustomFields.name == 'Periodsplanering',
-                                 StoryCustomFields.value.ilike(value))
-    if value := params.get('filter[label]'):
-        query = query.filter(Label.name == value)
+        query = query.where(story_id_in(search_story_ids(db, value)))
+    for name, attribute, lower in DATE_FILTERS:
+        if (value := params.get(name)) is not None:
+            column = getattr(Story, attribute)
+            query = query.where(column >= value if lower else column < value)
+    if (active := active_filter(params)) is not None:
+        query = query.where(Story.active.is_(active))
     return query
 
 
-async def apply_story_sort(query: Select, params: dict):
+def active_filter(params: dict) -> Optional[bool]:
+    """The `active` value `filter[active]` asks for, None for any."""
+    value = params.get('filter[active]', ActiveFilter.active)
+    return None if value == ActiveFilter.any else value == ActiveFilter.active
+
+
+def apply_story_sort(query: Select, params: dict):
     order = {
         SortOrder.forward: asc,
         SortOrder.reverse: desc
@@ -115,51 +226,165 @@ async def apply_story_sort(query: Select, params: dict):
         query = query.order_by(order[value](Story.created))
     if value := params.get('sort[updated]'):
         query = query.order_by(order[value](Story.updated))
-    return query
+    # Ties in id order, as in the story index, whatever index the filters use
+    return query.order_by(Story.id)
+
+
+# Record attribute of every sort, in the precedence of apply_story_sort and the
+# priority/period sorts done in Python after it
+INDEX_SORTS = (
+    ('sort[name]', 'name'),
+    ('sort[id]', 'id'),
+    ('sort[created]', 'created'),
+    ('sort[updated]', 'updated'),
+    ('sort[priority]', 'priority_rank'),
+    ('sort[period]', 'period_rank'),
+)
+SQL_SORTS = INDEX_SORTS[:4]
+
+
+def sort_records(records: list, params: dict) -> list:
+    """
+    Sort story index records like the SQL path orders stories: the SQL sorts
+    by precedence, then priority and period, each a stable sort of its own.
+    """
+    sql_sorts = [(attribute, params[key]) for key, attribute in SQL_SORTS if params.get(key)]
+    for attribute, value in reversed(sql_sorts):
+        records.sort(key=attrgetter(attribute), reverse=(value == SortOrder.reverse))
+    for key, attribute in INDEX_SORTS[4:]:
+        if value := params.get(key):
+            records.sort(key=attrgetter(attribute), reverse=(value == SortOrder.reverse))
+    return records
+
+
+def normalize_params(params: dict) -> tuple:
+    """Hashable form of search_params, for use as cache key."""
+    return tuple(sorted(
+        (key, value.value if isinstance(value, Enum) else value)
+        for key, value in params.items()
+        if value is not None
+    ))
+
+
+def not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    if if_none_match := request.headers.get('if-none-match'):
+        return etag in (tag.strip() for tag in if_none_match.split(','))
+    if if_modified_since := request.headers.get('if-modified-since'):
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+RELATIONSHIP_FIELDS = {
+    'labels': Story.labels,
+    'persons': Story.persons,
+    'components': Story.components,
+    'epic_groups': Story.epic_groups,
+    'products': Story.products,
+}
+CUSTOM_FIELD_FIELDS = ('priority', 'period')
+
+
+def parse_fields(fields: Optional[str]) -> Optional[frozenset[str]]:
+    if not fields:
+        return None
+    requested = frozenset(field.strip() for field in fields.split(',') if field.strip())
+    if unknown := requested - set(STORY_FIELDS):
+        raise HTTPException(422, detail=f'Unknown fields: {", ".join(sorted(unknown))}')
+    return requested | {'id'}
+
+
+def story_load_options(fields: frozenset[str]) -> list:
+    """
+    Load only the columns in `fields` and eagerly load the relationships in
+    it, so serializing the stories needs no further queries.
+    """
+    columns = [getattr(Story, name) for name in fields if name in Story.__table__.columns]
+    options = [load_only(*columns)]
+    for name, relationship in RELATIONSHIP_FIELDS.items():
+        if name in fields:
+            options.append(selectinload(relationship))
+    if fields.intersection(CUSTOM_FIELD_FIELDS):
+        options.append(selectinload(Story.custom_fields)
+                       .joinedload(StoryCustomFields.custom_field_value)
+                       .joinedload(CustomFieldValue.field))
+    return options
 
 
-def prio_sort(prio):
-    match prio:
-        case 'High':
-            return 4
-        case 'Medium':
-            return 3
-        case 'Low':
-            return 2
-        case None | 'None' | _:
-            return 1
-
-
-def period_sort(period):
-    match period:
-        case 'P1 2024':
-            return 1
-        case 'P2 2024':
-            return 2
-        case 'P3 2024':
-            return 3
-        case 'Kanske nästa period':
-            return 4
-        case 'Kanske efter nästa period':
-            return 5
-        case None | 'None' | _:
-            return 6
+# Identical backlog requests in flight share one computation and its encoded body
+backlog_requests = Coalescer('backlog')
 
 
 @router.get('/backlog')
-async def get_backlog(params: dict = Depends(search_params),
-                      db: Session = Depends(get_db)) -> BacklogResponse:
-    query = select(Story) \
-        .join(Label, Story.labels, isouter=True) \
-        .join(StoryCustomFields, Story.custom_fields, isouter=True) \
-        .join(Person, Story.persons, isouter=True)
+async def get_backlog(request: Request,
+                      since: Optional[int] = Query(
+                          None,
+                          description='Only return stories changed after this version, '
+                                      'and the ids of changed stories that no longer match'
+                      ),
+                      fields: Optional[str] = Query(
+                          None,
+                          description='Comma separated story fields to return, e.g. '
+                                      'id,name,priority,labels (default all but description)'
+                      ),
+                      offset: int = Query(0, ge=0, description='Matching stories to skip'),
+                      limit: Optional[int] = Query(
+                          None, ge=1,
+                          description='Most stories to return (default all); `count` is '
+                                      'still the number of matching stories'
+                      ),
+                      params: dict = Depends(search_params)) -> BacklogResponse:
+    sparse_fields = parse_fields(fields)
+    # Checked before touching the database, so an idle poll is nearly free
+    headers = {
+        'ETag': generation.etag(normalize_params(params), since,
+                                sorted(sparse_fields or ()), offset, limit),
+        'Last-Modified': formatdate(generation.changed_at, usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+    if not_modified(request, headers['ETag'], generation.changed_at):
+        return Response(status_code=304, headers=headers)
+
+    # The ETag covers the parameters and the data generation, so requests with
+    # the same one would compute the same body
+    body = await backlog_requests.run(headers['ETag'], lambda: run_in_threadpool(
+        backlog_body, params, since, sparse_fields, offset, limit))
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def backlog_body(params: dict, since: Optional[int], sparse_fields: Optional[frozenset[str]],
+                 offset: int, limit: Optional[int]) -> bytes:
+    """The backlog response as JSON, on a session of its own as it may be shared."""
+    with SessionLocal() as db:
+        if config.story_index:
+            return index_backlog(db, params, since, sparse_fields, offset, limit)
+        return sql_backlog(db, params, since, sparse_fields, offset, limit)
+
+
+def sql_backlog(db: Session, params: dict, since: Optional[int],
+                sparse_fields: Optional[frozenset[str]], offset: int,
+                limit: Optional[int]) -> bytes:
+    load_fields = set(sparse_fields or LIST_FIELDS)
+    if params.get('sort[priority]'):
+        load_fields.add('priority')
+    if params.get('sort[period]'):
+        load_fields.add('period')
+    query = select(Story).options(*story_load_options(frozenset(load_fields)))
 
     total = db.execute(select(func.count(Story.id))).scalar()
+    version = db.execute(select(func.max(Story.version))).scalar() or 0
 
-    query = await apply_story_filters(query, params)
-    query = await apply_story_sort(query, params)
+    changed = None
+    if since is not None:
+        changed = list(db.scalars(select(Story.id).where(Story.version > since)))
+        query = query.where(id_in(Story.id, changed))
 
-    matching = db.execute(query).unique().scalars().all()
+    query = apply_story_filters(query, params, db)
+    query = apply_story_sort(query, params)
+
+    matching = db.execute(query).scalars().all()
 
     if value := params.get('sort[priority]'):
         matching = sorted(matching, key=lambda c: prio_sort(c.priority),
@@ -167,8 +392,205 @@ async def get_backlog(params: dict = Depends(search_params),
     if value := params.get('sort[period]'):
         matching = sorted(matching, key=lambda c: period_sort(c.period),
                           reverse=(value == SortOrder.reverse))
-    return {
-        'items': matching,
+    result = {
+        'items': matching[offset:None if limit is None else offset + limit],
         'count': len(matching),
-        'total': total
+        'total': total,
+        'version': version
+    }
+    if changed is not None:
+        result['removed'] = sorted(set(changed) - {story.id for story in matching})
+    model = BacklogResponse if sparse_fields is None else sparse_backlog_model(sparse_fields)
+    return model.model_validate(result, from_attributes=True).model_dump_json().encode()
+
+
+def index_backlog(db: Session, params: dict, since: Optional[int],
+                  sparse_fields: Optional[frozenset[str]], offset: int,
+                  limit: Optional[int]) -> bytes:
+    """The backlog response answered from the story index."""
+    story_index.ensure_current(db)
+    story_ids = matching_story_ids(db, params)
+    if value := params.get('q'):
+        found = search_story_ids(db, value)
+        story_ids = found if story_ids is None else sorted(set(story_ids).intersection(found))
+    matching = story_index.select(story_ids, since, active_filter(params))
+    if any(params.get(name) is not None for name, *_ in DATE_FILTERS):
+        matching = [record for record in matching if in_date_ranges(record, params)]
+    matching = sort_records(matching, params)
+    removed = None
+    if since is not None:
+        matching_ids = {record.id for record in matching}
+        removed = [record.id for record in story_index.select(since=since)
+                   if record.id not in matching_ids]
+    page = matching[offset:None if limit is None else offset + limit]
+    descriptions = None
+    if sparse_fields is not None and 'description' in sparse_fields:
+        descriptions = read_descriptions(db, [record.id for record in page])
+    return encode_backlog(page, sparse_fields, len(matching), len(story_index.records),
+                          story_index.version, removed, descriptions)
+
+
+search_debouncer = Debouncer(config.search_debounce)
+
+
+@router.get('/search')
+async def search_stories(
+        q: str = Query(..., min_length=1, description='Words to search for',
+                       examples='tidsbokning'),
+        match: SearchMode = Query(
+            SearchMode.fuzzy,
+            description='fuzzy: similar words, tolerating typos; prefix: words starting '
+                        'with the query words; substring: the query anywhere'
+        ),
+        limit: int = Query(20, ge=1, le=200),
+        filter_active: ActiveFilter = Query(
+            ActiveFilter.active,
+            description='Stories still in Shortcut (true), those no longer imported (false) '
+                        'or both (any)',
+            alias='filter[active]'
+        ),
+        client: Optional[str] = Header(
+            None, alias='X-Search-Client',
+            description='Id of the search box sending the query. A newer search with '
+                        'the same id cancels this one, which then gets 409, and searches '
+                        'with an id wait SEARCH_DEBOUNCE seconds for newer ones first'
+        ),
+        db: Session = Depends(get_db)) -> list[SearchResult]:
+    """Stories whose name, labels or description match `q`, best match first."""
+    def run_search():
+        search_index.ensure_current(db)
+        return search_index.search(q, match, config.search_similarity,
+                                   active=active_filter({'filter[active]': filter_active}))[:limit]
+
+    async def search():
+        return await run_in_threadpool(run_search)
+
+    if client is None:
+        hits = await search()
+    else:
+        try:
+            hits = await search_debouncer.run(client, search)
+        except Superseded:
+            metrics.search_requests.inc(mode=match.value, result='superseded')
+            raise HTTPException(409, detail='Superseded by a newer search')
+    metrics.search_requests.inc(mode=match.value, result='ok')
+    return [{'id': hit.id, 'name': hit.name, 'score': hit.score} for hit in hits]
+
+
+stats_cache = GenerationCache('backlog_stats', generation)
+
+LINKED_FACETS = (
+    ('label', story_labels, story_labels.c.label_id, Label),
+    ('person', story_persons, story_persons.c.person_id, Person),
+    ('component', story_components, story_components.c.component_id, Component),
+    ('epic_group', story_epic_groups, story_epic_groups.c.epic_group_id, EpicGroup),
+    ('product', story_products, story_products.c.product_id, Product),
+)
+CUSTOM_FIELD_FACETS = (
+    ('priority', 'Priority'),
+    ('period', 'Periodsplanering'),
+)
+
+
+def facet_query(matching) -> Select:
+    """
+    Story counts for every facet value among the stories in `matching` (a CTE
+    of story ids), as one UNION ALL of GROUP BY queries.
+    """
+    story_ids = select(matching.c.id)
+    queries = [
+        select(literal('total').label('facet'), literal('total').label('value'),
+               func.count().label('count'))
+        .select_from(matching),
+        select(literal('source'), Story.source, func.count())
+        .where(Story.id.in_(story_ids))
+        .group_by(Story.source),
+    ]
+    for facet, field_name in CUSTOM_FIELD_FACETS:
+        queries.append(
+            select(literal(facet), CustomFieldValue.value,
+                   func.count(distinct(StoryCustomFields.story_id)))
+            .join(CustomFieldValue,
+                  StoryCustomFields.custom_field_value_id == CustomFieldValue.value_id)
+            .join(CustomField, CustomFieldValue.field_id == CustomField.id)
+            .where(CustomField.name == field_name,
+                   StoryCustomFields.story_id.in_(story_ids))
+            .group_by(CustomFieldValue.value))
+    for facet, table, column, model in LINKED_FACETS:
+        queries.append(
+            select(literal(facet), model.name, func.count(distinct(table.c.story_id)))
+            .select_from(table)
+            .join(model, column == model.id)
+            .where(table.c.story_id.in_(story_ids))
+            .group_by(model.name))
+    return union_all(*queries)
+
+
+async def get_stats(db: Session, params: dict) -> dict:
+    matching = apply_story_filters(select(Story.id), params, db).cte('matching')
+
+    facets = {facet: [] for facet in ('source', 'priority', 'period',
+                                      *(facet for facet, *_ in LINKED_FACETS))}
+    count = 0
+    for facet, value, value_count in db.execute(facet_query(matching)):
+        if facet == 'total':
+            count = value_count
+        else:
+            facets[facet].append({'value': value, 'count': value_count})
+
+    for facet, _field_name in CUSTOM_FIELD_FACETS:
+        if missing := count - sum(item['count'] for item in facets[facet]):
+            facets[facet].append({'value': None, 'count': missing})
+    for items in facets.values():
+        items.sort(key=lambda item: (-item['count'], str(item['value'])))
+
+    return {
+        'count': count,
+        'total': db.execute(select(func.count(Story.id))).scalar(),
+        'facets': facets,
     }
+
+
+@router.get('/backlog/stats')
+async def get_backlog_stats(params: dict = Depends(search_params),
+                            db: Session = Depends(get_db)) -> BacklogStats:
+    key = normalize_params({key: value for key, value in params.items()
+                            if not key.startswith('sort[')})
+    if (stats := stats_cache.get(key)) is None:
+        current = generation()
+        stats = await get_stats(db, params)
+        stats_cache.set(key, stats, generation=current)
+    return stats
+
+
+@router.get('/sources')
+async def get_sources(db: Session = Depends(get_db)) -> list[SourceCount]:
+    query = select(Story.source, func.count(Story.id)) \
+        .where(Story.active) \
+        .group_by(Story.source) \
+        .order_by(Story.source)
+    return [{'source': source, 'count': count}
+            for source, count in db.execute(query)]
+
+
+@router.get('/backlog/history')
+async def get_backlog_history(
+        facet: List[str] = Query(
+            ['total', 'priority', 'period', 'label'],
+            description=f'Facets to count stories on, any of {", ".join(FACETS)}'
+        ),
+        taken_from: Optional[datetime] = Query(
+            None,
+            description='Only snapshots taken at or after this time',
+            alias='from'
+        ),
+        taken_to: Optional[datetime] = Query(
+            None,
+            description='Only snapshots taken at or before this time',
+            alias='to'
+        ),
+        db: Session = Depends(get_db)) -> list[BacklogSnapshot]:
+    if unknown := set(facet) - set(FACETS):
+        raise HTTPException(422, detail=f'Unknown facets: {", ".join(sorted(unknown))}')
+    return get_history(db, facet, taken_from and as_utc(taken_from),
+                       taken_to and as_utc(taken_to))
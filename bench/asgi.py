@@ -0,0 +1,119 @@
+"""
+Minimal in-process ASGI client, so benchmarks exercise routing, validation and
+serialization without a socket in between.
+"""
+import asyncio
+import json
+from urllib.parse import urlencode
+
+
+class Response(object):
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ASGIClient(object):
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan = None
+        self._lifespan_queue = None
+        self._lifespan_events = None
+
+    async def __aenter__(self):
+        await self.startup()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.shutdown()
+
+    async def startup(self):
+        self._lifespan_queue = asyncio.Queue()
+        self._lifespan_events = asyncio.Queue()
+
+        async def receive():
+            return await self._lifespan_queue.get()
+
+        async def send(message):
+            await self._lifespan_events.put(message)
+
+        self._lifespan = asyncio.create_task(
+            self.app({'type': 'lifespan', 'asgi': {'version': '3.0'}, 'state': {}},
+                     receive, send))
+        await self._lifespan_queue.put({'type': 'lifespan.startup'})
+        message = await self._lifespan_events.get()
+        if message['type'] != 'lifespan.startup.complete':
+            raise RuntimeError(f'Startup failed: {message}')
+
+    async def shutdown(self):
+        if self._lifespan is None:
+            return
+        await self._lifespan_queue.put({'type': 'lifespan.shutdown'})
+        await self._lifespan_events.get()
+        await self._lifespan
+        self._lifespan = None
+
+    async def request(self, method, path, params=None, headers=None, body=b''):
+        query_string = urlencode(params or {}, doseq=True).encode()
+        raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        if body:
+            raw_headers.append((b'content-length', str(len(body)).encode()))
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': query_string,
+            'headers': raw_headers,
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        request_sent = False
+        status = None
+        response_headers = {}
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers.update((k.decode().lower(), v.decode())
+                                        for k, v in message.get('headers', []))
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, receive, send)
+        return Response(status, response_headers, b''.join(chunks))
+
+    async def get(self, path, params=None, headers=None):
+        return await self.request('GET', path, params=params, headers=headers)
+
+    async def post(self, path, json_body=None, headers=None):
+        headers = dict(headers or {}, **{'content-type': 'application/json'})
+        return await self.request('POST', path, headers=headers,
+                                  body=json.dumps(json_body).encode())
+
+    async def put(self, path, json_body=None, headers=None):
+        headers = dict(headers or {}, **{'content-type': 'application/json'})
+        body = json.dumps(json_body).encode() if json_body is not None else b''
+        return await self.request('PUT', path, headers=headers, body=body)
+
+    async def delete(self, path, headers=None):
+        return await self.request('DELETE', path, headers=headers)
@@ -0,0 +1,117 @@
+"""
+Seeded generator for synthetic backlogs shaped like the Shortcut API.
+
+The same seed and size always produce the same labels, custom fields and
+stories, so benchmark runs against different commits are comparable.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+WORDS = ('tidsbokning', 'faktura', 'kundportal', 'inloggning', 'rapport', 'export',
+         'betalning', 'avisering', 'sök', 'filter', 'behörighet', 'kalender',
+         'mobil', 'prestanda', 'import', 'integration', 'översikt', 'historik',
+         'admin', 'profil', 'notifiering', 'schema', 'dashboard', 'statistik')
+
+LABEL_NAMES = ('frontend', 'backend', 'ux', 'bug', 'teknisk skuld', 'säkerhet',
+               'kund', 'intern', 'api', 'mobil', 'prestanda', 'tillgänglighet',
+               'data', 'infrastruktur', 'dokumentation', 'support')
+
+PRIORITIES = ('High', 'Medium', 'Low')
+PERIODS = ('P1 2024', 'P2 2024', 'P3 2024', 'Kanske nästa period', 'Kanske efter nästa period')
+TEAMS = ('Alfa', 'Beta', 'Gamma', 'Delta')
+
+PERSONS = ('Anna', 'Bertil', 'Cecilia', 'David', 'Eva', 'Fredrik', 'Greta', 'Hugo')
+COMPONENTS = ('Kundportal', 'Bokning', 'Fakturering', 'Rapporter', 'Integrationer')
+EPIC_GROUPS = ('Onboarding', 'Självservice', 'Effektivisering')
+PRODUCTS = ('Webb', 'App', 'API')
+
+STATE = 'Önskemål'
+
+
+class BacklogGenerator(object):
+
+    def __init__(self, seed=1, stories=1000, states=(STATE,)):
+        self.seed = seed
+        self.story_count = stories
+        self.states = tuple(states)
+        self._labels = None
+        self._fields = None
+        self._stories = None
+
+    def labels(self):
+        if self._labels is None:
+            self._labels = [{'id': 1000 + index, 'name': name}
+                            for index, name in enumerate(LABEL_NAMES)]
+        return self._labels
+
+    def custom_fields(self):
+        if self._fields is None:
+            self._fields = [
+                self._field('priority', 'Priority', PRIORITIES),
+                self._field('period', 'Periodsplanering', PERIODS),
+                self._field('team', 'Team', TEAMS),
+            ]
+        return self._fields
+
+    @staticmethod
+    def _field(key, name, values):
+        return {'id': f'field-{key}',
+                'name': name,
+                'values': [{'id': f'field-{key}-{index}', 'value': value}
+                           for index, value in enumerate(values)]}
+
+    def stories(self):
+        if self._stories is None:
+            rng = random.Random(self.seed)
+            self._stories = [self._story(rng, index) for index in range(self.story_count)]
+        return self._stories
+
+    def _story(self, rng, index):
+        story_id = 10000 + index
+        created = datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(
+            minutes=rng.randrange(0, 60 * 24 * 500))
+        updated = created + timedelta(minutes=rng.randrange(0, 60 * 24 * 90))
+        name = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        description = '\n\n'.join(
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+            for _ in range(rng.randint(0, 8))
+        )
+        labels = rng.sample(self.labels(), k=min(len(self.labels()),
+                                                 int(rng.expovariate(0.8))))
+        custom_fields = []
+        for field, probability in zip(self.custom_fields(), (0.8, 0.6, 0.5)):
+            if rng.random() < probability:
+                value = rng.choice(field['values'])
+                custom_fields.append({'field_id': field['id'],
+                                      'value_id': value['id'],
+                                      'value': value['value']})
+        return {
+            'id': story_id,
+            'name': name,
+            'app_url': f'https://app.shortcut.com/bench/story/{story_id}',
+            'created_at': created.isoformat().replace('+00:00', 'Z'),
+            'updated_at': updated.isoformat().replace('+00:00', 'Z'),
+            'description': description,
+            'labels': [{'id': label['id'], 'name': label['name']} for label in labels],
+            'custom_fields': custom_fields,
+            'workflow_state': rng.choice(self.states),
+        }
+
+    def links(self):
+        """
+        Locally administrated links as {kind: (names, [(story_id, index), ...])},
+        where index points into names.
+        """
+        rng = random.Random(self.seed + 1)
+        result = {}
+        for kind, names, probability in (('persons', PERSONS, 0.5),
+                                         ('components', COMPONENTS, 0.4),
+                                         ('epic_groups', EPIC_GROUPS, 0.2),
+                                         ('products', PRODUCTS, 0.3)):
+            pairs = []
+            for story in self.stories():
+                if rng.random() < probability:
+                    for index in rng.sample(range(len(names)), k=rng.randint(1, 2)):
+                        pairs.append((story['id'], index))
+            result[kind] = (names, pairs)
+        return result
@@ -0,0 +1,441 @@
+"""
+Load generator for the HTTP API, driven by a scenario file.
+
+A scenario is a JSON file with a weighted mix of requests, sent by `users`
+concurrent virtual users for `duration` seconds, and optionally an import
+running in the background all along:
+
+    {
+      "users": 16,
+      "duration": 30,
+      "warmup": 3,
+      "think_time": 0.05,
+      "import": {"interval": 5, "touch": 50},
+      "requests": [
+        {"name": "backlog", "weight": 40, "path": "/shortcut/backlog",
+         "params": {"sort[priority]": ["reverse", "forward", null],
+                    "filter[label]": ["{label}", null]}},
+        {"name": "story", "weight": 30, "path": "/stories/{story}"},
+        {"name": "link", "weight": 5, "method": "PUT",
+         "path": "/stories/{story}/person/{person}"}
+      ]
+    }
+
+Each request is picked with probability proportional to its `weight`.
+Paths and parameter values may contain placeholders:
+- {story}: a random story id
+- {person}, {component}, {epic_group}, {product}: a random entity id
+- {label}, {priority}, {period}, {word}: a random value from the
+  synthetic backlog
+- {date}: a random day when stories of the synthetic backlog were updated
+- {date+N}: N days after the {date} of the same request
+
+A list picks one of its values at random, and null leaves the parameter
+out. `expect` lists the statuses that count as success, by default [200].
+The import runs every `interval` seconds. Before each run it changes the
+names and update times of `touch` stories in the mock, so that the import
+has something to write. 409 (another import running) counts as success.
+
+The requests go to the app in-process through ASGI by default, with no
+network. `--uvicorn N` serves it with N uvicorn workers on a local port
+instead, and `--url` targets a running server. Both use real HTTP. The
+first two modes start the mock Shortcut API and a throwaway database and
+import the backlog before loading. With `--url` the server imports from
+whatever it is configured with.
+
+    python -m bench.load bench/scenarios/mixed.json --stories 2000
+    python -m bench.load bench/scenarios/mixed.json --uvicorn 2 --output load.json
+
+Reported per request name and in total: requests, throughput, latency
+percentiles and error rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import aiohttp
+
+from app.core.config import ROOT
+from bench.generator import BacklogGenerator, WORDS, PRIORITIES, PERIODS, LABEL_NAMES, STATE
+from bench.mock_shortcut import MockShortcut
+from bench.run import git_revision
+from bench.workers import free_port, wait_ready
+
+PLACEHOLDER_RE = re.compile(r'\{(\w+)(?:\+(\d+))?\}')
+ENTITIES = {
+    'person': '/persons',
+    'component': '/components',
+    'epic_group': '/epic-groups',
+    'product': '/products',
+}
+CHOICES = {
+    'label': LABEL_NAMES,
+    'priority': PRIORITIES,
+    'period': PERIODS,
+    'word': WORDS,
+}
+ENTITY_COUNT = 8
+# The synthetic stories are updated between these days
+FIRST_DAY = datetime(2023, 1, 1, tzinfo=timezone.utc)
+DAYS = 590
+IMPORT_PATH = '/admin/shortcut/backlog'
+PERCENTILES = (50, 90, 95, 99)
+
+
+class AsgiTarget(object):
+    """Requests to the app in-process, through bench.asgi."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None,
+                      json_body=None) -> tuple[int, bytes]:
+        headers, body = {}, b''
+        if json_body is not None:
+            headers['content-type'] = 'application/json'
+            body = json.dumps(json_body).encode()
+        response = await self.client.request(method, path, params=params, headers=headers,
+                                             body=body)
+        return response.status, response.body
+
+
+class HttpTarget(object):
+    """Requests over HTTP to the server at `url`."""
+
+    def __init__(self, session: aiohttp.ClientSession, url: str):
+        self.session = session
+        self.url = url.rstrip('/')
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None,
+                      json_body=None) -> tuple[int, bytes]:
+        async with self.session.request(method, self.url + path, params=params,
+                                        json=json_body) as response:
+            return response.status, await response.read()
+
+
+class Stats(object):
+    __slots__ = ('latencies', 'errors', 'statuses')
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.statuses: dict[str, int] = {}
+
+    def add(self, latency: float, status, ok: bool):
+        self.latencies.append(latency)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def merge(self, other: 'Stats'):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def summary(self, elapsed: float) -> dict:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        result = {
+            'requests': count,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'errors': self.errors,
+            'error_rate': self.errors / count if count else 0.0,
+            'statuses': dict(sorted(self.statuses.items())),
+        }
+        for percentile in PERCENTILES:
+            result[f'p{percentile}'] = \
+                ordered[min(count - 1, count * percentile // 100)] if ordered else None
+        result['max'] = ordered[-1] if ordered else None
+        return result
+
+
+class Values(object):
+    """Random values for the placeholders of a scenario."""
+
+    def __init__(self, story_ids: list[int], entity_ids: dict[str, list[int]]):
+        self.story_ids = story_ids
+        self.entity_ids = entity_ids
+
+    def value(self, rng: random.Random, name: str, days: Optional[str], state: dict) -> str:
+        if name == 'story':
+            return str(rng.choice(self.story_ids))
+        if name in self.entity_ids:
+            return str(rng.choice(self.entity_ids[name]))
+        if name in CHOICES:
+            return rng.choice(CHOICES[name])
+        if name == 'date':
+            if days is None:
+                state['date'] = FIRST_DAY + timedelta(days=rng.randrange(DAYS))
+                return state['date'].date().isoformat()
+            day = state.get('date', FIRST_DAY) + timedelta(days=int(days))
+            return day.date().isoformat()
+        raise ValueError(f'Unknown placeholder {{{name}}}')
+
+    def fill(self, rng: random.Random, template: str, state: dict) -> str:
+        return PLACEHOLDER_RE.sub(
+            lambda match: self.value(rng, match.group(1), match.group(2), state), template)
+
+    def request(self, rng: random.Random, spec: dict) -> tuple[str, dict]:
+        """The path and query parameters of a request of `spec`."""
+        state = {}
+        path = self.fill(rng, spec['path'], state)
+        params = {}
+        for name, value in spec.get('params', {}).items():
+            if isinstance(value, list):
+                value = rng.choice(value)
+            if value is not None:
+                params[name] = self.fill(rng, str(value), state)
+        return path, params
+
+
+def load_scenario(path: str) -> dict:
+    with open(path) as fh:
+        scenario = json.load(fh)
+    if not scenario.get('requests'):
+        raise ValueError(f'{path}: a scenario needs requests')
+    for spec in scenario['requests']:
+        if 'name' not in spec or 'path' not in spec:
+            raise ValueError(f'{path}: every request needs a name and a path')
+        spec.setdefault('method', 'GET')
+        spec.setdefault('weight', 1)
+        spec['expect'] = set(spec.get('expect', [200]))
+    scenario.setdefault('users', 8)
+    scenario.setdefault('duration', 30)
+    scenario.setdefault('warmup', 0)
+    scenario.setdefault('think_time', 0)
+    return scenario
+
+
+def touch_stories(generator: BacklogGenerator, rng: random.Random, count: int):
+    """Rename and update some stories in the mock, as users of Shortcut would."""
+    now = datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+    stories = generator.stories()
+    for story in rng.sample(stories, min(count, len(stories))):
+        story['name'] = f'{story["name"].split(" #")[0]} #{rng.randrange(1000)}'
+        story['updated_at'] = now
+
+
+async def prepare(target) -> Values:
+    """The ids of the stories, and of entities to link them to, created if there are few."""
+    entity_ids = {}
+    for name, path in ENTITIES.items():
+        status, body = await target.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f'GET {path} returned {status}: {body[:200]!r}')
+        ids = [item['id'] for item in json.loads(body)]
+        for index in range(len(ids), ENTITY_COUNT):
+            status, body = await target.request('POST', path,
+                                                json_body={'name': f'Load {name} {index}'})
+            if status != 200:
+                raise RuntimeError(f'POST {path} returned {status}: {body[:200]!r}')
+            ids.append(json.loads(body)['id'])
+        entity_ids[name] = ids
+    status, body = await target.request('GET', '/shortcut/backlog', {'fields': 'id'})
+    if status != 200:
+        raise RuntimeError(f'GET /shortcut/backlog returned {status}: {body[:200]!r}')
+    story_ids = [item['id'] for item in json.loads(body)['items']]
+    if not story_ids:
+        raise RuntimeError('There are no stories to load test with, import some first')
+    return Values(story_ids, entity_ids)
+
+
+async def timed(target, method: str, path: str, params: dict) -> tuple[float, object]:
+    """Latency and status of a request; the status of a failed request is its exception."""
+    start = time.perf_counter()
+    try:
+        status, _body = await target.request(method, path, params)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status = type(e).__name__
+    return time.perf_counter() - start, status
+
+
+async def user(target, scenario: dict, values: Values, rng: random.Random,
+               stats: dict[str, Stats], measure_from: float, deadline: float):
+    """A virtual user sending requests of the mix one after the other until `deadline`."""
+    specs = scenario['requests']
+    weights = [spec['weight'] for spec in specs]
+    while time.monotonic() < deadline:
+        spec = rng.choices(specs, weights)[0]
+        path, params = values.request(rng, spec)
+        started = time.monotonic()
+        latency, status = await timed(target, spec['method'], path, params)
+        if started >= measure_from:
+            stats[spec['name']].add(latency, status, status in spec['expect'])
+        if scenario['think_time']:
+            await asyncio.sleep(rng.expovariate(1 / scenario['think_time']))
+
+
+async def imports(target, spec: dict, generator: Optional[BacklogGenerator],
+                  rng: random.Random, stats: Stats, measure_from: float, deadline: float):
+    """Import every `interval` seconds until `deadline`, changing the mock's stories first."""
+    while time.monotonic() < deadline:
+        if generator is not None and spec.get('touch'):
+            touch_stories(generator, rng, spec['touch'])
+        started = time.monotonic()
+        latency, status = await timed(target, 'GET', IMPORT_PATH, {})
+        if started >= measure_from:
+            stats.add(latency, status, status in (200, 409))
+        await asyncio.sleep(min(spec.get('interval', 10),
+                                max(0.0, deadline - time.monotonic())))
+
+
+async def run_scenario(target, scenario: dict, generator: Optional[BacklogGenerator],
+                       seed: int) -> dict:
+    values = await prepare(target)
+    stats = {spec['name']: Stats() for spec in scenario['requests']}
+    import_stats = Stats()
+    start = time.monotonic()
+    measure_from = start + scenario['warmup']
+    deadline = measure_from + scenario['duration']
+    tasks = [user(target, scenario, values, random.Random(seed * 1000 + index), stats,
+                  measure_from, deadline)
+             for index in range(scenario['users'])]
+    if scenario.get('import'):
+        tasks.append(imports(target, scenario['import'], generator, random.Random(seed),
+                             import_stats, measure_from, deadline))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - measure_from
+
+    total = Stats()
+    for name_stats in stats.values():
+        total.merge(name_stats)
+    results = {name: name_stats.summary(elapsed) for name, name_stats in stats.items()}
+    results['total'] = total.summary(elapsed)
+    if scenario.get('import'):
+        results['import'] = import_stats.summary(elapsed)
+    return {'elapsed': elapsed, 'stories': len(values.story_ids), 'requests': results}
+
+
+async def initial_import(target):
+    status, body = await target.request('GET', IMPORT_PATH)
+    if status != 200:
+        raise RuntimeError(f'Import returned {status}: {body[:200]!r}')
+
+
+async def run(args) -> dict:
+    scenario = load_scenario(args.scenario)
+    for name in ('users', 'duration', 'warmup'):
+        if getattr(args, name) is not None:
+            scenario[name] = getattr(args, name)
+
+    generator = None
+    mock = None
+    if args.url is None:
+        generator = BacklogGenerator(seed=args.seed, stories=args.stories, states=[STATE])
+        mock = MockShortcut(generator, latency=args.latency)
+        shortcut_url = await mock.start()
+        workdir = tempfile.mkdtemp(prefix='backlog-load-')
+        env = {'DATABASE_URL': f'sqlite:///{workdir}/load.db', 'SHORTCUT_URL': shortcut_url,
+               'SHORTCUT_STATES': STATE, 'SHORTCUT_TOKEN': 'bench', 'LOG_LEVEL': 'WARNING'}
+
+    try:
+        if args.url is None and args.uvicorn is None:
+            target_name = 'asgi'
+            os.environ.update(env)
+            # The schema is created by the migrations in the app's lifespan
+            from app.main import app
+            from bench.asgi import ASGIClient
+
+            async with ASGIClient(app) as client:
+                target = AsgiTarget(client)
+                await initial_import(target)
+                result = await run_scenario(target, scenario, generator, args.seed)
+        else:
+            timeout = aiohttp.ClientTimeout(total=120)
+            connector = aiohttp.TCPConnector(limit=scenario['users'] + 8)
+            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+                if args.url is not None:
+                    target_name = args.url
+                    target = HttpTarget(session, args.url)
+                    result = await run_scenario(target, scenario, None, args.seed)
+                else:
+                    target_name = f'uvicorn --workers {args.uvicorn}'
+                    port = free_port()
+                    server = subprocess.Popen(
+                        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                         '--workers', str(args.uvicorn), '--log-level', 'warning',
+                         '--no-access-log'],
+                        cwd=ROOT, env=dict(os.environ, **env))
+                    try:
+                        target = HttpTarget(session, f'http://127.0.0.1:{port}')
+                        await wait_ready(session, target.url)
+                        await initial_import(target)
+                        result = await run_scenario(target, scenario, generator, args.seed)
+                    finally:
+                        server.terminate()
+                        server.wait(timeout=30)
+    finally:
+        if mock is not None:
+            await mock.stop()
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'scenario': args.scenario,
+            'target': target_name,
+            'seed': args.seed,
+            'stories': result['stories'],
+            'latency': args.latency if args.url is None else None,
+            'users': scenario['users'],
+            'duration': scenario['duration'],
+            'warmup': scenario['warmup'],
+            'elapsed': result['elapsed'],
+            'shortcut_requests': mock.requests if mock is not None else None,
+        },
+        'requests': result['requests'],
+    }
+
+
+def report(result: dict):
+    meta = result['meta']
+    print(f'{meta["scenario"]} against {meta["target"]}: {meta["stories"]} stories, '
+          f'{meta["users"]} users, {meta["elapsed"]:.1f} s')
+    print(f'{"request":16} {"count":>7} {"req/s":>8} {"p50 ms":>8} {"p90 ms":>8} '
+          f'{"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} {"errors":>7} {"rate":>7}')
+    for name, stats in result['requests'].items():
+        latencies = ' '.join(f'{stats[key] * 1000:8.1f}' if stats[key] is not None
+                             else f'{"-":>8}'
+                             for key in (*(f'p{p}' for p in PERCENTILES), 'max'))
+        print(f'{name:16} {stats["requests"]:7} {stats["throughput"]:8.1f} {latencies} '
+              f'{stats["errors"]:7} {stats["error_rate"]:7.2%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mixed load on the API from a scenario file')
+    parser.add_argument('scenario', help='Scenario JSON file, e.g. bench/scenarios/mixed.json')
+    parser.add_argument('--stories', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds the mock Shortcut API waits before each response')
+    parser.add_argument('--users', type=int, help='Override the scenario\'s users')
+    parser.add_argument('--duration', type=float, help='Override the scenario\'s duration')
+    parser.add_argument('--warmup', type=float, help='Override the scenario\'s warmup')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--uvicorn', type=int, metavar='WORKERS',
+                        help='Serve the app with uvicorn and this many workers')
+    target.add_argument('--url', help='Load a running server instead')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Local stand-in for the parts of the Shortcut API the importer uses:
+/search/stories (with next-token paging), /labels and /custom-fields.
+
+Every response is delayed by `latency` seconds to model the network.
+
+    python -m bench.mock_shortcut --stories 5000 --latency 0.05 --port 8765
+"""
+import argparse
+import asyncio
+import re
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+from bench.generator import BacklogGenerator, STATE
+
+STATE_RE = re.compile(r'state:"([^"]*)"')
+
+
+class MockShortcut(object):
+
+    def __init__(self, generator: BacklogGenerator, latency=0.0, max_page_size=25):
+        self.generator = generator
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get('/api/v3/search/stories', self.search_stories)
+        self.app.router.add_get('/api/v3/labels', self.labels)
+        self.app.router.add_get('/api/v3/custom-fields', self.custom_fields)
+        self._runner = None
+        self.url = None
+
+    async def _delay(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def search_stories(self, request: web.Request):
+        await self._delay()
+        query = request.query.get('query', '')
+        page_size = min(int(request.query.get('page_size', 25)), self.max_page_size)
+        offset = int(request.query.get('next', 0) or 0)
+
+        stories = self.generator.stories()
+        if match := STATE_RE.search(query):
+            stories = [story for story in stories
+                       if story['workflow_state'] == match.group(1)]
+        page = stories[offset:offset + page_size]
+        next_offset = offset + page_size
+        next_url = None
+        if next_offset < len(stories):
+            params = urlencode({'query': query, 'page_size': page_size, 'next': next_offset})
+            next_url = f'/api/v3/search/stories?{params}'
+        return web.json_response({'data': page, 'next': next_url, 'total': len(stories)})
+
+    async def labels(self, request: web.Request):
+        await self._delay()
+        return web.json_response(self.generator.labels())
+
+    async def custom_fields(self, request: web.Request):
+        await self._delay()
+        return web.json_response(self.generator.custom_fields())
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://{host}:{port}/api/v3'
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Shortcut API')
+    parser.add_argument('--stories', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--states', type=lambda value: value.split(','), default=[STATE])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    mock = MockShortcut(BacklogGenerator(seed=args.seed, stories=args.stories,
+                                         states=args.states),
+                        latency=args.latency)
+    print(f'Serving {args.stories} stories on http://{args.host}:{args.port}/api/v3')
+    web.run_app(mock.app, host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""
+Benchmark harness for the import pipeline and the backlog endpoints.
+
+Starts a mock Shortcut API serving a seeded synthetic backlog, points the app
+at it and a throwaway SQLite database, then runs each scenario through the
+ASGI app in-process and writes timings as JSON.
+
+    python -m bench.run --stories 10000 --latency 0.02 --output results.json
+    python -m bench.run --compare before.json after.json
+
+Pass --story-index to answer the backlog from the in-memory story index
+instead of SQL, e.g. to compare the two with --compare.
+
+Besides timings, every scenario records the bytes the process read per run
+(`rchar` of /proc/self/io: SQLite's reads of the database file, whether from
+disk or the OS cache, where available), and the meta the size of the
+database file after the runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from bench.generator import BacklogGenerator, WORDS, PRIORITIES, PERIODS, LABEL_NAMES, STATE
+from bench.mock_shortcut import MockShortcut
+
+HERD_SIZE = 20
+
+
+class Context(object):
+
+    def __init__(self, client, generator, rng, headers=None):
+        self.client = client
+        self.generator = generator
+        self.rng = rng
+        self.headers = headers or {}
+        self.bytes = []
+
+    async def get(self, path, params=None):
+        response = await self.client.get(path, params=params, headers=self.headers)
+        if response.status != 200:
+            raise RuntimeError(f'GET {path} {params} returned {response.status}: '
+                               f'{response.body[:200]!r}')
+        self.bytes.append(len(response.body))
+        return response
+
+
+async def scenario_import(ctx):
+    await ctx.get('/admin/shortcut/backlog')
+
+
+async def scenario_backlog(ctx):
+    await ctx.get('/shortcut/backlog')
+
+
+async def scenario_backlog_fields(ctx):
+    await ctx.get('/shortcut/backlog', {'fields': 'id,name,priority,period,labels'})
+
+
+async def scenario_backlog_page(ctx):
+    await ctx.get('/shortcut/backlog', {'sort[priority]': 'reverse', 'offset': 50, 'limit': 50})
+
+
+async def scenario_backlog_herd(ctx):
+    # A dashboard opened by a whole team at once: identical concurrent requests
+    await asyncio.gather(*(ctx.get('/shortcut/backlog', {'sort[priority]': 'reverse'})
+                           for _ in range(HERD_SIZE)))
+
+
+async def scenario_search(ctx):
+    await ctx.get('/shortcut/backlog', {'q': ctx.rng.choice(WORDS)})
+
+
+async def scenario_search_ranked(ctx):
+    word = ctx.rng.choice(WORDS)
+    # A typo: one letter dropped
+    position = ctx.rng.randrange(1, len(word))
+    await ctx.get('/shortcut/search', {'q': word[:position] + word[position + 1:]})
+
+
+async def scenario_filter_priority(ctx):
+    await ctx.get('/shortcut/backlog', {'filter[priority]': ctx.rng.choice(PRIORITIES)})
+
+
+async def scenario_filter_period(ctx):
+    await ctx.get('/shortcut/backlog', {'filter[period]': ctx.rng.choice(PERIODS)})
+
+
+async def scenario_filter_label(ctx):
+    await ctx.get('/shortcut/backlog', {'filter[label]': ctx.rng.choice(LABEL_NAMES)})
+
+
+async def scenario_filter_multi(ctx):
+    await ctx.get('/shortcut/backlog', {
+        'filter[label]': ','.join(ctx.rng.sample(LABEL_NAMES, 2)),
+        'filter[priority]': ctx.rng.choice(PRIORITIES),
+        'filter[person]': str(ctx.rng.randint(1, 8)),
+    })
+
+
+async def scenario_filter_updated(ctx):
+    # "Changed this week": a random week within the generated update times
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc) + timedelta(days=ctx.rng.randrange(580))
+    await ctx.get('/shortcut/backlog', {'filter[updated_from]': start.isoformat(),
+                                        'filter[updated_to]': (start + timedelta(days=7)).isoformat()})
+
+
+async def scenario_sort_name(ctx):
+    await ctx.get('/shortcut/backlog', {'sort[name]': 'forward'})
+
+
+async def scenario_sort_priority(ctx):
+    await ctx.get('/shortcut/backlog', {'sort[priority]': 'reverse'})
+
+
+async def scenario_stats(ctx):
+    await ctx.get('/shortcut/backlog/stats', {'filter[label]': ctx.rng.choice(LABEL_NAMES)})
+
+
+async def scenario_detail(ctx):
+    story = ctx.rng.choice(ctx.generator.stories())
+    await ctx.get(f'/stories/{story["id"]}')
+
+
+SCENARIOS = {
+    'import': scenario_import,
+    'backlog': scenario_backlog,
+    'backlog_fields': scenario_backlog_fields,
+    'backlog_page': scenario_backlog_page,
+    'backlog_herd': scenario_backlog_herd,
+    'search': scenario_search,
+    'search_ranked': scenario_search_ranked,
+    'filter_priority': scenario_filter_priority,
+    'filter_period': scenario_filter_period,
+    'filter_label': scenario_filter_label,
+    'filter_multi': scenario_filter_multi,
+    'filter_updated': scenario_filter_updated,
+    'sort_name': scenario_sort_name,
+    'sort_priority': scenario_sort_priority,
+    'stats': scenario_stats,
+    'detail': scenario_detail,
+}
+
+
+def seed_links(generator):
+    """Create persons, components, epic groups and products and link them to stories."""
+    from sqlalchemy import insert, select, update, func
+    from app.db import models
+    from app.db.database import SessionLocal
+
+    kinds = {
+        'persons': (models.Person, models.story_persons, 'person_id'),
+        'components': (models.Component, models.story_components, 'component_id'),
+        'epic_groups': (models.EpicGroup, models.story_epic_groups, 'epic_group_id'),
+        'products': (models.Product, models.story_products, 'product_id'),
+    }
+    linked = set()
+    with SessionLocal() as db:
+        for kind, (names, pairs) in generator.links().items():
+            model, table, column = kinds[kind]
+            items = [model(name=name) for name in names]
+            db.add_all(items)
+            db.flush()
+            if pairs:
+                db.execute(insert(table), [{'story_id': story_id, column: items[index].id}
+                                           for story_id, index in pairs])
+                linked.update(story_id for story_id, _index in pairs)
+        # As the API's link endpoints do, so that caches and the story index notice
+        version = db.execute(select(func.max(models.Story.version))).scalar() + 1
+        db.execute(update(models.Story).where(models.Story.id.in_(linked))
+                   .values(version=version))
+        db.commit()
+
+
+def read_bytes():
+    """Bytes read by the process so far, None where /proc is not available."""
+    try:
+        with open('/proc/self/io') as fh:
+            for line in fh:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def database_size(path):
+    """Size of the database file, with the write-ahead log checkpointed into it."""
+    from sqlalchemy import text
+    from app.db.database import engine
+
+    with engine.connect() as connection:
+        connection.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+    return os.path.getsize(path)
+
+
+def summarize(samples, sizes, cpu=None, io=None):
+    ordered = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.fmean(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'max': ordered[-1],
+        'bytes': int(statistics.fmean(sizes)) if sizes else 0,
+        'cpu': statistics.fmean(cpu) if cpu else None,
+        'io': int(statistics.fmean(io)) if io else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    generator = BacklogGenerator(seed=args.seed, stories=args.stories, states=args.states)
+    mock = MockShortcut(generator, latency=args.latency)
+    shortcut_url = await mock.start()
+
+    workdir = tempfile.mkdtemp(prefix='backlog-bench-')
+    database = f'{workdir}/bench.db'
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ['SHORTCUT_URL'] = shortcut_url
+    os.environ['SHORTCUT_STATES'] = ','.join(args.states)
+    os.environ.setdefault('SHORTCUT_TOKEN', 'bench')
+    os.environ['STORY_INDEX'] = 'true' if args.story_index else 'false'
+    os.environ['DESCRIPTION_COMPRESSION'] = args.description_compression
+
+    # The schema is created by the migrations in the app's lifespan
+    from app.main import app
+    from bench.asgi import ASGIClient
+
+    names = args.scenario or list(SCENARIOS)
+    results = {}
+    async with ASGIClient(app) as client:
+        headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else None
+        ctx = Context(client, generator, random.Random(args.seed), headers)
+
+        start = time.perf_counter()
+        await scenario_import(ctx)
+        results['import_initial'] = summarize([time.perf_counter() - start], ctx.bytes)
+        seed_links(generator)
+
+        for name in names:
+            scenario = SCENARIOS[name]
+            repeat = max(1, args.repeat // 5) if name == 'import' else args.repeat
+            for _ in range(args.warmup):
+                await scenario(ctx)
+            samples = []
+            cpu = []
+            io = []
+            ctx.bytes = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cpu_start = time.process_time()
+                io_start = read_bytes()
+                await scenario(ctx)
+                if io_start is not None:
+                    io.append(read_bytes() - io_start)
+                cpu.append(time.process_time() - cpu_start)
+                samples.append(time.perf_counter() - start)
+            results[name] = summarize(samples, ctx.bytes, cpu, io)
+            print(f'{name:18} median {results[name]["median"] * 1000:9.2f} ms  '
+                  f'p95 {results[name]["p95"] * 1000:9.2f} ms  '
+                  f'cpu {results[name]["cpu"] * 1000:9.2f} ms  '
+                  f'{results[name]["bytes"]:>10} bytes  '
+                  f'read {results[name]["io"] or 0:>10} bytes', file=sys.stderr)
+        database_bytes = database_size(database)
+        print(f'database {database_bytes} bytes', file=sys.stderr)
+
+    from app.db.story_index import story_index
+
+    await mock.stop()
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'seed': args.seed,
+            'stories': args.stories,
+            'latency': args.latency,
+            'states': args.states,
+            'repeat': args.repeat,
+            'accept_encoding': args.accept_encoding,
+            'shortcut_requests': mock.requests,
+            'story_index': args.story_index,
+            'story_index_bytes': story_index.size,
+            'description_compression': args.description_compression,
+            'database_bytes': database_bytes,
+        },
+        'scenarios': results,
+    }
+
+
+def compare(before_path, after_path):
+    with open(before_path) as fh:
+        before = json.load(fh)
+    with open(after_path) as fh:
+        after = json.load(fh)
+    print(f'{"scenario":18} {"before ms":>12} {"after ms":>12} {"change":>8} '
+          f'{"before read":>12} {"after read":>12}')
+    for name, result in after['scenarios'].items():
+        if name not in before['scenarios']:
+            continue
+        old = before['scenarios'][name]['median'] * 1000
+        new = result['median'] * 1000
+        change = (new - old) / old * 100 if old else 0.0
+        print(f'{name:18} {old:12.2f} {new:12.2f} {change:+7.1f}% '
+              f'{before["scenarios"][name].get("io") or 0:12} {result.get("io") or 0:12}')
+    if 'database_bytes' in before['meta'] and 'database_bytes' in after['meta']:
+        print(f'{"database bytes":18} {before["meta"]["database_bytes"]:12} '
+              f'{after["meta"]["database_bytes"]:12}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backlog report benchmarks')
+    parser.add_argument('--stories', type=int, default=1000,
+                        help='Number of synthetic stories (1k - 200k)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Mock Shortcut API latency per request in seconds')
+    parser.add_argument('--states', type=lambda value: value.split(','), default=[STATE],
+                        help='Comma separated workflow states to spread stories over')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--accept-encoding',
+                        help='Accept-Encoding header to send, e.g. "gzip, br"')
+    parser.add_argument('--story-index', action='store_true',
+                        help='Answer backlog queries from the in-memory story index')
+    parser.add_argument('--description-compression', default='none',
+                        choices=('none', 'zlib', 'zstd'),
+                        help='Codec to store story descriptions with')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, can be repeated (default: all)')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold start timing: starts the app in fresh interpreters against a throwaway
+SQLite database and reports the median time of each startup phase, until the
+first request has been answered.
+
+The first start creates the schema and is reported separately. With
+--alembic, running `alembic upgrade head` in its own interpreter, as
+start.sh used to do before starting uvicorn, is timed as well.
+
+    python -m bench.startup --runs 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from app.core.config import ROOT
+
+
+async def child():
+    from app.core.startup import startup
+    from app.main import app
+    from bench.asgi import ASGIClient
+
+    async with ASGIClient(app) as client:
+        start = time.perf_counter()
+        response = await client.get('/version')
+        first_request = time.perf_counter() - start
+    if response.status != 200:
+        raise RuntimeError(f'GET /version returned {response.status}')
+    print(json.dumps(dict(startup.phases, first_request=first_request)))
+
+
+def start(env) -> dict:
+    start_time = time.perf_counter()
+    output = subprocess.run([sys.executable, '-m', 'bench.startup', '--child'], env=env,
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return dict(json.loads(output.splitlines()[-1]), process=time.perf_counter() - start_time)
+
+
+def print_phases(title, runs: list[dict]):
+    print(title)
+    for phase in runs[0]:
+        values = [run.get(phase, 0) for run in runs]
+        print(f'  {phase:16} {statistics.median(values) * 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure app startup time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--alembic', action='store_true',
+                        help='Also time alembic upgrade head in a separate interpreter')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child())
+        return
+
+    workdir = tempfile.mkdtemp(prefix='backlog-startup-')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{workdir}/startup.db',
+               SHORTCUT_TOKEN='bench', LOG_LEVEL='WARNING')
+    print_phases('first start (creates the schema)', [start(env)])
+    print_phases(f'warm database, median of {args.runs}', [start(env) for _ in range(args.runs)])
+    if args.alembic:
+        times = []
+        for _ in range(args.runs):
+            start_time = time.perf_counter()
+            subprocess.run(['alembic', 'upgrade', 'head'], env=env, cwd=ROOT,
+                           capture_output=True, check=True)
+            times.append(time.perf_counter() - start_time)
+        print(f'alembic upgrade head, up to date: {statistics.median(times) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
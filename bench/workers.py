@@ -0,0 +1,148 @@
+"""
+Load test of the backlog endpoint with 1, 2, 4, ... uvicorn worker processes.
+
+Starts the mock Shortcut API, imports the backlog once, then for each worker
+count starts uvicorn on a shared throwaway SQLite database and keeps
+`--concurrency` clients requesting the backlog for `--duration` seconds.
+Before each measurement a few concurrent imports are started, to check that
+only one of them runs at a time (the rest get 409).
+
+    python -m bench.workers --stories 2000 --workers 1,2,4 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from app.core.config import ROOT
+from bench.generator import BacklogGenerator, STATE
+from bench.mock_shortcut import MockShortcut
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f'{url}/version') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+async def concurrent_imports(session: aiohttp.ClientSession, url: str, count=3) -> list[int]:
+    async def one():
+        async with session.get(f'{url}/admin/shortcut/backlog') as response:
+            await response.read()
+            return response.status
+    return sorted(await asyncio.gather(*(one() for _ in range(count))))
+
+
+async def load(session: aiohttp.ClientSession, url: str, params: dict, concurrency: int,
+               duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                async with session.get(f'{url}/shortcut/backlog', params=params) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+        'errors': errors,
+    }
+
+
+async def run(args):
+    mock = MockShortcut(BacklogGenerator(seed=args.seed, stories=args.stories,
+                                         states=[STATE]))
+    shortcut_url = await mock.start()
+    workdir = tempfile.mkdtemp(prefix='backlog-workers-')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{workdir}/workers.db',
+               SHORTCUT_URL=shortcut_url, SHORTCUT_STATES=STATE, SHORTCUT_TOKEN='bench',
+               LOG_LEVEL='WARNING')
+    params = dict(arg.split('=', 1) for arg in args.param)
+
+    results = {}
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=args.concurrency + 8)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        for workers in args.workers:
+            port = free_port()
+            url = f'http://127.0.0.1:{port}'
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                 '--workers', str(workers), '--log-level', 'warning', '--no-access-log'],
+                cwd=ROOT, env=env)
+            try:
+                await wait_ready(session, url)
+                imports = await concurrent_imports(session, url)
+                await load(session, url, params, args.concurrency, min(2.0, args.duration))
+                results[workers] = await load(session, url, params, args.concurrency,
+                                              args.duration)
+                results[workers]['imports'] = imports
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    await mock.stop()
+
+    print(f'{args.stories} stories, {args.concurrency} clients, {args.duration:.0f} s, '
+          f'{os.cpu_count()} CPUs, params {params or "none"}')
+    print(f'{"workers":>8} {"req/s":>8} {"speedup":>8} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"errors":>7}  concurrent imports')
+    base = results[args.workers[0]]['throughput']
+    for workers, result in results.items():
+        print(f'{workers:>8} {result["throughput"]:8.1f} {result["throughput"] / base:7.2f}x '
+              f'{result["p50"] * 1000:8.1f} {result["p95"] * 1000:8.1f} '
+              f'{result["errors"]:>7}  {result["imports"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backlog throughput per worker count')
+    parser.add_argument('--stories', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=lambda value: [int(item) for item in value.split(',')],
+                        default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--param', action='append', default=[],
+                        help='Backlog query parameter, e.g. fields=id,name,priority')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,5 +9,9 @@ else
     echo "There is no script $PRE_START_PATH"
 fi
 
-alembic upgrade head
-exec uvicorn app.main:app --host 0.0.0.0 --port 80 --no-use-colors
+# The app upgrades the database itself at startup (MIGRATE_ON_STARTUP), and
+# skips Alembic when the schema is already current
+# WORKERS > 1 runs several worker processes sharing the database. Imports are
+# serialized by a lock file next to the database, and caches follow the data
+# generation stored in it
+exec uvicorn app.main:app --host 0.0.0.0 --port 80 --no-use-colors --workers ${WORKERS:-1}
@@ -0,0 +1,67 @@
+"""
+Fixtures running the app in process against a temporary SQLite database and
+a mock Shortcut API serving generated stories.
+"""
+import os
+import socket
+import tempfile
+
+import pytest
+
+from bench.asgi import ASGIClient
+from bench.generator import BacklogGenerator
+from bench.mock_shortcut import MockShortcut
+
+# Generated stories served by the mock; their ids start at 10000
+STORIES = 100
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# The configuration is read when the app is imported, so it is set up first
+PORT = free_port()
+os.environ.update(DATABASE_URL=f'sqlite:///{tempfile.mkdtemp()}/test.db',
+                  SHORTCUT_URL=f'http://127.0.0.1:{PORT}/api/v3', SHORTCUT_TOKEN='test',
+                  SHORTCUT_STATES='A,B', SHORTCUT_WORKSPACES='default',
+                  MAINTENANCE_INTERVAL='0', STORY_INDEX='false')
+
+
+@pytest.fixture(scope='session')
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(scope='session')
+async def mock():
+    mock = MockShortcut(BacklogGenerator(stories=STORIES, states=('A', 'B')))
+    await mock.start(port=PORT)
+    yield mock
+    await mock.stop()
+
+
+@pytest.fixture(scope='session')
+async def client(mock):
+    from app.main import app
+    async with ASGIClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope='session')
+def import_backlog(client, mock):
+    """Import the first `stories` generated stories, deactivating the others."""
+    async def import_stories(stories=STORIES):
+        mock.generator = BacklogGenerator(stories=stories, states=('A', 'B'))
+        response = await client.get('/admin/shortcut/backlog')
+        assert response.status == 200, response.body
+    return import_stories
+
+
+@pytest.fixture
+async def backlog(import_backlog, mock):
+    """All generated stories imported and active."""
+    await import_backlog()
+    return mock.generator
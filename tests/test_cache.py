@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from app.core.cache import TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache('test_shared', ttl=60)
+    loads = []
+    release = asyncio.Event()
+
+    async def load():
+        loads.append(1)
+        await release.wait()
+        return 'value'
+
+    callers = [asyncio.create_task(cache.get_or_load('key', load)) for _ in range(3)]
+    await asyncio.sleep(0)
+    # A cancelled caller leaves the load to the others
+    callers[0].cancel()
+    release.set()
+    assert await asyncio.gather(*callers[1:]) == ['value', 'value']
+    assert len(loads) == 1
+    assert cache.get('key') == 'value'
+
+
+async def test_invalidated_load_is_not_stored():
+    cache = TTLCache('test_invalidated', ttl=60)
+    release = asyncio.Event()
+
+    async def old_load():
+        await release.wait()
+        return 'old'
+
+    async def new_load():
+        return 'new'
+
+    loading = asyncio.create_task(cache.get_or_load('key', old_load))
+    await asyncio.sleep(0)
+    cache.invalidate('key')
+    assert await cache.get_or_load('key', new_load) == 'new'
+    release.set()
+    assert await loading == 'old'
+    assert cache.get('key') == 'new'
@@ -0,0 +1,75 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def names(client, prefix) -> list[str]:
+    response = await client.get('/components', {'q': prefix})
+    assert response.status == 200, response.body
+    return [item['name'] for item in response.json()]
+
+
+async def test_list_cache(client):
+    # The cached lists are dropped by every write
+    assert await names(client, 'Cached') == []
+    response = await client.post('/components', {'name': 'Cached'})
+    assert response.status == 200, response.body
+    item = response.json()
+    assert await names(client, 'Cached') == ['Cached']
+    response = await client.put(f'/components/{item["id"]}', {'id': item['id'],
+                                                               'name': 'Cached renamed'})
+    assert response.status == 200, response.body
+    assert await names(client, 'Cached') == ['Cached renamed']
+    response = await client.delete(f'/components/{item["id"]}')
+    assert response.status == 200, response.body
+    assert await names(client, 'Cached') == []
+
+
+async def test_batch(client):
+    assert await names(client, 'Batch') == []
+    response = await client.post('/components', {'name': 'Batch taken'})
+    assert response.status == 200, response.body
+    taken = response.json()
+
+    response = await client.post('/components/batch', [
+        {'name': 'Batch one'}, {'name': 'Batch taken'}, {'name': 'Batch two'},
+        {'name': 'Batch one'}])
+    assert response.status == 200, response.body
+    results = response.json()
+    assert [(result['index'], result['status'], result['name']) for result in results] == [
+        (0, 'created', 'Batch one'), (1, 'conflict', 'Batch taken'),
+        (2, 'created', 'Batch two'), (3, 'conflict', 'Batch one')]
+    one, two = results[0]['id'], results[2]['id']
+    assert one and two and results[1]['id'] is None
+    assert await names(client, 'Batch') == ['Batch one', 'Batch taken', 'Batch two']
+
+    response = await client.put('/components/batch', [
+        {'id': one, 'name': 'Batch first'}, {'id': two, 'name': 'Batch taken'},
+        {'id': 999999, 'name': 'Batch missing'}, {'id': taken['id'], 'name': 'Batch taken'}])
+    assert response.status == 200, response.body
+    assert [result['status'] for result in response.json()] \
+        == ['updated', 'conflict', 'not_found', 'updated']
+    assert await names(client, 'Batch') == ['Batch first', 'Batch taken', 'Batch two']
+
+    response = await client.post('/components/batch/delete', [one, 999999, two])
+    assert response.status == 200, response.body
+    assert [result['status'] for result in response.json()] \
+        == ['deleted', 'not_found', 'deleted']
+    assert await names(client, 'Batch') == ['Batch taken']
+
+
+async def test_create_conflict(client):
+    response = await client.post('/components', {'name': 'Single'})
+    assert response.status == 200, response.body
+    item = response.json()
+
+    response = await client.post('/components', {'name': 'Single'})
+    assert response.status == 400
+    response = await client.post('/components', {'name': 'Single other'})
+    assert response.status == 200, response.body
+    response = await client.put(f'/components/{item["id"]}', {'id': item['id'],
+                                                               'name': 'Single other'})
+    assert response.status == 400
+    response = await client.put('/components/999999', {'id': 999999, 'name': 'Single gone'})
+    assert response.status == 404
+    assert await names(client, 'Single') == ['Single', 'Single other']
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update, insert, func
+
+pytestmark = pytest.mark.anyio
+
+# The last generated stories, left out of a second import and deactivated by it
+REMOVED = list(range(10095, 10100))
+
+
+async def test_purge_inactive(client, backlog, import_backlog):
+    from app.db.database import engine
+    from app.db.models import Story, story_labels
+
+    await import_backlog(backlog.story_count - len(REMOVED))
+    expired = REMOVED[:3]
+    with engine.begin() as connection:
+        connection.execute(update(Story).where(Story.id.in_(expired)).values(
+            deactivated=datetime.now(timezone.utc) - timedelta(days=100)))
+        label_id = connection.execute(select(story_labels.c.label_id).limit(1)).scalar()
+        connection.execute(insert(story_labels).values(story_id=1, label_id=label_id))
+
+    # Nothing is purged unless asked for
+    response = await client.get('/admin/maintenance')
+    assert response.status == 200, response.body
+    report = response.json()
+    assert report['purged'] == []
+    assert report['orphans']['story_labels'] == 1
+
+    response = await client.get('/admin/maintenance', {'purge_inactive_days': 90})
+    assert response.status == 200, response.body
+    assert response.json()['purged'] == expired
+
+    with engine.connect() as connection:
+        assert sorted(connection.scalars(select(Story.id).where(~Story.active))) \
+            == REMOVED[3:]
+        assert connection.scalar(select(func.count()).select_from(story_labels).where(
+            story_labels.c.story_id.in_(expired))) == 0
+    response = await client.get('/shortcut/backlog', {'fields': 'id', 'filter[active]': 'any'})
+    assert response.json()['count'] == backlog.story_count - len(expired)
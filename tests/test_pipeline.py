@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app.db.pipeline import story_rows
+
+
+def test_story_rows_parse_utc_timestamps():
+    story = {'id': 1, 'name': 'Story', 'app_url': 'https://app.shortcut.com/story/1',
+             'created_at': '2024-05-02T08:30:00Z', 'updated_at': '2024-05-03T10:15:30.123Z',
+             'labels': [{'id': 7}, {'id': 8}], 'custom_fields': [{'value_id': 'v'}]}
+    rows, custom_fields, labels = story_rows([story], {7}, 'default/A')
+    assert rows[0]['created'] == datetime(2024, 5, 2, 8, 30, tzinfo=timezone.utc)
+    assert rows[0]['updated'] == datetime(2024, 5, 3, 10, 15, 30, 123000, tzinfo=timezone.utc)
+    assert custom_fields == [{'story_id': 1, 'custom_field_value_id': 'v'}]
+    assert labels == [{'story_id': 1, 'label_id': 7}]
+
+
+@pytest.mark.anyio
+async def test_writer_failure_ends_import(client, mock, import_backlog, monkeypatch):
+    from app.db import pipeline
+    from app.routers.admin import shortcut
+
+    calls = []
+
+    def failing_stage(*args):
+        calls.append(args)
+        raise RuntimeError('disk full')
+
+    # Small queues, which the fetchers would fill up and then wait on forever
+    monkeypatch.setattr(shortcut.config, 'import_queue_size', 1)
+    monkeypatch.setattr(pipeline, 'stage', failing_stage)
+    response = await asyncio.wait_for(client.get('/admin/shortcut/backlog'), 30)
+    assert response.status == 502, response.body
+    assert response.json()['detail']['failed'] == {'default/A': 'disk full',
+                                                   'default/B': 'disk full'}
+    assert len(calls) == 1
+
+    # The import lock was released and the next import goes through
+    monkeypatch.undo()
+    await import_backlog()